@@ -0,0 +1,117 @@
+import os
+import json
+import time
+import multiprocessing as mp
+
+import numpy as np
+import torch
+
+from gcn_model import topk_by_item_chunks
+from serving import compute_final_embedding
+
+
+def checkpoint_stamp(checkpoint_path, n_layers):
+    # identifies the checkpoint the exported embeddings were propagated from
+    stat = os.stat(checkpoint_path)
+    return {'checkpoint': os.path.abspath(checkpoint_path), 'mtime': stat.st_mtime, 'size': stat.st_size, 'n_layers': n_layers}
+
+
+def export_is_current(out_dir, checkpoint_path, n_layers):
+    paths = [os.path.join(out_dir, name) for name in ['users_emb.npy', 'items_emb.npy', 'export_stamp.json']]
+    if not all(os.path.exists(path) for path in paths):
+        return False
+    with open(paths[2]) as f:
+        return json.load(f) == checkpoint_stamp(checkpoint_path, n_layers)
+
+
+def export_embedding(data_set, checkpoint_path, out_dir, n_layers=3):
+    # propagate once, final user / item embeddings as float32 .npy (read back as memmap by the workers),
+    # export_stamp.json (written last) records the checkpoint they belong to
+    os.makedirs(out_dir, exist_ok=True)
+    users_emb, items_emb = compute_final_embedding(data_set, checkpoint_path, n_layers)
+    np.save(os.path.join(out_dir, 'users_emb.npy'), users_emb.float().numpy())
+    np.save(os.path.join(out_dir, 'items_emb.npy'), items_emb.float().numpy())
+    with open(os.path.join(out_dir, 'export_stamp.json'), 'w') as f:
+        json.dump(checkpoint_stamp(checkpoint_path, n_layers), f)
+
+
+def open_outputs(out_dir, n_users, k, n_chunks, resume=True):
+    # (n_users, k) int32 item ids + float32 scores, done[chunk] is set once the rows of the chunk are flushed
+    paths = [os.path.join(out_dir, name) for name in ['topk_items.npy', 'topk_scores.npy', 'topk_done.npy']]
+    if resume and all(os.path.exists(path) for path in paths):
+        items = np.load(paths[0], mmap_mode='r+')
+        scores = np.load(paths[1], mmap_mode='r+')
+        done = np.load(paths[2], mmap_mode='r+')
+        assert items.shape == (n_users, k) and len(done) == n_chunks, 'outputs in ' + out_dir + ' have another k / chunk size, use resume=False'
+        return items, scores, done
+    items = np.lib.format.open_memmap(paths[0], mode='w+', dtype=np.int32, shape=(n_users, k))
+    scores = np.lib.format.open_memmap(paths[1], mode='w+', dtype=np.float32, shape=(n_users, k))
+    done = np.lib.format.open_memmap(paths[2], mode='w+', dtype=bool, shape=(n_chunks, ))
+    done.flush()
+    return items, scores, done
+
+
+# set before the pool forks, read by the workers
+_job = None
+_items_emb = None
+
+
+def init_worker(n_threads):
+    global _items_emb
+    torch.set_num_threads(n_threads)
+    _items_emb = torch.from_numpy(np.load(os.path.join(_job[0], 'items_emb.npy'))) # every chunk scores against all items
+
+
+def topk_job(chunk_id):
+    # top-k of the users of one chunk, seen items excluded, written straight into the output memmaps
+    out_dir, k, chunk_users, item_chunk_size, indptr, indices = _job
+    users_emb = np.load(os.path.join(out_dir, 'users_emb.npy'), mmap_mode='r')
+    start = chunk_id * chunk_users
+    end = min(start + chunk_users, len(users_emb))
+    seen_rows = torch.from_numpy(np.repeat(np.arange(end - start), np.diff(indptr[start:end + 1])))
+    seen_items = torch.from_numpy(np.asarray(indices[indptr[start]:indptr[end]], dtype=np.int64))
+    with torch.no_grad():
+        top_scores, top_items = topk_by_item_chunks(torch.from_numpy(np.array(users_emb[start:end])), _items_emb, k,
+                                                    item_chunk_size or _items_emb.shape[0], seen_rows, seen_items)
+    out_items = np.load(os.path.join(out_dir, 'topk_items.npy'), mmap_mode='r+')
+    out_scores = np.load(os.path.join(out_dir, 'topk_scores.npy'), mmap_mode='r+')
+    out_items[start:end] = top_items.numpy().astype(np.int32)
+    out_scores[start:end] = top_scores.numpy()
+    out_items.flush()
+    out_scores.flush()
+    return chunk_id, end - start
+
+
+def batch_topk(data_set, checkpoint_path, out_dir, k=20, n_layers=3, chunk_users=8192, item_chunk_size=None, n_workers=4,
+               threads_per_worker=2, resume=True):
+    # top-k of every user into out_dir/topk_items.npy / topk_scores.npy, rerun with resume=True to finish only the missing chunks;
+    # the embeddings (and every top-k row) are redone when the checkpoint changed since the export
+    global _job
+    if not (resume and export_is_current(out_dir, checkpoint_path, n_layers)):
+        if resume:
+            print('no export of', checkpoint_path, 'in', out_dir, '(or the checkpoint changed), exporting again')
+        time_start = time.time()
+        export_embedding(data_set, checkpoint_path, out_dir, n_layers)
+        resume = False # old top-k rows belong to other embeddings
+        print('propagate & export embedding time:', time.time() - time_start)
+    n_users = data_set.get_user_num()
+    k = min(k, data_set.get_item_num())
+    n_chunks = (n_users - 1) // chunk_users + 1
+    items, scores, done = open_outputs(out_dir, n_users, k, n_chunks, resume)
+    pending = np.nonzero(~done)[0].tolist()
+    print('top-%d of %d users, %d / %d chunks pending' % (k, n_users, len(pending), n_chunks))
+
+    train_csr = data_set.get_train_csr()
+    _job = (out_dir, k, chunk_users, item_chunk_size, train_csr.indptr, train_csr.indices)
+    n_done_users = 0
+    time_start = time.time()
+    with mp.get_context('fork').Pool(n_workers, initializer=init_worker, initargs=(threads_per_worker, )) as pool:
+        for chunk_id, n_chunk_users in pool.imap_unordered(topk_job, pending):
+            done[chunk_id] = True
+            done.flush()
+            n_done_users += n_chunk_users
+            elapsed = time.time() - time_start
+            print('chunk %d done, %d users, %.0f users/sec' % (chunk_id, n_done_users, n_done_users / elapsed))
+    elapsed = time.time() - time_start
+    print('batch top-k: %d users in %.1fs, %.0f users/sec' % (n_done_users, elapsed, n_done_users / max(elapsed, 1e-9)))
+    return items, scores
@@ -0,0 +1,150 @@
+import numpy as np
+import torch
+
+# numpy / torch only: DataLoader workers and LightGCN-only runs import this without dgl / networkx / struc2vec
+
+
+class TrainDatasetOnlyCF(torch.utils.data.Dataset):
+    # (user, pos, neg) samples of the train interactions, what the train DataLoader workers unpickle (no graph, no scipy)
+
+    def __init__(self, train_data, train_user_dict, n_items, n_neg=1):
+        self.train_data = train_data
+        self.train_user_dict = train_user_dict
+        self.n_items = n_items
+        self.n_neg = n_neg # negatives per (user, pos), > 1 gives neg_id of shape (n_neg, )
+
+    def __len__(self):
+        return len(self.train_data[0])
+
+    def __getitem__(self, index):
+        user_id = self.train_data[0][index]
+        pos_id = self.train_data[1][index]
+        if self.n_neg > 1:
+            neg_ids = np.random.randint(0, self.n_items, self.n_neg)
+            rejected = np.nonzero(np.isin(neg_ids, self.train_user_dict[user_id]))[0]
+            while len(rejected) > 0:
+                neg_ids[rejected] = np.random.randint(0, self.n_items, len(rejected))
+                rejected = rejected[np.isin(neg_ids[rejected], self.train_user_dict[user_id])]
+            return user_id, pos_id, neg_ids
+        while True:
+            neg_id = np.random.randint(0, self.n_items)
+            if neg_id in self.train_user_dict[user_id]:
+                continue
+            else:
+                break
+        return user_id, pos_id, neg_id
+
+
+class TestDatasetOnlyCF(torch.utils.data.Dataset):
+
+    def __init__(self, train_user_dict, test_user_dict, test_user_list, n_items):
+        self.train_user_dict = train_user_dict
+        self.test_user_dict = test_user_dict
+        self.test_user_list = test_user_list
+        self.n_items = n_items
+
+    def __len__(self):
+        return len(self.test_user_list)
+
+    def __getitem__(self, index):
+        # Problem: not traversal, but sample
+        user_id = self.test_user_list[index]
+        pos_id = self.test_user_dict[user_id][np.random.randint(0, len(self.test_user_dict[user_id]))]
+        while True:
+            neg_id = np.random.randint(0, self.n_items)
+            if neg_id in self.train_user_dict[user_id]:
+                continue
+            elif neg_id in self.test_user_dict[user_id]:
+                continue
+            else:
+                break
+        return user_id, pos_id, neg_id
+
+
+class EvaluateDatasetOnlyCF(torch.utils.data.Dataset):
+
+    def __init__(self, train_user_dict, test_user_dict, test_user_list, test_data, n_items, n_users, n_test):
+        self.train_user_dict = train_user_dict
+        self.test_user_dict = test_user_dict
+        self.test_user_list = test_user_list
+        self.n_items = n_items
+        self.n_users = n_users
+        self.n_test = n_test
+        self.test_data = test_data
+
+    def __len__(self):
+        return self.n_test
+
+    # def __getitem__(self, index): # secend version
+    #     user_id = np.random.randint(0, self.n_users)
+    #     pos_id = self.test_user_dict[user_id][np.random.randint(0, len(self.test_user_dict[user_id]))]
+    #     while True:
+    #         neg_id = np.random.randint(0, self.n_items)
+    #         if neg_id in self.train_user_dict[user_id]:
+    #             continue
+    #         elif neg_id in self.test_user_dict[user_id]:
+    #             continue
+    #         else:
+    #             break
+    #     return user_id, pos_id, neg_id
+
+    def __getitem__(self, index): # third version
+        user_id = self.test_data[0][index]
+        pos_id = self.test_data[1][index]
+        while True:
+            neg_id = np.random.randint(0, self.n_items)
+            if neg_id in self.train_user_dict[user_id]:
+                continue
+            elif neg_id in self.test_user_dict[user_id]:
+                continue
+            else:
+                break
+        return user_id, pos_id, neg_id
+
+
+class CSRUserDict():
+    # read only {user_id: item_ids} over CSR arrays (e.g. views of shared memory), rows are numpy slices, no per user objects
+
+    def __init__(self, indptr, indices):
+        self.indptr = indptr
+        self.indices = indices
+
+    def __getitem__(self, user_id):
+        return self.indices[self.indptr[user_id]:self.indptr[user_id + 1]]
+
+    def __contains__(self, user_id):
+        return 0 <= user_id < len(self.indptr) - 1 and self.indptr[user_id + 1] > self.indptr[user_id]
+
+    def get(self, user_id, default=None):
+        return self[user_id] if user_id in self else default
+
+    def keys(self):
+        return np.nonzero(np.diff(self.indptr))[0].tolist()
+
+    def __len__(self):
+        return int(np.count_nonzero(np.diff(self.indptr)))
+
+
+def load_cf_data(file_path):
+    # [users, items] int32 arrays and {user_id: [item_ids]} of an adjacency file (user item item ...)
+    cases_user = []
+    cases_item = []
+    user_dict = dict()
+
+    lines = open(file_path, 'r').readlines()
+    for l in lines:
+        tmp = l.strip()
+        inter = [int(i) for i in tmp.split()]
+
+        if len(inter) > 1:
+            user_id, item_ids = inter[0], inter[1:]
+            item_ids = list(set(item_ids))
+
+            for item_id in item_ids:
+                cases_user.append(user_id)
+                cases_item.append(item_id)
+            user_dict[user_id] = item_ids # {user_id: [item_ids]}
+
+    cases_user = np.array(cases_user, dtype=np.int32)
+    cases_item = np.array(cases_item, dtype=np.int32)
+    return [cases_user, cases_item], user_dict
@@ -1,139 +1,134 @@
+import os
 import time
 
 import dgl
 import numpy as np
-import networkx as nx
+import scipy.sparse as sp
 import torch
 from torch.utils.data import DataLoader
 
-from s2vec.struc2vec import Struc2Vec
-
-
-class TestDatasetOnlyCF(torch.utils.data.Dataset):
-
-    def __init__(self, train_user_dict, test_user_dict, test_user_list, n_items):
-        self.train_user_dict = train_user_dict
-        self.test_user_dict = test_user_dict
-        self.test_user_list = test_user_list
-        self.n_items = n_items
-
-    def __len__(self):
-        return len(self.test_user_list)
-
-    def __getitem__(self, index):
-        # Problem: not traversal, but sample
-        user_id = self.test_user_list[index]
-        pos_id = self.test_user_dict[user_id][np.random.randint(0, len(self.test_user_dict[user_id]))]
-        while True:
-            neg_id = np.random.randint(0, self.n_items)
-            if neg_id in self.train_user_dict[user_id]:
-                continue
-            elif neg_id in self.test_user_dict[user_id]:
-                continue
-            else:
-                break
-        return user_id, pos_id, neg_id
-
-
-class EvaluateDatasetOnlyCF(torch.utils.data.Dataset):
-
-    def __init__(self, train_user_dict, test_user_dict, test_user_list, test_data, n_items, n_users, n_test):
-        self.train_user_dict = train_user_dict
-        self.test_user_dict = test_user_dict
-        self.test_user_list = test_user_list
-        self.n_items = n_items
-        self.n_users = n_users
-        self.n_test = n_test
-        self.test_data = test_data
-
-    def __len__(self):
-        return self.n_test
-
-    # def __getitem__(self, index): # secend version
-    #     user_id = np.random.randint(0, self.n_users)
-    #     pos_id = self.test_user_dict[user_id][np.random.randint(0, len(self.test_user_dict[user_id]))]
-    #     while True:
-    #         neg_id = np.random.randint(0, self.n_items)
-    #         if neg_id in self.train_user_dict[user_id]:
-    #             continue
-    #         elif neg_id in self.test_user_dict[user_id]:
-    #             continue
-    #         else:
-    #             break
-    #     return user_id, pos_id, neg_id
-
-    def __getitem__(self, index): # third version
-        user_id = self.test_data[0][index]
-        pos_id = self.test_data[1][index]
-        while True:
-            neg_id = np.random.randint(0, self.n_items)
-            if neg_id in self.train_user_dict[user_id]:
-                continue
-            elif neg_id in self.test_user_dict[user_id]:
-                continue
-            else:
-                break
-        return user_id, pos_id, neg_id
+from cf_core import TrainDatasetOnlyCF, TestDatasetOnlyCF, EvaluateDatasetOnlyCF, CSRUserDict, load_cf_data
+from ingest import ingest_csr, csr_to_train_data
+from idmap import build_id_maps, group_by_user
 
 
 class DataOnlyCF(torch.utils.data.Dataset):
 
-    def __init__(self, train_data_path, test_data_path):
-        self.train_data, self.train_user_dict = self._load_cf_data(train_data_path)
-        self.test_data, self.test_user_dict = self._load_cf_data(test_data_path)
+    def __init__(self, train_data_path, test_data_path, n_neg=1, ingest_workers=0, remap_ids=False):
+        self.n_neg = n_neg # negatives per (user, pos), > 1 gives neg_id of shape (n_neg, )
+        if ingest_workers > 0:
+            # streaming chunked load straight into the CSR store (see ingest.ingest_csr), train and test,
+            # the user dicts are CSRUserDict views over the CSR arrays once the shapes are known
+            train_csr = ingest_csr(train_data_path, n_workers=ingest_workers)
+            test_csr = ingest_csr(test_data_path, n_workers=ingest_workers)
+            self.train_data = csr_to_train_data(train_csr)
+            self.test_data = csr_to_train_data(test_csr)
+            self.train_user_dict = None
+            self.test_user_dict = None
+        else:
+            self.train_data, self.train_user_dict = self._load_cf_data(train_data_path)
+            self.test_data, self.test_user_dict = self._load_cf_data(test_data_path)
+        self.user_map = None
+        self.item_map = None
+        if remap_ids:
+            # compact dense ids, translate back with user_map / item_map
+            self._remap_ids(os.path.dirname(train_data_path))
+        self.n_users, self.n_items, self.n_train, self.n_test = self._statistic_cf()
+        if ingest_workers > 0 and not remap_ids:
+            train_csr.resize((self.n_users, self.n_items)) # test ids may be larger
+            test_csr.resize((self.n_users, self.n_items))
+            self.train_csr = train_csr
+        else:
+            self.train_csr = self._build_train_csr()
+        if ingest_workers > 0:
+            if remap_ids:
+                test_csr = sp.csr_matrix((np.ones(self.n_test, dtype=np.float32), (self.test_data[0], self.test_data[1])), shape=(self.n_users, self.n_items))
+            self.train_user_dict = CSRUserDict(self.train_csr.indptr, self.train_csr.indices)
+            self.test_user_dict = CSRUserDict(test_csr.indptr, test_csr.indices)
         self.train_user_list = list(self.train_user_dict.keys())
         self.test_user_list = list(self.test_user_dict.keys())
-        self.n_users, self.n_items, self.n_train, self.n_test = self._statistic_cf()
         self.G = self._build_interaction_graph()
 
     def _load_cf_data(self, file_path):
-        cases_user = []
-        cases_item = []
-        user_dict = dict()
-
-        lines = open(file_path, 'r').readlines()
-        for l in lines:
-            tmp = l.strip()
-            inter = [int(i) for i in tmp.split()]
-
-            if len(inter) > 1:
-                user_id, item_ids = inter[0], inter[1:]
-                item_ids = list(set(item_ids))
-
-                for item_id in item_ids:
-                    cases_user.append(user_id)
-                    cases_item.append(item_id)
-                user_dict[user_id] = item_ids # {user_id: [item_ids]}
-
-        cases_user = np.array(cases_user, dtype=np.int32)
-        cases_item = np.array(cases_item, dtype=np.int32)
-        return [cases_user, cases_item], user_dict
+        return load_cf_data(file_path)
 
     def _statistic_cf(self):
-        n_users = max(max(self.train_data[0]), max(self.test_data[0])) + 1
-        n_items = max(max(self.train_data[1]), max(self.test_data[1])) + 1
+        n_users = int(max(self.train_data[0].max(), self.test_data[0].max())) + 1
+        n_items = int(max(self.train_data[1].max(), self.test_data[1].max())) + 1
         n_train = len(self.train_data[0])
         n_test = len(self.test_data[0])
         return n_users, n_items, n_train, n_test
 
+    def _remap_ids(self, data_dir):
+        # only ids with training edges are kept, test interactions of the other ids are dropped
+        self.user_map, self.item_map = build_id_maps(self.train_data, data_dir)
+        self.train_data = [self.user_map.to_dense(self.train_data[0]).astype(np.int32), self.item_map.to_dense(self.train_data[1]).astype(np.int32)]
+        test_users = self.user_map.to_dense(self.test_data[0])
+        test_items = self.item_map.to_dense(self.test_data[1])
+        keep = (test_users >= 0) & (test_items >= 0)
+        self.test_data = [test_users[keep].astype(np.int32), test_items[keep].astype(np.int32)]
+        self.train_user_dict = group_by_user(self.train_data[0], self.train_data[1])
+        self.test_user_dict = group_by_user(self.test_data[0], self.test_data[1])
+        print('id remap: users', len(self.user_map), ', items', len(self.item_map), ', test interactions dropped', int(np.sum(~keep)))
+
+    def _build_train_csr(self):
+        # user -> items, shape (n_users, n_items)
+        values = np.ones(len(self.train_data[0]), dtype=np.float32)
+        return sp.csr_matrix((values, (self.train_data[0], self.train_data[1])), shape=(self.n_users, self.n_items))
+
     def _build_interaction_graph(self):
-        n_nodes = self.n_users + self.n_items
-        g = dgl.DGLGraph()
-        g.add_nodes(n_nodes)
-        # item id start from self.n_users
-        g.add_edges(self.train_data[0], self.train_data[1] + self.n_users)
-        g.add_edges(self.train_data[1] + self.n_users, self.train_data[0])
-        g.readonly()
-        g.ndata['id'] = torch.arange(n_nodes, dtype=torch.long)
-        g.ndata['sqrt_degree'] = 1 / torch.sqrt(g.out_degrees().float().unsqueeze(-1))
-        return g
-
-    def build_struc_graphs(self, mode=0, mode3_layers=[-1]):
+        return build_interaction_graph(self.train_data[0], self.train_data[1], self.n_users, self.n_items)
+
+    def reorder_nodes(self, user_old2new, item_old2new):
+        # relabel users and items in place, see reorder.NodeOrder
+        assert self.user_map is None, 'id maps do not follow a reorder'
+        self.train_data = [user_old2new[self.train_data[0]].astype(np.int32), item_old2new[self.train_data[1]].astype(np.int32)]
+        self.test_data = [user_old2new[self.test_data[0]].astype(np.int32), item_old2new[self.test_data[1]].astype(np.int32)]
+        self.train_user_dict = {user_old2new[u].item(): item_old2new[items].tolist() for u, items in self.train_user_dict.items()}
+        self.test_user_dict = {user_old2new[u].item(): item_old2new[items].tolist() for u, items in self.test_user_dict.items()}
+        self.train_user_list = list(self.train_user_dict.keys())
+        self.test_user_list = list(self.test_user_dict.keys())
+        self.train_csr = self._build_train_csr()
+        self.G = self._build_interaction_graph()
+
+    def append_interactions(self, user_ids, item_ids):
+        # add (user, item) train edges, new ids grow n_users / n_items, return the edges really added
+        assert self.user_map is None, 'id maps do not follow appended ids'
+        assert isinstance(self.train_user_dict, dict), 'ingested (CSR) train data is read only, load without ingest_workers to append'
+        user_ids = np.asarray(user_ids, dtype=np.int32)
+        item_ids = np.asarray(item_ids, dtype=np.int32)
+        new_users = []
+        new_items = []
+        for user_id, item_id in zip(user_ids.tolist(), item_ids.tolist()):
+            items = self.train_user_dict.setdefault(user_id, [])
+            if item_id in items:
+                continue
+            items.append(item_id)
+            new_users.append(user_id)
+            new_items.append(item_id)
+        new_users = np.array(new_users, dtype=np.int32)
+        new_items = np.array(new_items, dtype=np.int32)
+        if len(new_users) == 0:
+            return new_users, new_items
+
+        self.train_data = [np.concatenate((self.train_data[0], new_users)), np.concatenate((self.train_data[1], new_items))]
+        self.train_user_list = list(self.train_user_dict.keys())
+        self.n_users = max(self.n_users, new_users.max().item() + 1)
+        self.n_items = max(self.n_items, new_items.max().item() + 1)
+        self.n_train = len(self.train_data[0])
+        self.train_csr = self._build_train_csr()
+        self.G = self._build_interaction_graph()
+        return new_users, new_items
+
+    def build_struc_graphs(self, mode=0, mode3_layers=[-1], engine='dtw'):
+        # networkx / struc2vec (pandas, fastdtw, joblib, ...) are only imported when struc graphs are requested
+        import networkx as nx
+        from s2vec.struc2vec import Struc2Vec
         nx_rec_g = nx.Graph()
         nx_rec_g.add_nodes_from(range(self.n_users + self.n_items))
         edges = np.concatenate((self.train_data[0].reshape(-1, 1), self.train_data[1].reshape(-1, 1) + self.n_users), 1)
         nx_rec_g.add_edges_from(edges)
-        s2v = Struc2Vec(nx_rec_g, self.n_users, workers=4, verbose=40, opt3_num_layers=3, reuse=True)
+        s2v = Struc2Vec(nx_rec_g, self.n_users, workers=4, verbose=40, opt3_num_layers=3, reuse=True, engine=engine)
         if mode == 0: # general
             g_list = s2v.get_struc_graphs()
         elif mode == 1: # sumed
@@ -173,16 +168,8 @@ class DataOnlyCF(torch.utils.data.Dataset):
     #             break
     #     return user_id, pos_id, neg_id
 
-    def __getitem__(self, index): # third version
-        user_id = self.train_data[0][index]
-        pos_id = self.train_data[1][index]
-        while True:
-            neg_id = np.random.randint(0, self.n_items)
-            if neg_id in self.train_user_dict[user_id]:
-                continue
-            else:
-                break
-        return user_id, pos_id, neg_id
+    def __getitem__(self, index): # third version, see cf_core.TrainDatasetOnlyCF
+        return TrainDatasetOnlyCF.__getitem__(self, index)
 
     def get_interaction_graph(self):
         return self.G
@@ -196,12 +183,91 @@ class DataOnlyCF(torch.utils.data.Dataset):
     def get_train_data(self):
         return self.train_data
 
+    def get_train_csr(self):
+        return self.train_csr
+
+    def get_node_degrees(self):
+        # training degree of users then items, same order as the graph nodes
+        user_degrees = np.diff(self.train_csr.indptr)
+        item_degrees = np.bincount(self.train_csr.indices, minlength=self.n_items)
+        return np.concatenate((user_degrees, item_degrees))
+
+    def get_id_maps(self):
+        # (user_map, item_map) of remap_ids, None without remapping
+        return self.user_map, self.item_map
+
+    def get_train_dataset(self):
+        # the train samples without the graphs, for DataLoader workers
+        return TrainDatasetOnlyCF(self.train_data, self.train_user_dict, self.n_items, self.n_neg)
+
     def get_evaluate_dataset(self):
         return EvaluateDatasetOnlyCF(self.train_user_dict, self.test_user_dict, self.test_user_list, self.test_data, self.n_items, self.n_users, self.n_test)
 
     def get_test_dataset(self):
         return TestDatasetOnlyCF(self.train_user_dict, self.test_user_dict, self.test_user_list, self.n_items)
 
+    def share_arrays(self):
+        # train / test interactions and CSR arrays copied once into torch shared memory, a spawned process maps them
+        # through SharedDataCF instead of receiving the python dicts
+        test_csr = sp.csr_matrix((np.ones(self.n_test, dtype=np.float32), (self.test_data[0], self.test_data[1])), shape=(self.n_users, self.n_items))
+        arrays = {'train_users': self.train_data[0], 'train_items': self.train_data[1], 'test_users': self.test_data[0], 'test_items': self.test_data[1],
+                  'train_indptr': self.train_csr.indptr, 'train_indices': self.train_csr.indices, 'train_values': self.train_csr.data,
+                  'test_indptr': test_csr.indptr, 'test_indices': test_csr.indices}
+        arrays = {name: torch.from_numpy(np.ascontiguousarray(array)).share_memory_() for name, array in arrays.items()}
+        arrays['n_users'] = int(self.n_users)
+        arrays['n_items'] = int(self.n_items)
+        return arrays
+
+
+class SharedDataCF(DataOnlyCF):
+    # DataOnlyCF over share_arrays, train_user_dict / test_user_dict are CSR row lookups (numpy rows, not lists)
+
+    def __init__(self, arrays, n_neg=1):
+        self.n_neg = n_neg
+        self.n_users = arrays['n_users']
+        self.n_items = arrays['n_items']
+        self.train_data = [arrays['train_users'].numpy(), arrays['train_items'].numpy()]
+        self.test_data = [arrays['test_users'].numpy(), arrays['test_items'].numpy()]
+        self.n_train = len(self.train_data[0])
+        self.n_test = len(self.test_data[0])
+        self.train_csr = sp.csr_matrix((arrays['train_values'].numpy(), arrays['train_indices'].numpy(), arrays['train_indptr'].numpy()),
+                                       shape=(self.n_users, self.n_items), copy=False)
+        self.train_user_dict = CSRUserDict(self.train_csr.indptr, self.train_csr.indices)
+        self.test_user_dict = CSRUserDict(arrays['test_indptr'].numpy(), arrays['test_indices'].numpy())
+        self.train_user_list = self.train_user_dict.keys()
+        self.test_user_list = self.test_user_dict.keys()
+        self.G = build_interaction_graph(self.train_data[0], self.train_data[1], self.n_users, self.n_items)
+        self.user_map = None
+        self.item_map = None
+
+
+def build_interaction_graph(users, items, n_users, n_items):
+    n_nodes = n_users + n_items
+    g = dgl.DGLGraph()
+    g.add_nodes(n_nodes)
+    # item id start from n_users
+    g.add_edges(users, items + n_users)
+    g.add_edges(items + n_users, users)
+    g.readonly()
+    g.ndata['id'] = torch.arange(n_nodes, dtype=torch.long)
+    g.ndata['sqrt_degree'] = 1 / torch.sqrt(g.out_degrees().float().clamp(min=1).unsqueeze(-1)) # isolated nodes get 1, not inf
+    return g
+
+
+def build_struc_graph(n_nodes, src, dst, weight):
+    # struc graph of Struc2Vec.get_pruned_struc_graph from its edges, e.g. shared with a spawned process
+    g = dgl.DGLGraph()
+    g.add_nodes(n_nodes)
+    g.add_edges(src, dst)
+    g.readonly()
+    g.ndata['id'] = torch.arange(n_nodes, dtype=torch.long)
+    g.edata['weight'] = weight
+    g.ndata['out_sqrt_degree'] = 1 / torch.sqrt(g.out_degrees().float().unsqueeze(-1))
+    g.ndata['in_sqrt_degree'] = 1 / torch.sqrt(g.in_degrees().float().unsqueeze(-1))
+    g.ndata['out_sqrt_degree'][torch.isinf(g.ndata['out_sqrt_degree'])] = 0
+    g.ndata['in_sqrt_degree'][torch.isinf(g.ndata['in_sqrt_degree'])] = 0
+    return g
+
 
 if __name__ == "__main__":
     data = DataOnlyCF('data/amazon-book/train.txt', 'data/amazon-book/test.txt')
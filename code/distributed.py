@@ -0,0 +1,198 @@
+import dgl
+import numpy as np
+import scipy.sparse as sp
+import torch
+import torch.nn as nn
+import torch.distributed as dist
+from scipy.sparse.csgraph import reverse_cuthill_mckee
+
+
+def partition_nodes(train_csr, n_parts, method='bfs'):
+    # part of every node (users then items); metis and bfs keep neighbors together so the edge cut (and the halo) stays small
+    adj = sp.bmat([[None, train_csr], [train_csr.T, None]], format='csr')
+    degrees = np.diff(adj.indptr)
+    if method == 'metis' and not hasattr(dgl, 'metis_partition_assignment'):
+        print('dgl', dgl.__version__, 'has no metis_partition_assignment (dgl >= 0.5), partition with bfs instead')
+        method = 'bfs'
+    if method == 'metis':
+        # k-way metis (dgl >= 0.5), balanced on nodes and edges
+        adj = adj.tocoo()
+        g = dgl.DGLGraph()
+        g.add_nodes(adj.shape[0])
+        g.add_edges(torch.from_numpy(adj.row.astype(np.int64)), torch.from_numpy(adj.col.astype(np.int64)))
+        g.readonly()
+        parts = dgl.metis_partition_assignment(g, n_parts, balance_edges=True).numpy().astype(np.int64)
+    elif method == 'bfs':
+        # locality grown: reverse Cuthill-McKee (BFS) order cut into contiguous runs of equal degree + 1 load
+        order = reverse_cuthill_mckee(adj, symmetric_mode=True)
+        load = np.cumsum(degrees[order] + 1)
+        parts = np.zeros(len(degrees), dtype=np.int64)
+        parts[order] = np.minimum(((load - 1) * n_parts) // load[-1], n_parts - 1)
+    elif method == 'snake':
+        # deal degree sorted nodes in snake order, balanced but the edge cut is random (baseline)
+        order = np.argsort(-degrees, kind='stable')
+        rounds = np.arange(len(order)) // n_parts
+        pos = np.arange(len(order)) % n_parts
+        parts = np.zeros(len(degrees), dtype=np.int64)
+        parts[order] = np.where(rounds % 2 == 0, pos, n_parts - 1 - pos)
+    else:
+        assert False, 'not support this method in partition_nodes: ' + str(method)
+    return parts
+
+
+def edge_cut_fraction(train_csr, parts):
+    # share of interactions whose user and item are on different parts
+    n_users = train_csr.shape[0]
+    users = np.repeat(np.arange(n_users), np.diff(train_csr.indptr))
+    return np.mean(parts[users] != parts[train_csr.indices + n_users]).item() if len(users) > 0 else 0.0
+
+
+class HaloPlan():
+
+    def __init__(self, src, dst, parts, rank, world_size):
+        # src / dst: global node ids of the directed edges (both directions of each interaction)
+        self.rank = rank
+        self.world_size = world_size
+        self.own = np.nonzero(parts == rank)[0] # sorted global ids, local id = position
+        self.n_own = len(self.own)
+        self.send_index = {} # peer -> local ids of my rows the peer needs
+        self.recv_offset = {} # peer -> (start, end) in the halo buffer
+        halo_list = []
+        for p in range(world_size):
+            if p == rank:
+                continue
+            send_nodes = np.unique(src[(parts[src] == rank) & (parts[dst] == p)])
+            recv_nodes = np.unique(src[(parts[src] == p) & (parts[dst] == rank)]) # same order as the peer sends them
+            self.send_index[p] = torch.from_numpy(np.searchsorted(self.own, send_nodes))
+            self.recv_offset[p] = (sum(len(h) for h in halo_list), sum(len(h) for h in halo_list) + len(recv_nodes))
+            halo_list.append(recv_nodes)
+        self.halo = np.concatenate(halo_list) if len(halo_list) > 0 else np.zeros(0, dtype=np.int64)
+        self.n_halo = len(self.halo)
+        self.sent_bytes = 0 # communication volume counter
+
+    def exchange(self, send_rows, n_recv_rows, recv_slices):
+        # point to point exchange with every peer that shares a boundary
+        recv_bufs = {}
+        reqs = []
+        for p, (start, end) in recv_slices.items():
+            if end > start:
+                recv_bufs[p] = torch.empty((end - start, ) + send_rows.shape[1:], dtype=send_rows.dtype)
+                reqs.append(dist.irecv(recv_bufs[p], src=p))
+        for p, index in self.send_index.items():
+            if len(index) > 0:
+                rows = send_rows[index].contiguous()
+                self.sent_bytes += rows.numel() * rows.element_size()
+                reqs.append(dist.isend(rows, dst=p))
+        for req in reqs:
+            req.wait()
+        out = torch.zeros((n_recv_rows, ) + send_rows.shape[1:], dtype=send_rows.dtype)
+        for p, buf in recv_bufs.items():
+            start, end = recv_slices[p]
+            out[start:end] = buf
+        return out
+
+
+class HaloExchange(torch.autograd.Function):
+
+    @staticmethod
+    def forward(ctx, own_embed, plan):
+        # rows of my halo nodes from their owners
+        ctx.plan = plan
+        return plan.exchange(own_embed.detach(), plan.n_halo, plan.recv_offset)
+
+    @staticmethod
+    def backward(ctx, grad_halo):
+        # reverse direction: halo grads go back to the owners and are added to the sent rows
+        plan = ctx.plan
+        recv_bufs = {}
+        reqs = []
+        for p, index in plan.send_index.items():
+            if len(index) > 0:
+                recv_bufs[p] = torch.empty((len(index), ) + grad_halo.shape[1:], dtype=grad_halo.dtype)
+                reqs.append(dist.irecv(recv_bufs[p], src=p))
+        for p, (start, end) in plan.recv_offset.items():
+            if end > start:
+                rows = grad_halo[start:end].contiguous()
+                plan.sent_bytes += rows.numel() * rows.element_size()
+                reqs.append(dist.isend(rows, dst=p))
+        for req in reqs:
+            req.wait()
+        grad_own = torch.zeros((plan.n_own, ) + grad_halo.shape[1:], dtype=grad_halo.dtype)
+        for p, buf in recv_bufs.items():
+            grad_own.index_add_(0, plan.send_index[p], buf)
+        return grad_own, None
+
+
+class PartitionedLightGCN(nn.Module):
+
+    def __init__(self, n_users, n_items, train_data, parts, rank, world_size, embed_dim=64, n_layers=3, lam=1e-4):
+        super(PartitionedLightGCN, self).__init__()
+        self.n_users = n_users
+        self.n_items = n_items
+        self.n_layers = n_layers
+        self.lam = lam
+        n_nodes = n_users + n_items
+        users = train_data[0].astype(np.int64)
+        items = train_data[1].astype(np.int64) + n_users
+        src = np.concatenate((users, items))
+        dst = np.concatenate((items, users))
+        self.plan = HaloPlan(src, dst, parts, rank, world_size)
+
+        degrees = np.bincount(src, minlength=n_nodes).astype(np.float32)
+        sqrt_degree = np.zeros(n_nodes, dtype=np.float32)
+        sqrt_degree[degrees > 0] = 1 / np.sqrt(degrees[degrees > 0])
+        # local rows: [own, halo]
+        global2local = np.full(n_nodes, -1, dtype=np.int64)
+        global2local[self.plan.own] = np.arange(self.plan.n_own)
+        global2local[self.plan.halo] = self.plan.n_own + np.arange(self.plan.n_halo)
+        self.global2local = global2local
+        mask = parts[dst] == rank
+        index = torch.from_numpy(np.stack((global2local[dst[mask]], global2local[src[mask]])))
+        values = torch.from_numpy(sqrt_degree[dst[mask]] * sqrt_degree[src[mask]])
+        self.adj = torch.sparse_coo_tensor(index, values, (self.plan.n_own, self.plan.n_own + self.plan.n_halo)).coalesce()
+
+        # owned rows only, same init range as the full xavier table
+        self.embedding_own = nn.Embedding(self.plan.n_own, embed_dim)
+        bound = np.sqrt(6 / (n_nodes + embed_dim))
+        nn.init.uniform_(self.embedding_own.weight, -bound, bound)
+
+    def propagate_embedding(self):
+        # final embedding of [own, halo] rows, plus the ego rows of [own, halo] for the regularizer
+        ego_embed = self.embedding_own.weight
+        all_embed = [ego_embed]
+        ego_halo = None
+        for k in range(self.n_layers):
+            halo = HaloExchange.apply(all_embed[-1], self.plan)
+            if ego_halo is None:
+                ego_halo = halo
+            all_embed.append(torch.sparse.mm(self.adj, torch.cat([all_embed[-1], halo])))
+        propagated_own = torch.mean(torch.stack(all_embed, dim=-1), dim=-1)
+        propagated_halo = HaloExchange.apply(propagated_own, self.plan)
+        return torch.cat([propagated_own, propagated_halo]), torch.cat([ego_embed, ego_halo])
+
+    def bpr_loss(self, users, pos, neg):
+        # local row ids
+        propagated_embed, ego_embed = self.propagate_embedding()
+        reg_loss = ego_embed[users].norm(2).pow(2) + ego_embed[pos].norm(2).pow(2) + ego_embed[neg].norm(2).pow(2)
+        users_emb = propagated_embed[users]
+        pos_scores = torch.sum(users_emb * propagated_embed[pos], dim=1)
+        neg_scores = torch.sum(users_emb * propagated_embed[neg], dim=1)
+        loss = torch.mean(nn.functional.softplus(neg_scores - pos_scores))
+        reg_loss = (1/2) * reg_loss / float(len(users))
+        return loss + self.lam * reg_loss
+
+    def gather_propagated_embedding(self, parts):
+        # full (n_users + n_items, dim) propagated table on every rank
+        with torch.no_grad():
+            propagated_own = self.propagate_embedding()[0][:self.plan.n_own]
+        n_max = torch.tensor([self.plan.n_own])
+        dist.all_reduce(n_max, op=dist.ReduceOp.MAX)
+        padded = torch.zeros(n_max.item(), propagated_own.shape[1])
+        padded[:self.plan.n_own] = propagated_own
+        gathered = [torch.zeros_like(padded) for p in range(self.plan.world_size)]
+        dist.all_gather(gathered, padded)
+        table = torch.zeros(len(parts), propagated_own.shape[1])
+        for p in range(self.plan.world_size):
+            own_p = np.nonzero(parts == p)[0]
+            table[torch.from_numpy(own_p)] = gathered[p][:len(own_p)]
+        return table
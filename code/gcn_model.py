@@ -1,7 +1,10 @@
+import math
+
 import dgl
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from torch.utils.checkpoint import checkpoint
 import numpy as np
 
 
@@ -82,9 +85,78 @@ class Aggregator(nn.Module):
         return out
 
 
+class CompressedEmbedding(nn.Module):
+
+    def __init__(self, num_embeddings, embedding_dim, low_degree_mask, n_buckets=10000, low_dim=16):
+        # nodes in low_degree_mask share n_buckets hashed rows of low_dim, projected up to embedding_dim
+        super(CompressedEmbedding, self).__init__()
+        self.num_embeddings = num_embeddings
+        self.embedding_dim = embedding_dim
+        low_degree_mask = torch.as_tensor(low_degree_mask, dtype=torch.bool)
+        n_full = int((~low_degree_mask).sum())
+        n_buckets = min(n_buckets, max(int(low_degree_mask.sum()), 1))
+
+        row_index = torch.zeros(num_embeddings, dtype=torch.long)
+        row_index[~low_degree_mask] = torch.arange(n_full, dtype=torch.long)
+        low_ids = torch.nonzero(low_degree_mask).squeeze(-1)
+        row_index[low_ids] = (low_ids * 2654435761) % (2 ** 32) % n_buckets # multiplicative hash
+        self.register_buffer('row_index', row_index)
+        self.register_buffer('is_low', low_degree_mask)
+
+        self.full = nn.Embedding(n_full, embedding_dim)
+        self.bucket = nn.Embedding(n_buckets, low_dim)
+        if low_dim == embedding_dim:
+            self.proj = None # hashing only
+        else:
+            self.proj = nn.Linear(low_dim, embedding_dim, bias=False)
+        nn.init.xavier_uniform_(self.full.weight, gain=1)
+        nn.init.xavier_uniform_(self.bucket.weight, gain=1)
+
+    def forward(self, ids):
+        rows = self.row_index[ids]
+        low = self.is_low[ids]
+        out = torch.zeros(ids.shape + (self.embedding_dim,), dtype=self.full.weight.dtype, device=self.full.weight.device)
+        out[~low] = self.full(rows[~low])
+        low_embed = self.bucket(rows[low])
+        out[low] = low_embed if self.proj is None else self.proj(low_embed)
+        return out
+
+    def get_full_table(self):
+        return self.forward(torch.arange(self.num_embeddings, device=self.row_index.device))
+
+    def load_full_table(self, table):
+        # full rows are copied, buckets take the mean of their nodes; with a projection, bucket rows and proj are the
+        # least squares fit of the low degree rows: count weighted truncated SVD of the bucket means
+        self.full.weight.data = table[~self.is_low].clone()
+        low_ids = torch.nonzero(self.is_low).squeeze(-1)
+        if len(low_ids) == 0:
+            return
+        buckets = self.row_index[low_ids]
+        bucket_sum = torch.zeros(self.bucket.num_embeddings, self.embedding_dim, device=table.device).index_add_(0, buckets, table[low_ids].float())
+        bucket_count = torch.zeros(len(bucket_sum), device=table.device).index_add_(0, buckets, torch.ones(len(buckets), device=table.device))
+        bucket_mean = bucket_sum / bucket_count.clamp(min=1).unsqueeze(-1)
+        if self.proj is None:
+            self.bucket.weight.data = bucket_mean
+            return
+        low_dim = self.bucket.embedding_dim
+        weight = bucket_count.sqrt().unsqueeze(-1)
+        U, S, V = torch.svd(bucket_mean * weight) # (n_buckets, r), (r, ), (embedding_dim, r)
+        k = min(low_dim, len(S))
+        bucket_rows = torch.zeros(len(bucket_mean), low_dim, device=table.device)
+        proj_weight = torch.zeros(self.embedding_dim, low_dim, device=table.device)
+        # singular values split evenly between the bucket rows and proj
+        bucket_rows[:, :k] = U[:, :k] * S[:k].sqrt() / weight.clamp(min=1)
+        proj_weight[:, :k] = V[:, :k] * S[:k].sqrt()
+        self.bucket.weight.data = bucket_rows
+        self.proj.weight.data = proj_weight
+        with torch.no_grad():
+            error = (self.proj(self.bucket(buckets)) - table[low_ids].float()).norm() / table[low_ids].float().norm().clamp(min=1e-12)
+        print('compressed embedding: %d low degree rows fitted to %d buckets of dim %d, relative error %.3f' % (len(low_ids), len(bucket_mean), low_dim, error.item()))
+
+
 class CFGCN(nn.Module):
 
-    def __init__(self, n_users, n_items, itra_G, struc_Gs=None, embed_dim=64, n_layers=3, lam=0.001, weighted_fuse=False, combine_mode=0, aggregator_type='gcn'):
+    def __init__(self, n_users, n_items, itra_G, struc_Gs=None, embed_dim=64, n_layers=3, lam=0.001, weighted_fuse=False, combine_mode=0, aggregator_type='gcn', use_bf16=False, fuse_struc=False, neg_loss='mean', node_degrees=None, low_degree_quantile=0.0, n_buckets=10000, low_dim=16, recompute=None):
         super(CFGCN, self).__init__()
 
         self.n_users = n_users
@@ -96,9 +168,25 @@ class CFGCN(nn.Module):
         self.struc_Gs = struc_Gs
         self.f = nn.Sigmoid()
         self.combine_mode = combine_mode
-
-        self.embedding_user_item_itra = torch.nn.Embedding(num_embeddings=self.n_users + self.n_items, embedding_dim=self.embed_dim)
-        nn.init.xavier_uniform_(self.embedding_user_item_itra.weight, gain=1)
+        # bfloat16 Aggregator Linear & scoring matmul (autocast); the DGL messages stay float32 (the builtin kernels of
+        # DGL 0.4 are float32 / float64 only), as do the table, loss and optimizer state
+        self.use_bf16 = use_bf16
+        # loss over the n_neg negatives of each (user, pos): mean (averaged bpr), max (bpr of the hardest), softmax (sampled softmax)
+        self.neg_loss = neg_loss
+        # activation checkpointing while training: None (keep every layer), 'layer' (keep layer outputs, recompute
+        # the aggregator intermediates), 'graph' (keep the ego / propagated table of each graph, recompute the whole graph)
+        assert recompute in [None, 'layer', 'graph'], 'not support this recompute mode: ' + str(recompute)
+        self.recompute = recompute
+
+        if node_degrees is not None and low_degree_quantile > 0:
+            # nodes under the degree quantile (of the training CSR) get hashed / low dim rows
+            # np.quantile: torch.quantile is limited to 2 ** 24 elements
+            node_degrees = torch.as_tensor(node_degrees)
+            degree_threshold = np.quantile(node_degrees.cpu().numpy(), low_degree_quantile).item()
+            self.embedding_user_item_itra = CompressedEmbedding(self.n_users + self.n_items, self.embed_dim, node_degrees <= degree_threshold, n_buckets, low_dim)
+        else:
+            self.embedding_user_item_itra = torch.nn.Embedding(num_embeddings=self.n_users + self.n_items, embedding_dim=self.embed_dim)
+            nn.init.xavier_uniform_(self.embedding_user_item_itra.weight, gain=1)
         # nn.init.normal_(self.embedding_user_item_itra.weight, std=0.1)
         self.aggregate_layers_itra = []
         for k in range(self.n_layers):
@@ -128,7 +216,7 @@ class CFGCN(nn.Module):
             nn.init.constant_(self.layers_weight[0], 1)
 
         # Try to use GCN with parameter
-        conv_dim_list = [64, 64, 64, 64]
+        conv_dim_list = [64] * (self.n_layers + 1)
         aggregator_layers = nn.ModuleList()
         for k in range(self.n_layers):
             aggregator_layers.append(Aggregator(conv_dim_list[k], conv_dim_list[k + 1], aggregator_type))
@@ -136,14 +224,45 @@ class CFGCN(nn.Module):
         # self.aggregate_layers_itra = aggregator_layers
         # self.aggregate_layers_itra_p = aggregator_layers
 
+        # propagate all struc graphs as one block diagonal graph (one sparse pass per layer)
+        if fuse_struc and self.struc_Gs is not None:
+            self.fused_struc_G = build_fused_struc_graph(self.struc_Gs)
+        else:
+            self.fused_struc_G = None
+
     def load_pretrained_embedding(self, pretrained_data):
         assert pretrained_data.shape[0] == self.n_users + self.n_items
         assert pretrained_data.shape[1] == self.embed_dim
-        self.embedding_user_item_itra.weight.data = pretrained_data
+        if isinstance(self.embedding_user_item_itra, CompressedEmbedding):
+            self.embedding_user_item_itra.load_full_table(pretrained_data)
+        else:
+            self.embedding_user_item_itra.weight.data = pretrained_data
 
     def get_pretrained_embedding(self):
+        if isinstance(self.embedding_user_item_itra, CompressedEmbedding):
+            return self.embedding_user_item_itra.get_full_table().detach()
         return self.embedding_user_item_itra.weight.data
 
+    def grow_embedding(self, n_users, n_items, itra_G):
+        # keep trained rows, item rows move because item node id = n_users + item_id
+        assert self.struc_Gs is None, 'struc graphs must be rebuilt after new interactions'
+        assert not isinstance(self.embedding_user_item_itra, CompressedEmbedding)
+        assert n_users >= self.n_users and n_items >= self.n_items
+        old_weight = self.embedding_user_item_itra.weight.data
+        embedding = torch.nn.Embedding(num_embeddings=n_users + n_items, embedding_dim=self.embed_dim).to(old_weight.device)
+        nn.init.xavier_uniform_(embedding.weight, gain=1)
+        embedding.weight.data[:self.n_users] = old_weight[:self.n_users]
+        embedding.weight.data[n_users:n_users + self.n_items] = old_weight[self.n_users:]
+        self.embedding_user_item_itra = embedding
+        self.n_users = n_users
+        self.n_items = n_items
+        self.itra_G = itra_G
+
+    def low_precision_context(self):
+        # autocast covers the nn.Linear of Aggregator and the scoring matmul
+        device_type = next(self.embedding_user_item_itra.parameters()).device.type
+        return torch.autocast(device_type=device_type, dtype=torch.bfloat16, enabled=self.use_bf16)
+
     def bpr_loss(self, users, pos, neg, use_dummy_gcn=False, use_struc=None):
         if use_dummy_gcn:
             propagate_func = self.dummy_propagate_embedding
@@ -151,11 +270,14 @@ class CFGCN(nn.Module):
             propagate_func = self.propagate_embedding
         if use_struc is None:
             use_struc = self.struc_Gs is not None
+        if neg.dim() == 1:
+            neg = neg.unsqueeze(-1) # (batch_size, n_neg)
+        n_neg = neg.shape[1]
 
         users_emb_itra_ego = self.embedding_user_item_itra(users.long())
         pos_emb_itra_ego   = self.embedding_user_item_itra(pos.long() + self.n_users)
         neg_emb_itra_ego   = self.embedding_user_item_itra(neg.long() + self.n_users)
-        reg_loss = users_emb_itra_ego.norm(2).pow(2) + pos_emb_itra_ego.norm(2).pow(2) + neg_emb_itra_ego.norm(2).pow(2)
+        reg_loss = users_emb_itra_ego.norm(2).pow(2) + pos_emb_itra_ego.norm(2).pow(2) + neg_emb_itra_ego.norm(2).pow(2) / n_neg
 
         propagated_embed_itra = propagate_func(self.itra_G, self.embedding_user_item_itra, self.aggregate_layers_itra)
         users_emb_itra = propagated_embed_itra[users.long()]
@@ -167,7 +289,7 @@ class CFGCN(nn.Module):
             users_emb_struc_ego = self.embedding_user_item_struc(users.long())
             pos_emb_struc_ego   = self.embedding_user_item_struc(pos.long() + self.n_users)
             neg_emb_struc_ego   = self.embedding_user_item_struc(neg.long() + self.n_users)
-            reg_loss += (users_emb_struc_ego.norm(2).pow(2) + pos_emb_struc_ego.norm(2).pow(2) + neg_emb_struc_ego.norm(2).pow(2))
+            reg_loss += (users_emb_struc_ego.norm(2).pow(2) + pos_emb_struc_ego.norm(2).pow(2) + neg_emb_struc_ego.norm(2).pow(2) / n_neg)
             # reg_loss = (users_emb_struc_ego.norm(2).pow(2) + pos_emb_struc_ego.norm(2).pow(2) + neg_emb_struc_ego.norm(2).pow(2)) # pure
 
             users_embs = [users_emb_itra]
@@ -176,10 +298,7 @@ class CFGCN(nn.Module):
             # users_embs = [] # pure
             # pos_embs = [] # pure
             # neg_embs = [] # pure
-            for index, g_in in enumerate(self.struc_Gs):
-                g = g_in.local_var()
-                g.edata['weight'] = g.edata['weight'] * self.norm_weight_list[index] + self.norm_bias_list[index]
-                propagated_embed_struc = propagate_func(g, self.embedding_user_item_struc, self.aggregate_layers_struc, use_noise=False)
+            for propagated_embed_struc in self.propagate_struc_graphs(propagate_func):
                 users_emb_struc = propagated_embed_struc[users.long()]
                 pos_emb_struc   = propagated_embed_struc[pos.long() + self.n_users]
                 neg_emb_struc   = propagated_embed_struc[neg.long() + self.n_users]
@@ -195,13 +314,15 @@ class CFGCN(nn.Module):
             pos_emb = pos_emb_itra
             neg_emb = neg_emb_itra
 
-        pos_scores = torch.sum(users_emb * pos_emb, dim=1)
-        neg_scores = torch.sum(users_emb * neg_emb, dim=1)
-        loss = torch.mean(nn.functional.softplus(neg_scores - pos_scores))
+        pos_scores = torch.sum(users_emb * pos_emb, dim=1, dtype=torch.float32) # loss accumulation in float32
+        with self.low_precision_context():
+            neg_scores = torch.bmm(neg_emb, users_emb.unsqueeze(-1)).squeeze(-1).float() # (batch_size, n_neg)
+        loss = multi_neg_loss(pos_scores, neg_scores, self.neg_loss)
         reg_loss = (1/2) * reg_loss / float(len(users))
         return loss + self.lam * reg_loss
 
-    def get_users_ratings(self, users, use_dummy_gcn=False, use_struc=None):
+    def get_final_embedding(self, use_dummy_gcn=False, use_struc=None, show_detail=True):
+        # propagated (and combined) embeddings of all users and all items
         if use_dummy_gcn:
             propagate_func = self.dummy_propagate_embedding
         else:
@@ -210,7 +331,7 @@ class CFGCN(nn.Module):
             use_struc = self.struc_Gs is not None
 
         propagated_embed_itra = propagate_func(self.itra_G, self.embedding_user_item_itra, self.aggregate_layers_itra_p)
-        users_emb_itra = propagated_embed_itra[users.long()]
+        users_emb_itra = propagated_embed_itra[:self.n_users]
         items_emb_itra = propagated_embed_itra[self.n_users:]
 
         if use_struc:
@@ -219,16 +340,10 @@ class CFGCN(nn.Module):
             items_embs = [items_emb_itra]
             # users_embs = [] # pure
             # items_embs = [] # pure
-            print()
-            for index, g_in in enumerate(self.struc_Gs):
-                g = g_in.local_var()
-                g.edata['weight'] = g.edata['weight'] * self.norm_weight_list[index] + self.norm_bias_list[index]
-                print('g.edata[weight] mean & var', g.edata['weight'].mean().cpu(), g.edata['weight'].var().cpu())
-                if self.layers_weight is not None:
-                    print('self.layers_weight', [w.data.cpu() for w in self.layers_weight])
-                # print('embed ego mean & abs mean & var:', self.embedding_user_item_struc.weight.mean().cpu(), self.embedding_user_item_struc.weight.abs().mean().cpu(), self.embedding_user_item_struc.weight.var().cpu())
-                propagated_embed_struc = propagate_func(g, self.embedding_user_item_struc, self.aggregate_layers_struc, use_noise=False, show_detail=False)
-                users_emb_struc = propagated_embed_struc[users.long()]
+            if show_detail:
+                print()
+            for propagated_embed_struc in self.propagate_struc_graphs(propagate_func, show_detail=show_detail):
+                users_emb_struc = propagated_embed_struc[:self.n_users]
                 items_emb_struc = propagated_embed_struc[self.n_users:]
                 users_embs.append(users_emb_struc)
                 items_embs.append(items_emb_struc)
@@ -238,20 +353,88 @@ class CFGCN(nn.Module):
         else:
             users_emb = users_emb_itra
             items_emb = items_emb_itra
+        return users_emb, items_emb
 
-        ratings = self.f(torch.matmul(users_emb, items_emb.t()))
+    def get_users_ratings(self, users, use_dummy_gcn=False, use_struc=None):
+        users_emb, items_emb = self.get_final_embedding(use_dummy_gcn, use_struc)
+        users_emb = users_emb[users.long()]
+        with self.low_precision_context():
+            ratings = torch.matmul(users_emb, items_emb.t())
+        ratings = self.f(ratings.float())
         return ratings # shape: (test_batch_size, n_items)
 
 
+    def cache_fold_in(self):
+        # per layer item embedding of the interaction graph, needed by fold_in, call again after training
+        assert self.struc_Gs is None, 'fold_in only supports the parameter free interaction graph path'
+        with torch.no_grad():
+            all_embed = self.propagate_embedding(self.itra_G, self.embedding_user_item_itra, self.aggregate_layers_itra, return_layers=True)
+            self.item_layer_embeds = torch.stack([e[self.n_users:].float() for e in all_embed]) # (n_layers + 1, n_items, embed_dim)
+            self.item_sqrt_degree = self.itra_G.ndata['sqrt_degree'][self.n_users:].float() # (n_items, 1)
+            # final item embedding from the same layers (as propagate_embedding), no second propagation
+            item_layers = list(self.item_layer_embeds)
+            if self.layers_weight is not None:
+                item_layers = [e * self.layers_weight[idx].detach().float() for idx, e in enumerate(item_layers)]
+            self.items_emb_cached = torch.mean(torch.stack(item_layers, dim=-1), dim=-1) # (n_items, embed_dim)
+
+    def fold_in(self, item_ids):
+        # propagated embedding of a user not in the graph from the items it interacted with, O(len(item_ids) * embed_dim * n_layers)
+        # item embeddings are taken from the cache, i.e. the new edges do not change the item side
+        item_ids = torch.as_tensor(item_ids, dtype=torch.long, device=self.item_layer_embeds.device)
+        if len(item_ids) == 0:
+            # no interaction yet: zero embedding, every item gets the same score
+            return torch.zeros(self.item_layer_embeds.shape[-1], device=self.item_layer_embeds.device)
+        user_sqrt_degree = 1 / math.sqrt(len(item_ids))
+        item_norm = self.item_sqrt_degree[item_ids] * user_sqrt_degree # (len(item_ids), 1)
+        # no ego embedding is trained for the new user, use the mean of its items instead
+        user_layers = [self.item_layer_embeds[0][item_ids].mean(dim=0)]
+        for k in range(self.n_layers):
+            user_layers.append(torch.sum(self.item_layer_embeds[k][item_ids] * item_norm, dim=0))
+        if self.layers_weight is not None:
+            user_layers = [e * self.layers_weight[idx].detach() for idx, e in enumerate(user_layers)]
+        return torch.mean(torch.stack(user_layers, dim=-1), dim=-1) # (embed_dim, )
+
+    def fold_in_ratings(self, batch_item_ids):
+        # ratings of new users against all items, batch_item_ids is a list of item id lists
+        with torch.no_grad():
+            users_emb = torch.stack([self.fold_in(item_ids) for item_ids in batch_item_ids])
+            return self.f(torch.matmul(users_emb, self.items_emb_cached.t())) # shape: (len(batch_item_ids), n_items)
+
+    def propagate_struc_graphs(self, propagate_func, show_detail=False):
+        # list of propagated embedding, one per struc graph, edge weight rescaled by norm_weight_list / norm_bias_list
+        if self.fused_struc_G is not None:
+            g = self.fused_struc_G.local_var()
+            graph_index = g.edata['graph_index']
+            norm_weight = torch.cat(list(self.norm_weight_list))[graph_index].unsqueeze(-1)
+            norm_bias = torch.cat(list(self.norm_bias_list))[graph_index].unsqueeze(-1)
+            g.edata['weight'] = g.edata['weight'] * norm_weight + norm_bias
+            if show_detail:
+                print('fused g.edata[weight] mean & var', g.edata['weight'].mean().cpu(), g.edata['weight'].var().cpu())
+                if self.layers_weight is not None:
+                    print('self.layers_weight', [w.data.cpu() for w in self.layers_weight])
+            propagated_embed = propagate_func(g, self.embedding_user_item_struc, self.aggregate_layers_struc, use_noise=False)
+            return list(torch.chunk(propagated_embed, len(self.struc_Gs), dim=0))
+
+        propagated_embeds = []
+        for index, g_in in enumerate(self.struc_Gs):
+            g = g_in.local_var()
+            g.edata['weight'] = g.edata['weight'] * self.norm_weight_list[index] + self.norm_bias_list[index]
+            if show_detail:
+                print('g.edata[weight] mean & var', g.edata['weight'].mean().cpu(), g.edata['weight'].var().cpu())
+                if self.layers_weight is not None:
+                    print('self.layers_weight', [w.data.cpu() for w in self.layers_weight])
+            # print('embed ego mean & abs mean & var:', self.embedding_user_item_struc.weight.mean().cpu(), self.embedding_user_item_struc.weight.abs().mean().cpu(), self.embedding_user_item_struc.weight.var().cpu())
+            propagated_embeds.append(propagate_func(g, self.embedding_user_item_struc, self.aggregate_layers_struc, use_noise=False))
+        return propagated_embeds
+
     def dummy_propagate_embedding(self, g_in, ebd_in, agg_layers_in=None, use_noise=False):
         ego_embed = ebd_in(g_in.ndata['id'])
         return ego_embed
 
 
-    def propagate_embedding(self, g_in, ebd_in, agg_layers_in, use_noise=False, show_detail=False):
+    def propagate_embedding(self, g_in, ebd_in, agg_layers_in, use_noise=False, show_detail=False, return_layers=False):
         g = g_in.local_var() # try to not use local_var()
         ego_embed = ebd_in(g.ndata['id'])
-        all_embed = [ego_embed]
 
         # print()
         # ma = torch.max(g.edata['weight']).cpu().item()
@@ -273,12 +456,33 @@ class CFGCN(nn.Module):
         # plt.show()
         # exit(0)
 
+        recompute = self.recompute if self.training and torch.is_grad_enabled() and not return_layers else None
+        if recompute == 'graph':
+            # only ego_embed and the result are kept, the backward runs the whole propagation once more
+            return checkpoint(self.propagate_layers, g, ego_embed, agg_layers_in, use_noise, show_detail, False, use_reentrant=False)
+        return self.propagate_layers(g, ego_embed, agg_layers_in, use_noise, show_detail, return_layers, recompute == 'layer')
+
+    def run_layer(self, layer, g, embed, use_noise=False, show_detail=False):
+        with self.low_precision_context():
+            return layer(g, embed, use_noise, show_detail).to(embed.dtype)
+
+    def propagate_layers(self, g, ego_embed, agg_layers_in, use_noise=False, show_detail=False, return_layers=False, recompute_layer=False):
+        all_embed = [ego_embed]
         for i, layer in enumerate(agg_layers_in):
-            ego_embed = layer(g, ego_embed, use_noise, show_detail)
+            if recompute_layer:
+                ego_embed = checkpoint(self.run_layer, layer, g, ego_embed, use_noise, show_detail, use_reentrant=False)
+            else:
+                ego_embed = self.run_layer(layer, g, ego_embed, use_noise, show_detail)
             all_embed.append(ego_embed)
+        if return_layers:
+            return all_embed # [ego, layer 1, ..., layer n_layers], before layers_weight
 
         if self.layers_weight is not None:
-            all_embed = [e * self.layers_weight[idx] for idx, e in enumerate(all_embed)]
+            all_embed = [e * self.layers_weight[idx].to(e.dtype) for idx, e in enumerate(all_embed)]
+
+        if self.recompute is not None:
+            # same mean without the stacked copy, the sum keeps no table for backward
+            return sum(all_embed) / len(all_embed)
 
         # mean version
         all_embed = torch.stack(all_embed, dim=-1)
@@ -293,6 +497,129 @@ class CFGCN(nn.Module):
         return propagated_embed
 
 
+class MF(nn.Module):
+
+    def __init__(self, n_users, n_items, embed_dim=64, lam=0.001, combine_mode=0, n_struc=0, neg_loss='mean', sparse=False):
+        # CFGCN pretraining (use_dummy_gcn=True) on the batch rows only, same (n_users + n_items, embed_dim) table
+        # n_struc / combine_mode reproduce the dummy struc path: the struc table is the itra table, concat repeats the embedding
+        super(MF, self).__init__()
+        self.n_users = n_users
+        self.n_items = n_items
+        self.embed_dim = embed_dim
+        self.lam = lam
+        self.combine_mode = combine_mode
+        self.n_struc = n_struc
+        self.neg_loss = neg_loss
+        self.f = nn.Sigmoid()
+        # sparse: grads only hold the batch rows, use torch.optim.SparseAdam
+        self.embedding_user_item_itra = torch.nn.Embedding(num_embeddings=self.n_users + self.n_items, embedding_dim=self.embed_dim, sparse=sparse)
+        nn.init.xavier_uniform_(self.embedding_user_item_itra.weight, gain=1)
+
+    def load_pretrained_embedding(self, pretrained_data):
+        assert pretrained_data.shape[0] == self.n_users + self.n_items
+        assert pretrained_data.shape[1] == self.embed_dim
+        self.embedding_user_item_itra.weight.data = pretrained_data
+
+    def get_pretrained_embedding(self):
+        return self.embedding_user_item_itra.weight.data
+
+    def score_scale(self, use_struc):
+        if use_struc and self.combine_mode == 1:
+            return 1 + self.n_struc
+        return 1
+
+    def bpr_loss(self, users, pos, neg, use_dummy_gcn=True, use_struc=None):
+        if use_struc is None:
+            use_struc = self.n_struc > 0
+        if neg.dim() == 1:
+            neg = neg.unsqueeze(-1) # (batch_size, n_neg)
+        n_neg = neg.shape[1]
+
+        users_emb = self.embedding_user_item_itra(users.long())
+        pos_emb = self.embedding_user_item_itra(pos.long() + self.n_users)
+        neg_emb = self.embedding_user_item_itra(neg.long() + self.n_users)
+        reg_loss = users_emb.norm(2).pow(2) + pos_emb.norm(2).pow(2) + neg_emb.norm(2).pow(2) / n_neg
+        if use_struc:
+            reg_loss = 2 * reg_loss # itra + struc rows of the same table
+
+        scale = self.score_scale(use_struc)
+        pos_scores = scale * torch.sum(users_emb * pos_emb, dim=1)
+        neg_scores = scale * torch.bmm(neg_emb, users_emb.unsqueeze(-1)).squeeze(-1) # (batch_size, n_neg)
+        loss = multi_neg_loss(pos_scores, neg_scores, self.neg_loss)
+        reg_loss = (1/2) * reg_loss / float(len(users))
+        return loss + self.lam * reg_loss
+
+    def get_final_embedding(self, use_dummy_gcn=True, use_struc=None, show_detail=False):
+        if use_struc is None:
+            use_struc = self.n_struc > 0
+        table = self.embedding_user_item_itra.weight
+        return self.score_scale(use_struc) * table[:self.n_users], table[self.n_users:]
+
+    def get_users_ratings(self, users, use_dummy_gcn=True, use_struc=None):
+        users_emb, items_emb = self.get_final_embedding(use_dummy_gcn, use_struc)
+        ratings = torch.matmul(users_emb[users.long()], items_emb.t())
+        return self.f(ratings)
+
+
+def build_fused_struc_graph(struc_Gs):
+    # block diagonal graph of struc_Gs, node k * n_nodes + v is node v of graph k, ndata['id'] still indexes the embedding
+    n_nodes = struc_Gs[0].number_of_nodes()
+    src_list, dst_list, graph_index_list = [], [], []
+    for index, g in enumerate(struc_Gs):
+        assert g.number_of_nodes() == n_nodes
+        src, dst = g.all_edges(order='eid')
+        src_list.append(src + index * n_nodes)
+        dst_list.append(dst + index * n_nodes)
+        graph_index_list.append(torch.full((g.number_of_edges(),), index, dtype=torch.long))
+    fused_g = dgl.DGLGraph()
+    fused_g.add_nodes(n_nodes * len(struc_Gs))
+    fused_g.add_edges(torch.cat(src_list), torch.cat(dst_list))
+    fused_g.readonly()
+    device = struc_Gs[0].ndata['id'].device
+    fused_g.ndata['id'] = torch.cat([g.ndata['id'] for g in struc_Gs])
+    fused_g.ndata['out_sqrt_degree'] = torch.cat([g.ndata['out_sqrt_degree'] for g in struc_Gs])
+    fused_g.ndata['in_sqrt_degree'] = torch.cat([g.ndata['in_sqrt_degree'] for g in struc_Gs])
+    fused_g.edata['weight'] = torch.cat([g.edata['weight'] for g in struc_Gs])
+    fused_g.edata['graph_index'] = torch.cat(graph_index_list).to(device)
+    return fused_g
+
+
+def multi_neg_loss(pos_scores, neg_scores, mode='mean'):
+    # pos_scores: (batch_size, ), neg_scores: (batch_size, n_neg)
+    if mode == 'mean':
+        return torch.mean(nn.functional.softplus(neg_scores - pos_scores.unsqueeze(-1)))
+    elif mode == 'max':
+        return torch.mean(nn.functional.softplus(neg_scores.max(dim=1)[0] - pos_scores))
+    elif mode == 'softmax':
+        logits = torch.cat([pos_scores.unsqueeze(-1), neg_scores], dim=1)
+        target = torch.zeros(len(logits), dtype=torch.long, device=logits.device)
+        return nn.functional.cross_entropy(logits, target)
+    else:
+        assert False, 'not support this mode in multi_neg_loss'
+
+
+def topk_by_item_chunks(users_emb, items_emb, k, item_chunk_size, seen_rows=None, seen_items=None):
+    # top-k items of every user without the (batch_size, n_items) score matrix, seen (row, item) pairs excluded;
+    # items_emb may be a numpy memmap, then only one chunk of rows is read at a time
+    top_scores = None
+    for start in range(0, items_emb.shape[0], item_chunk_size):
+        chunk = items_emb[start:start + item_chunk_size]
+        if isinstance(chunk, np.ndarray):
+            chunk = torch.from_numpy(np.array(chunk))
+        scores = torch.matmul(users_emb, chunk.t()).float()
+        if seen_rows is not None:
+            in_chunk = (seen_items >= start) & (seen_items < start + scores.shape[1])
+            scores[seen_rows[in_chunk], seen_items[in_chunk] - start] = -np.inf
+        chunk_scores, chunk_items = torch.topk(scores, k=min(k, scores.shape[1]))
+        chunk_items = chunk_items + start
+        if top_scores is not None:
+            chunk_scores = torch.cat([top_scores, chunk_scores], dim=1)
+            chunk_items = torch.cat([top_items, chunk_items], dim=1)
+        top_scores, index = torch.topk(chunk_scores, k=min(k, chunk_scores.shape[1]))
+        top_items = torch.gather(chunk_items, 1, index)
+    return top_scores, top_items
+
+
 def combine_multi_graph_embedding(embeddings_in, mode=0):
     if mode == 0:
         # mean
@@ -313,7 +640,7 @@ def combine_multi_graph_embedding(embeddings_in, mode=0):
 #     return g.ndata['N_h']
 
 
-def AggregateUnweighted_p(g, entity_embed):
+def AggregateUnweighted_p(g, entity_embed, use_noise=False, show_detail=False):
     g = g.local_var()
     g.ndata['node'] = entity_embed * g.ndata['sqrt_degree']
     g.update_all(dgl.function.copy_src(src='node', out='side'), lambda nodes: {'N_h': torch.sum(nodes.mailbox['side'], 1)})
@@ -321,7 +648,7 @@ def AggregateUnweighted_p(g, entity_embed):
     return g.ndata['N_h']
 
 
-def AggregateUnweighted(g, entity_embed):
+def AggregateUnweighted(g, entity_embed, use_noise=False, show_detail=False):
     g = g.local_var()
     g.ndata['node'] = entity_embed * g.ndata['sqrt_degree']
     g.update_all(dgl.function.copy_src(src='node', out='side'), dgl.function.sum(msg='side', out='N_h'))
@@ -329,7 +656,7 @@ def AggregateUnweighted(g, entity_embed):
     return g.ndata['N_h']
 
 
-def AggregateWeighted(g, entity_embed):
+def AggregateWeighted(g, entity_embed, use_noise=False, show_detail=False):
     g = g.local_var()
     g.ndata['node'] = entity_embed * g.ndata['out_sqrt_degree']
     g.update_all(dgl.function.u_mul_e('node', 'weight', 'side'), dgl.function.sum(msg='side', out='N_h'))
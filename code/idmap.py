@@ -0,0 +1,61 @@
+import os
+
+import numpy as np
+
+
+class IdMap():
+
+    def __init__(self, raw_ids):
+        # dense id = position in the sorted unique raw ids, lookups are searchsorted, no python dict
+        self.raw_ids = np.unique(np.asarray(raw_ids, dtype=np.int64))
+        self.org_ids = None
+
+    def __len__(self):
+        return len(self.raw_ids)
+
+    def to_dense(self, raw_ids):
+        # -1 for raw ids without a dense id
+        raw_ids = np.asarray(raw_ids, dtype=np.int64)
+        if len(self.raw_ids) == 0:
+            return np.full(raw_ids.shape, -1, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self.raw_ids, raw_ids), len(self.raw_ids) - 1)
+        return np.where(self.raw_ids[pos] == raw_ids, pos, -1)
+
+    def to_raw(self, dense_ids):
+        return self.raw_ids[dense_ids]
+
+    def load_org_ids(self, list_path):
+        # user_list.txt / item_list.txt: header, then 'org_id remap_id' per line, remap_id is the raw id of the data files
+        table = np.loadtxt(list_path, dtype=str, skiprows=1, ndmin=2)
+        remap_ids = table[:, 1].astype(np.int64)
+        order = np.argsort(remap_ids)
+        remap_ids = remap_ids[order]
+        pos = np.minimum(np.searchsorted(remap_ids, self.raw_ids), len(remap_ids) - 1)
+        assert np.all(remap_ids[pos] == self.raw_ids), 'raw ids missing in ' + list_path
+        self.org_ids = table[:, 0][order][pos]
+
+    def to_org(self, dense_ids):
+        assert self.org_ids is not None, 'call load_org_ids first'
+        return self.org_ids[dense_ids]
+
+
+def build_id_maps(train_data, data_dir=None):
+    # users / items with at least one training edge, zero degree ids get no row and no graph node
+    user_map = IdMap(train_data[0])
+    item_map = IdMap(train_data[1])
+    if data_dir is not None:
+        if os.path.exists(os.path.join(data_dir, 'user_list.txt')):
+            user_map.load_org_ids(os.path.join(data_dir, 'user_list.txt'))
+        if os.path.exists(os.path.join(data_dir, 'item_list.txt')):
+            item_map.load_org_ids(os.path.join(data_dir, 'item_list.txt'))
+    return user_map, item_map
+
+
+def group_by_user(users, items):
+    # {user_id: [item_ids]} from interaction arrays
+    order = np.argsort(users, kind='stable')
+    users = users[order]
+    items = items[order]
+    starts = np.concatenate(([0], np.nonzero(users[1:] != users[:-1])[0] + 1)) if len(users) > 0 else np.zeros(0, dtype=np.int64)
+    ends = np.append(starts[1:], len(users))
+    return {users[s].item(): items[s:e].tolist() for s, e in zip(starts.tolist(), ends.tolist())}
@@ -0,0 +1,122 @@
+import time
+
+import dgl
+import numpy as np
+import scipy.sparse as sp
+import torch
+import torch.nn as nn
+
+from sampler import UniformNegativeSampler
+
+
+class SubgraphNegativeSampler(UniformNegativeSampler):
+
+    def __init__(self, train_data, n_items, candidate_items):
+        # uniform over candidate_items (global item ids), positives of the user rejected as in UniformNegativeSampler
+        super(SubgraphNegativeSampler, self).__init__(train_data, n_items)
+        self.candidate_items = candidate_items
+
+    def draw(self, size):
+        return self.candidate_items[np.random.randint(0, len(self.candidate_items), size)]
+
+
+def get_node_adj(data_set):
+    # symmetric (n_users + n_items) adjacency of the interaction graph
+    R = data_set.get_train_csr()
+    return sp.bmat([[None, R], [R.T, None]], format='csr')
+
+
+def get_neighborhood(data_set, center_nodes, n_hops):
+    # node ids (item id already + n_users) within n_hops of center_nodes, sorted
+    adj = get_node_adj(data_set)
+    frontier = np.zeros(adj.shape[0], dtype=np.float32)
+    frontier[center_nodes] = 1
+    for k in range(n_hops):
+        frontier = ((frontier + adj.dot(frontier)) > 0).astype(np.float32)
+    return np.nonzero(frontier)[0]
+
+
+def build_neighborhood_graph(data_set, nodes):
+    # induced subgraph on nodes, ndata['id'] is the local id (row of nodes), sqrt_degree comes from the full graph
+    n_users = data_set.get_user_num()
+    users, items = data_set.get_train_data()
+    items = items + n_users
+    mask = np.isin(users, nodes) & np.isin(items, nodes)
+    local_users = np.searchsorted(nodes, users[mask])
+    local_items = np.searchsorted(nodes, items[mask])
+
+    g = dgl.DGLGraph()
+    g.add_nodes(len(nodes))
+    g.add_edges(local_users, local_items)
+    g.add_edges(local_items, local_users)
+    g.readonly()
+    nodes_t = torch.from_numpy(nodes).long()
+    g.ndata['id'] = torch.arange(len(nodes), dtype=torch.long)
+    g.ndata['sqrt_degree'] = data_set.get_interaction_graph().ndata['sqrt_degree'][nodes_t]
+    return g
+
+
+def fine_tune_affected(model, data_set, affected_users, n_steps=100, batch_size=2048, lr=0.001, device=torch.device('cpu')):
+    # train only on edges of affected users, propagating over their (n_layers + 1)-hop neighborhood
+    # positives are 1 hop away so their n_layers receptive field is inside the subgraph, negatives near the border are approximated
+    n_users = data_set.get_user_num()
+    nodes = get_neighborhood(data_set, affected_users, model.n_layers + 1)
+    sub_g = build_neighborhood_graph(data_set, nodes)
+    sub_g.ndata['id'] = sub_g.ndata['id'].to(device)
+    sub_g.ndata['sqrt_degree'] = sub_g.ndata['sqrt_degree'].to(device)
+    print('fine tune subgraph: nodes', len(nodes), '/', n_users + data_set.get_item_num(), ',edges', sub_g.number_of_edges())
+
+    users, items = data_set.get_train_data()
+    mask = np.isin(users, affected_users)
+    train_users = users[mask]
+    train_items = items[mask]
+    # negatives: items of the subgraph, positives of the user rejected
+    neg_sampler = SubgraphNegativeSampler([train_users, train_items], data_set.get_item_num(), nodes[nodes >= n_users] - n_users)
+
+    # only the subgraph rows are optimized (and carry Adam state), written back to the full table afterwards;
+    # aggregators / layer weights stay fixed
+    nodes_t = torch.from_numpy(nodes).long().to(device)
+    table = model.embedding_user_item_itra.weight
+    sub_embedding = nn.Embedding.from_pretrained(table.data[nodes_t].clone(), freeze=False)
+    optimizer = torch.optim.Adam(params=sub_embedding.parameters(), lr=lr)
+    model.train()
+    time_start = time.time()
+    total_loss = 0
+    for step_i in range(n_steps):
+        batch = np.random.randint(0, len(train_users), min(batch_size, len(train_users)))
+        negs = neg_sampler.sample(train_users[batch], train_items[batch])
+        users_t = torch.from_numpy(np.searchsorted(nodes, train_users[batch])).long().to(device)
+        pos_t = torch.from_numpy(np.searchsorted(nodes, train_items[batch] + n_users)).long().to(device)
+        neg_t = torch.from_numpy(np.searchsorted(nodes, negs + n_users)).long().to(device)
+
+        ego_embed = sub_embedding.weight
+        reg_loss = ego_embed[users_t].norm(2).pow(2) + ego_embed[pos_t].norm(2).pow(2) + ego_embed[neg_t].norm(2).pow(2)
+        propagated_embed = model.propagate_embedding(sub_g, sub_embedding, model.aggregate_layers_itra)
+        users_emb = propagated_embed[users_t]
+        pos_scores = torch.sum(users_emb * propagated_embed[pos_t], dim=1, dtype=torch.float32)
+        neg_scores = torch.sum(users_emb * propagated_embed[neg_t], dim=1, dtype=torch.float32)
+        loss = torch.mean(nn.functional.softplus(neg_scores - pos_scores))
+        loss = loss + model.lam * (1/2) * reg_loss / float(len(batch))
+
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+        total_loss += loss.cpu().item()
+    table.data[nodes_t] = sub_embedding.weight.data
+    model.zero_grad() # no stale grads of layers_weight etc. from the fixed parameters
+    print('fine tune loss:', total_loss / max(n_steps, 1), ', time:', time.time() - time_start)
+
+
+def append_and_refresh(data_set, model, user_ids, item_ids, n_steps=100, batch_size=2048, lr=0.001, device=torch.device('cpu')):
+    # add new interactions to data_set, grow model for new ids, then fine tune around the touched users
+    new_users, new_items = data_set.append_interactions(user_ids, item_ids)
+    if len(new_users) == 0:
+        print('no new interactions')
+        return
+    print('append interactions:', len(new_users), ', n_users', data_set.get_user_num(), ', n_items', data_set.get_item_num())
+    itra_G = data_set.get_interaction_graph()
+    itra_G.ndata['id'] = itra_G.ndata['id'].to(device)
+    itra_G.ndata['sqrt_degree'] = itra_G.ndata['sqrt_degree'].to(device)
+    model.grow_embedding(data_set.get_user_num(), data_set.get_item_num(), itra_G)
+    affected_users = np.unique(new_users)
+    fine_tune_affected(model, data_set, affected_users, n_steps, batch_size, lr, device)
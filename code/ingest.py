@@ -0,0 +1,164 @@
+import os
+import multiprocessing as mp
+
+import numpy as np
+import scipy.sparse as sp
+
+
+def find_chunks(file_path, chunk_bytes=64 * 2 ** 20):
+    # byte ranges of about chunk_bytes, every range starts at the beginning of a line
+    size = os.path.getsize(file_path)
+    offsets = [0]
+    with open(file_path, 'rb') as f:
+        for pos in range(chunk_bytes, size, chunk_bytes):
+            if pos <= offsets[-1]:
+                continue
+            f.seek(pos)
+            f.readline() # move to the next line start
+            if f.tell() < size and f.tell() > offsets[-1]:
+                offsets.append(f.tell())
+    offsets.append(size)
+    return list(zip(offsets[:-1], offsets[1:]))
+
+
+def parse_ints(buf):
+    # every run of digits of the uint8 array buf as int64 (ids are non-negative integers, any other byte separates),
+    # + the byte offset of each run; one pass per digit position, no python object per token
+    digit = ((buf >= ord('0')) & (buf <= ord('9'))).astype(np.int8)
+    change = np.diff(np.concatenate(([0], digit, [0])))
+    starts = np.nonzero(change == 1)[0]
+    lengths = np.nonzero(change == -1)[0] - starts
+    values = np.zeros(len(starts), dtype=np.int64)
+    for k in range(lengths.max() if len(lengths) > 0 else 0):
+        active = np.nonzero(lengths > k)[0]
+        values[active] = values[active] * 10 + (buf[starts[active] + k] - ord('0'))
+    return values, starts
+
+
+def parse_chunk(args):
+    # (user, item) pairs of one byte range, duplicates inside the chunk removed
+    file_path, start, end, file_format = args
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        buf = np.frombuffer(f.read(end - start), dtype=np.uint8)
+    values, starts = parse_ints(buf)
+    if file_format == 'adj':
+        # user item item ..., one user per line (train.txt format): the first id of a line is the user
+        line_ids = np.searchsorted(np.nonzero(buf == ord('\n'))[0], starts)
+        first = np.ones(len(values), dtype=bool)
+        first[1:] = line_ids[1:] != line_ids[:-1]
+        line_lengths = np.diff(np.append(np.nonzero(first)[0], len(values)))
+        users = np.repeat(values[first], line_lengths - 1)
+        items = values[~first]
+    elif file_format == 'edges':
+        # user item [timestamp], one interaction per line, integer columns
+        newline = np.nonzero(buf == ord('\n'))[0]
+        n_cols = np.count_nonzero(starts < (newline[0] if len(newline) > 0 else len(buf)))
+        if n_cols == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        assert len(values) % n_cols == 0, 'lines with another number of columns in ' + file_path
+        ids = values.reshape(-1, n_cols)
+        users = ids[:, 0].copy()
+        items = ids[:, 1].copy()
+    else:
+        assert False, 'not support this file format: ' + str(file_format)
+    order = np.lexsort((items, users))
+    users = users[order]
+    items = items[order]
+    keep = np.ones(len(users), dtype=bool)
+    keep[1:] = (users[1:] != users[:-1]) | (items[1:] != items[:-1])
+    return users[keep], items[keep]
+
+
+def count_chunk(args):
+    users, items = parse_chunk(args)
+    if len(users) == 0:
+        return np.zeros(0, dtype=np.int64), -1
+    return np.bincount(users), items.max()
+
+
+def map_chunks(func, tasks, n_workers):
+    # in windows of 2 * n_workers chunks, so at most that many parsed chunks are alive at once
+    if n_workers <= 1:
+        for task in tasks:
+            yield func(task)
+        return
+    with mp.get_context('fork').Pool(n_workers) as pool:
+        window = 2 * n_workers
+        for start in range(0, len(tasks), window):
+            for result in pool.map(func, tasks[start:start + window]):
+                yield result
+
+
+def dedup_rows(indptr, indices, block_edges=2 ** 26):
+    # sort the items of every user and drop duplicates across chunks, compacted in place block by block
+    n_users = len(indptr) - 1
+    new_indptr = np.zeros(n_users + 1, dtype=np.int64)
+    write = 0
+    start_user = 0
+    while start_user < n_users:
+        end_user = np.searchsorted(indptr, indptr[start_user] + block_edges, side='right') - 1
+        end_user = min(max(end_user, start_user + 1), n_users)
+        items = np.array(indices[indptr[start_user]:indptr[end_user]])
+        rows = np.repeat(np.arange(end_user - start_user), np.diff(indptr[start_user:end_user + 1]))
+        order = np.lexsort((items, rows))
+        rows = rows[order]
+        items = items[order]
+        keep = np.ones(len(items), dtype=bool)
+        keep[1:] = (rows[1:] != rows[:-1]) | (items[1:] != items[:-1])
+        rows = rows[keep]
+        items = items[keep]
+        indices[write:write + len(items)] = items # write <= read position, nothing unread is overwritten
+        new_indptr[start_user + 1:end_user + 1] = write + np.cumsum(np.bincount(rows, minlength=end_user - start_user))
+        write += len(items)
+        start_user = end_user
+    return new_indptr, write
+
+
+def ingest_csr(file_path, file_format='adj', n_workers=4, chunk_bytes=64 * 2 ** 20, block_edges=2 ** 26, out_dir=None):
+    # two pass streaming load of a user -> item file into a CSR matrix (n_users, n_items):
+    # pass 1 counts the interactions of every user, pass 2 fills the indices at per user cursors,
+    # then duplicates across chunks are removed; with out_dir the indices live in a .npy memmap
+    tasks = [(file_path, start, end, file_format) for start, end in find_chunks(file_path, chunk_bytes)]
+
+    counts = np.zeros(0, dtype=np.int64)
+    max_item = -1
+    for chunk_counts, chunk_max_item in map_chunks(count_chunk, tasks, n_workers):
+        if len(chunk_counts) > len(counts):
+            counts = np.concatenate((counts, np.zeros(len(chunk_counts) - len(counts), dtype=np.int64)))
+        counts[:len(chunk_counts)] += chunk_counts
+        max_item = max(max_item, chunk_max_item)
+    n_users = len(counts)
+    n_items = int(max_item) + 1
+    indptr = np.zeros(n_users + 1, dtype=np.int64)
+    np.cumsum(counts, out=indptr[1:])
+    n_edges = int(indptr[-1])
+
+    if out_dir is not None:
+        os.makedirs(out_dir, exist_ok=True)
+        indices = np.lib.format.open_memmap(os.path.join(out_dir, 'indices.npy'), mode='w+', dtype=np.int32, shape=(n_edges, ))
+    else:
+        indices = np.zeros(n_edges, dtype=np.int32)
+    cursor = indptr[:-1].copy()
+    for users, items in map_chunks(parse_chunk, tasks, n_workers):
+        if len(users) == 0:
+            continue
+        # users are sorted inside a chunk: position = cursor of the user + rank inside its run
+        run_start = np.concatenate(([0], np.nonzero(users[1:] != users[:-1])[0] + 1))
+        run_length = np.diff(np.append(run_start, len(users)))
+        rank = np.arange(len(users)) - np.repeat(run_start, run_length)
+        indices[cursor[users] + rank] = items
+        cursor[users[run_start]] += run_length
+
+    indptr, n_edges = dedup_rows(indptr, indices, block_edges)
+    indices = indices[:n_edges]
+    if out_dir is not None:
+        indices.flush()
+        np.save(os.path.join(out_dir, 'indptr.npy'), indptr)
+    return sp.csr_matrix((np.ones(n_edges, dtype=np.float32), indices, indptr), shape=(n_users, n_items), copy=False)
+
+
+def csr_to_train_data(csr):
+    # [users, items] arrays in the layout of DataOnlyCF.train_data
+    users = np.repeat(np.arange(csr.shape[0], dtype=np.int32), np.diff(csr.indptr))
+    return [users, np.asarray(csr.indices, dtype=np.int32)]
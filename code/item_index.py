@@ -0,0 +1,122 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+
+from gcn_model import topk_by_item_chunks
+
+
+def normalize(items_emb, metric):
+    items_emb = torch.as_tensor(items_emb).float()
+    if metric == 'cosine':
+        return items_emb / items_emb.norm(dim=1, keepdim=True).clamp(min=1e-12)
+    elif metric == 'dot':
+        return items_emb
+    else:
+        assert False, 'not support this metric in ItemNeighbors: ' + str(metric)
+
+
+class ItemNeighbors():
+
+    def __init__(self, items_emb, n_neighbors=20, metric='cosine', block_size=4096, item_chunk_size=65536, n_threads=4, build=True, full_rebuild_fraction=0.5):
+        # exact top-n_neighbors of every item (itself excluded), a (block_size, item_chunk_size) score block at a time,
+        # stored as CSR rows sorted by score: neighbors of item i are indices[indptr[i]:indptr[i + 1]]
+        self.metric = metric
+        self.block_size = block_size
+        self.item_chunk_size = item_chunk_size
+        self.n_threads = n_threads
+        self.full_rebuild_fraction = full_rebuild_fraction # refresh rebuilds every row above this share of changed items
+        self.items_emb = normalize(items_emb, metric).clone() # the embedding every stored row was computed with
+        self.n_items = self.items_emb.shape[0]
+        self.n_neighbors = min(n_neighbors, self.n_items - 1)
+        self.indptr = np.arange(self.n_items + 1, dtype=np.int64) * self.n_neighbors
+        self.indices = np.zeros(self.n_items * self.n_neighbors, dtype=np.int32)
+        self.scores = np.zeros(self.n_items * self.n_neighbors, dtype=np.float32)
+        if not build:
+            return
+        time_start = time.time()
+        self.compute_rows(np.arange(self.n_items))
+        print('item neighbors: %d items, top-%d, %.1fs' % (self.n_items, self.n_neighbors, time.time() - time_start))
+
+    def neighbors(self, item_id, k=None):
+        start, end = self.indptr[item_id], self.indptr[item_id + 1]
+        end = end if k is None else min(end, start + k)
+        return self.indices[start:end], self.scores[start:end]
+
+    def row_view(self, array):
+        # every row holds n_neighbors entries, so the CSR arrays reshape to (n_items, n_neighbors)
+        return array.reshape(self.n_items, self.n_neighbors)
+
+    def compute_block(self, rows):
+        # matmul / topk release the GIL, blocks run in parallel threads
+        rows_t = torch.from_numpy(rows)
+        with torch.no_grad():
+            top_scores, top_items = topk_by_item_chunks(self.items_emb[rows_t], self.items_emb, self.n_neighbors, self.item_chunk_size,
+                                                        torch.arange(len(rows)), rows_t)
+        self.row_view(self.indices)[rows] = top_items.numpy()
+        self.row_view(self.scores)[rows] = top_scores.numpy()
+
+    def compute_rows(self, rows):
+        blocks = [rows[start:start + self.block_size] for start in range(0, len(rows), self.block_size)]
+        with ThreadPoolExecutor(self.n_threads) as executor:
+            list(executor.map(self.compute_block, blocks))
+
+    def merge_block(self, rows, changed):
+        # rows did not change: their scores against unchanged items still hold, only the changed items are scored again
+        # (item_chunk_size columns at a time); unchanged items outside the old list score <= the old last score,
+        # the merge is exact if its last score stays >= it
+        top_items = torch.from_numpy(self.row_view(self.indices)[rows].astype(np.int64))
+        top_scores = torch.from_numpy(self.row_view(self.scores)[rows].copy())
+        old_last = top_scores[:, -1].clone()
+        top_scores[torch.from_numpy(np.isin(top_items.numpy(), changed))] = -np.inf
+        rows_emb = self.items_emb[torch.from_numpy(rows)]
+        with torch.no_grad():
+            for start in range(0, len(changed), self.item_chunk_size):
+                chunk = torch.from_numpy(changed[start:start + self.item_chunk_size])
+                chunk_scores = torch.matmul(rows_emb, self.items_emb[chunk].t())
+                top_scores, index = torch.topk(torch.cat([top_scores, chunk_scores], dim=1), k=self.n_neighbors)
+                top_items = torch.gather(torch.cat([top_items, chunk.unsqueeze(0).expand(len(rows), -1)], dim=1), 1, index)
+        exact = (top_scores[:, -1] >= old_last).numpy()
+        self.row_view(self.indices)[rows[exact]] = top_items.numpy()[exact]
+        self.row_view(self.scores)[rows[exact]] = top_scores.numpy()[exact]
+        return rows[~exact]
+
+    def refresh(self, items_emb, threshold=0.05):
+        # items whose embedding moved more than threshold (relative L2 to the stored one) get their rows recomputed and are
+        # scored again in the rows of the other items, items under the threshold keep their stored embedding
+        items_emb = normalize(items_emb, self.metric)
+        assert items_emb.shape == self.items_emb.shape, 'the number of items changed, build a new index'
+        time_start = time.time()
+        drift = (items_emb - self.items_emb).norm(dim=1) / self.items_emb.norm(dim=1).clamp(min=1e-12)
+        changed = torch.nonzero(drift > threshold).squeeze(-1).numpy()
+        if len(changed) == 0:
+            return changed
+        self.items_emb[torch.from_numpy(changed)] = items_emb[torch.from_numpy(changed)]
+        if len(changed) > self.full_rebuild_fraction * self.n_items:
+            # most items moved (e.g. a retrain): merging costs about as much as a rebuild
+            self.compute_rows(np.arange(self.n_items))
+            print('item neighbors refresh: %d changed, full rebuild, %.1fs' % (len(changed), time.time() - time_start))
+            return changed
+        unchanged = np.setdiff1d(np.arange(self.n_items), changed)
+        blocks = [unchanged[start:start + self.block_size] for start in range(0, len(unchanged), self.block_size)]
+        with ThreadPoolExecutor(self.n_threads) as executor:
+            inexact = list(executor.map(lambda rows: self.merge_block(rows, changed), blocks))
+        recompute = np.concatenate([changed] + inexact)
+        self.compute_rows(recompute)
+        print('item neighbors refresh: %d changed, %d rows recomputed, %d merged, %.1fs' % (
+            len(changed), len(recompute), self.n_items - len(recompute), time.time() - time_start))
+        return changed
+
+    def save(self, path):
+        np.savez(path, indptr=self.indptr, indices=self.indices, scores=self.scores, items_emb=self.items_emb.numpy(),
+                 metric=self.metric, n_neighbors=self.n_neighbors)
+
+
+def load_item_neighbors(path, block_size=4096, item_chunk_size=65536, n_threads=4):
+    data = np.load(path)
+    index = ItemNeighbors(data['items_emb'], int(data['n_neighbors']), str(data['metric']), block_size, item_chunk_size, n_threads, build=False)
+    index.indptr = data['indptr']
+    index.indices = data['indices']
+    index.scores = data['scores']
+    return index
@@ -0,0 +1,108 @@
+import logging
+
+# live (n_nodes, embed_dim) tensors inside one layer of each aggregator: scaled input, N_h, scaled N_h, then
+# Aggregator: Linear input (graphsage concatenates), Linear output, activation (bi-interaction has two branches)
+LAYER_TABLES = {'unweighted': 3, 'gcn': 6, 'graphsage': 7, 'bi-interaction': 9}
+SCORE_COPIES = 3 # matmul output, float / sigmoid output, masked copy for topk
+
+
+class MemoryPlanner():
+
+    def __init__(self, model, budget_bytes, min_test_batch_size=256, max_batch_size=4096 * 8):
+        # estimates from graph and model shapes only, nothing is allocated
+        self.budget_bytes = budget_bytes
+        self.min_test_batch_size = min_test_batch_size
+        self.max_batch_size = max_batch_size
+        self.n_users = model.n_users
+        self.n_items = model.n_items
+        self.n_nodes = model.n_users + model.n_items
+        self.embed_dim = model.embed_dim
+        self.n_layers = model.n_layers
+        self.dtype_bytes = 4 # tables and messages stay float32 with use_bf16 (only autocast regions run in bfloat16)
+        self.itra_edges = model.itra_G.number_of_edges()
+        self.struc_edges = [g.number_of_edges() for g in model.struc_Gs] if model.struc_Gs is not None else []
+        self.aggregator_type = model.aggregate_layers_struc[0].aggregator_type
+        self.recompute = model.recompute
+        n_graphs = 1 + len(self.struc_edges)
+        # concat combine multiplies the scoring dimension
+        self.score_dim = self.embed_dim * n_graphs if model.combine_mode == 1 else self.embed_dim
+        self.param_bytes = sum(p.numel() * p.element_size() for p in model.parameters())
+
+    def table_bytes(self, n_rows=None):
+        return (self.n_nodes if n_rows is None else n_rows) * self.embed_dim * self.dtype_bytes
+
+    def propagation_bytes(self, n_edges, layer_tables, training, materialize_messages=False, recompute=None):
+        # all_embed keeps n_layers + 1 tables, torch.stack copies them once more, + the mean
+        # (with recompute the mean is a running sum, no stacked copy)
+        n_out_tables = self.n_layers + 2 if self.recompute is not None else 2 * (self.n_layers + 1) + 1
+        out = n_out_tables * self.table_bytes()
+        # DGL builtin sum is fused, a python reduce (AggregateUnweighted_p) materializes one message per edge
+        messages = n_edges * self.embed_dim * self.dtype_bytes if materialize_messages else 0
+        layer = layer_tables * self.table_bytes() + messages
+        if not training or recompute == 'layer':
+            # under no_grad only one layer is alive, with per layer recompute the backward rebuilds one layer at a time
+            return out + layer
+        # autograd keeps the intermediates of every layer
+        return out + self.n_layers * layer
+
+    def train_bytes(self, use_struc=True):
+        # parameters + grads + 2 Adam states, every graph propagated with autograd in bpr_loss
+        graphs = [(self.itra_edges, LAYER_TABLES['unweighted'])]
+        if use_struc:
+            graphs += [(n_edges, LAYER_TABLES.get(self.aggregator_type, 3)) for n_edges in self.struc_edges]
+        if self.recompute == 'graph':
+            # ego + propagated table kept per graph, one graph at a time is propagated again with autograd in backward
+            return 4 * self.param_bytes + len(graphs) * 2 * self.table_bytes() + max(
+                self.propagation_bytes(n_edges, layer_tables, True) for n_edges, layer_tables in graphs)
+        total = 4 * self.param_bytes
+        for n_edges, layer_tables in graphs:
+            total += self.propagation_bytes(n_edges, layer_tables, True, recompute=self.recompute)
+        return total
+
+    def final_embedding_bytes(self, use_struc=True):
+        # get_final_embedding under no_grad: struc results are kept until combined, + the combine stack
+        total = self.propagation_bytes(self.itra_edges, LAYER_TABLES['unweighted'], False, materialize_messages=True)
+        if use_struc and len(self.struc_edges) > 0:
+            n_graphs = 1 + len(self.struc_edges)
+            one_graph = max(self.propagation_bytes(n_edges, LAYER_TABLES.get(self.aggregator_type, 3), False) for n_edges in self.struc_edges)
+            total = max(total, one_graph) + n_graphs * self.table_bytes() + n_graphs * self.table_bytes()
+        return total
+
+    def scoring_bytes(self, batch_size, item_chunk_size=None):
+        # get_users_ratings: (batch_size, n_items) scores, float32 after the matmul
+        n_cols = self.n_items if item_chunk_size is None else item_chunk_size
+        return batch_size * n_cols * 4 * SCORE_COPIES + batch_size * self.score_dim * 4
+
+    def eval_bytes(self, batch_size):
+        # bpr_loss under no_grad after the final embedding: user / pos / neg rows of the final and the ego embedding
+        return batch_size * 3 * (self.score_dim * 4 + self.embed_dim * self.dtype_bytes)
+
+    def plan(self, use_struc=True):
+        # largest test batch whose scores fit next to the model state and one final embedding pass,
+        # item chunks when even min_test_batch_size full rows do not fit
+        resident = 4 * self.param_bytes + self.final_embedding_bytes(use_struc)
+        available = self.budget_bytes - resident
+        row_bytes = self.scoring_bytes(1)
+        test_batch_size = int(available // row_bytes) if available > 0 else 0
+        item_chunk_size = None
+        if test_batch_size < self.min_test_batch_size:
+            test_batch_size = self.min_test_batch_size
+            # largest chunk whose scores fit, at least one item when nothing fits (see the warning below)
+            chunk_bytes = available - self.scoring_bytes(self.min_test_batch_size, 0)
+            item_chunk_size = max(1, int(max(chunk_bytes, 0) // (self.min_test_batch_size * 4 * SCORE_COPIES)))
+            if item_chunk_size >= self.n_items:
+                item_chunk_size = None
+        test_batch_size = min(test_batch_size, self.max_batch_size)
+        # evaluate runs under no_grad: one final embedding pass + the gathered rows, not the training propagation
+        eval_batch_size = min(max(int(max(available, 0) // self.eval_bytes(1)), self.min_test_batch_size), self.max_batch_size)
+        plan = {'test_batch_size': test_batch_size, 'eval_batch_size': eval_batch_size, 'item_chunk_size': item_chunk_size}
+
+        logging.info('memory plan (budget %.2fGB): train propagation %.2fGB, final embedding %.2fGB, scoring %.2fGB -> %s' % (
+            self.budget_bytes / 2 ** 30, self.train_bytes(use_struc) / 2 ** 30, self.final_embedding_bytes(use_struc) / 2 ** 30,
+            self.scoring_bytes(test_batch_size, item_chunk_size) / 2 ** 30, str(plan)))
+        if self.scoring_bytes(test_batch_size, item_chunk_size) > available or self.eval_bytes(eval_batch_size) > available:
+            logging.warning('no test / eval batch fits the memory budget (%.2fGB left after the model state and one final embedding pass), '
+                            'the plan uses the minimum sizes, raise MEM_BUDGET_GB or reduce the model' % (available / 2 ** 30))
+        if self.train_bytes(use_struc) > self.budget_bytes:
+            logging.warning('training propagation is estimated above the memory budget, reduce LAYERS / M3LAYERS, use BF16 or RECOMPUTE')
+        return plan
@@ -1,8 +1,11 @@
 import torch
 import numpy as np
-from sklearn.metrics import roc_auc_score
 
 def precision_and_recall(batch_predict_items, batch_truth_items):
+    precision, recall = precision_and_recall_per_user(batch_predict_items, batch_truth_items)
+    return np.mean(precision).item(), np.mean(recall).item()
+
+def precision_and_recall_per_user(batch_predict_items, batch_truth_items):
     assert len(batch_predict_items) == len(batch_truth_items)
     precision = []
     recall = []
@@ -13,9 +16,12 @@ def precision_and_recall(batch_predict_items, batch_truth_items):
                 hit += 1
         precision.append(hit / len(predict_items))
         recall.append(hit / len(truth_items))
-    return np.mean(precision).item(), np.mean(recall).item()
+    return np.array(precision), np.array(recall)
 
 def ndcg(batch_predict_items, batch_truth_items):
+    return np.mean(ndcg_per_user(batch_predict_items, batch_truth_items))
+
+def ndcg_per_user(batch_predict_items, batch_truth_items):
     """
     Normalized Discounted Cumulative Gain
     rel_i = 1 or 0, so 2^{rel_i} - 1 = 1 or 0
@@ -38,12 +44,13 @@ def ndcg(batch_predict_items, batch_truth_items):
     idcg[idcg == 0.] = 1.
     ndcg = dcg/idcg
     ndcg[np.isnan(ndcg)] = 0.
-    return np.mean(ndcg)
+    return ndcg
 
 def auc(ratings, n_items, batch_truth_items):
     """
         design for a single user
     """
+    from sklearn.metrics import roc_auc_score # sklearn is slow to import and only needed with show_auc
     auc_scores = []
     for i, truth_items in enumerate(batch_truth_items):
         all_item_scores = ratings[i]
@@ -53,3 +60,39 @@ def auc(ratings, n_items, batch_truth_items):
         test_item_scores = all_item_scores[all_item_scores >= 0]
         auc_scores.append(roc_auc_score(r, test_item_scores))
     return np.mean(auc_scores).item()
+
+
+def degree_strata(degrees, n_strata=5):
+    """
+        stratum index of each user, strata are quantile bins of the training degree
+    """
+    bounds = np.quantile(degrees, np.linspace(0, 1, n_strata + 1)[1:-1])
+    return np.searchsorted(bounds, degrees, side='right')
+
+def stratified_sample(strata, n_sample):
+    """
+        proportional allocation (at least 1 per non-empty stratum), return sampled positions
+    """
+    sampled = []
+    for s in np.unique(strata):
+        members = np.nonzero(strata == s)[0]
+        n_s = max(1, int(round(n_sample * len(members) / len(strata))))
+        sampled.append(np.random.choice(members, min(n_s, len(members)), replace=False))
+    return np.concatenate(sampled)
+
+def stratified_mean_ci(values, sample_strata, strata_sizes, n_boot=1000, alpha=0.05):
+    """
+        stratified estimate of the population mean and its bootstrap (1 - alpha) interval,
+        values & sample_strata are per sampled user, strata_sizes[s] is the population size of stratum s
+    """
+    total = float(np.sum(strata_sizes))
+    estimate = 0.0
+    boot_estimates = np.zeros(n_boot)
+    for s in np.unique(sample_strata):
+        v = values[sample_strata == s]
+        weight = strata_sizes[s] / total
+        estimate += weight * np.mean(v)
+        boot_index = np.random.randint(0, len(v), (n_boot, len(v)))
+        boot_estimates += weight * np.mean(v[boot_index], axis=1)
+    low, high = np.quantile(boot_estimates, [alpha / 2, 1 - alpha / 2])
+    return estimate, low.item(), high.item()
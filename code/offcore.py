@@ -0,0 +1,230 @@
+import os
+
+import numpy as np
+import scipy.sparse as sp
+import torch
+import torch.nn as nn
+
+
+class RowStore():
+
+    def __init__(self, out_dir, n_rows, dim, hot_rows, init_bound=None, block_rows=2 ** 16):
+        # (n_rows, dim) float32 table + Adam m / v states in .npy memmaps under out_dir, the hot rows (e.g. the highest
+        # degree nodes) of all three are pinned in memory; existing files are reopened when init_bound is None
+        os.makedirs(out_dir, exist_ok=True)
+        self.out_dir = out_dir
+        self.n_rows = n_rows
+        self.dim = dim
+        self.arrays = {}
+        for name in ['table', 'm', 'v']:
+            path = os.path.join(out_dir, name + '.npy')
+            if init_bound is None:
+                self.arrays[name] = np.load(path, mmap_mode='r+')
+                assert self.arrays[name].shape == (n_rows, dim), path + ' has another shape'
+            else:
+                self.arrays[name] = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=(n_rows, dim)) # zero filled
+        if init_bound is not None:
+            # same init range as the full xavier table, written block by block
+            for start in range(0, n_rows, block_rows):
+                end = min(start + block_rows, n_rows)
+                self.arrays['table'][start:end] = np.random.uniform(-init_bound, init_bound, (end - start, dim))
+        # Adam step count of m / v (bias correction), saved by flush next to the tables
+        steps_path = os.path.join(out_dir, 'adam_steps.npy')
+        self.adam_steps = int(np.load(steps_path)) if init_bound is None and os.path.exists(steps_path) else 0
+        self.hot = np.unique(np.asarray(hot_rows, dtype=np.int64))
+        self.slot = np.full(n_rows, -1, dtype=np.int64)
+        self.slot[self.hot] = np.arange(len(self.hot))
+        self.cache = {name: np.array(array[self.hot]) for name, array in self.arrays.items()}
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.hit_rows = 0
+        self.miss_rows = 0
+        self.read_bytes = 0
+        self.write_bytes = 0
+
+    def stats(self):
+        n_rows = self.hit_rows + self.miss_rows
+        return {'hit_rate': self.hit_rows / n_rows if n_rows > 0 else 0.0, 'rows': n_rows,
+                'read_mb': self.read_bytes / 2 ** 20, 'write_mb': self.write_bytes / 2 ** 20,
+                'cache_mb': sum(c.nbytes for c in self.cache.values()) / 2 ** 20}
+
+    def read(self, rows, name='table'):
+        # rows: unique global ids, cold rows are read from the memmap in ascending order
+        out = np.empty((len(rows), self.dim), dtype=np.float32)
+        slot = self.slot[rows]
+        hot = slot >= 0
+        out[hot] = self.cache[name][slot[hot]]
+        cold = np.nonzero(~hot)[0]
+        cold = cold[np.argsort(rows[cold])]
+        out[cold] = self.arrays[name][rows[cold]]
+        if name == 'table':
+            self.hit_rows += int(hot.sum())
+            self.miss_rows += len(cold)
+        self.read_bytes += len(cold) * self.dim * 4
+        return out
+
+    def write(self, rows, values, name='table'):
+        slot = self.slot[rows]
+        hot = slot >= 0
+        self.cache[name][slot[hot]] = values[hot]
+        cold = np.nonzero(~hot)[0]
+        cold = cold[np.argsort(rows[cold])]
+        self.arrays[name][rows[cold]] = values[cold]
+        self.write_bytes += len(cold) * self.dim * 4
+
+    def flush(self):
+        # hot rows back to the files, call before reading the memmaps directly (propagate_to_file, checkpoints)
+        for name, array in self.arrays.items():
+            array[self.hot] = self.cache[name]
+            array.flush()
+        np.save(os.path.join(self.out_dir, 'adam_steps.npy'), np.array(self.adam_steps))
+
+
+class RowAdam():
+
+    def __init__(self, store, lr=0.001, betas=(0.9, 0.999), eps=1e-8):
+        # lazy Adam (as torch.optim.SparseAdam): only rows with a gradient are read, updated and written back,
+        # the step count lives in the store with m / v so a reopened store continues the same run
+        self.store = store
+        self.lr = lr
+        self.betas = betas
+        self.eps = eps
+
+    def step(self, rows, grad):
+        self.store.adam_steps += 1
+        n_steps = self.store.adam_steps
+        beta1, beta2 = self.betas
+        m = self.store.read(rows, 'm') * beta1 + (1 - beta1) * grad
+        v = self.store.read(rows, 'v') * beta2 + (1 - beta2) * grad * grad
+        step_size = self.lr * np.sqrt(1 - beta2 ** n_steps) / (1 - beta1 ** n_steps)
+        table = self.store.read(rows, 'table') - step_size * m / (np.sqrt(v) + self.eps)
+        self.store.write(rows, m, 'm')
+        self.store.write(rows, v, 'v')
+        self.store.write(rows, table.astype(np.float32), 'table')
+
+
+class OutOfCoreLightGCN():
+
+    def __init__(self, n_users, n_items, train_csr, store, n_layers=3, lam=1e-4, fanout=None):
+        # LightGCN trained on the sampled n_layers hop subgraph of each batch, only its rows are read from the store;
+        # fanout: neighbors sampled per node (with replacement, rescaled to the full degree), None for all neighbors
+        self.n_users = n_users
+        self.n_items = n_items
+        self.n_layers = n_layers
+        self.lam = lam
+        self.fanout = fanout
+        self.store = store
+        train_csr = sp.csr_matrix(train_csr, dtype=np.float32)
+        self.adj = sp.bmat([[None, train_csr], [train_csr.T, None]], format='csr') # users then items, item node id = n_users + item_id
+        self.degree = np.diff(self.adj.indptr)
+        self.sqrt_degree = np.zeros(n_users + n_items, dtype=np.float32)
+        self.sqrt_degree[self.degree > 0] = 1 / np.sqrt(self.degree[self.degree > 0])
+        self.touched_rows = 0
+
+    def sample_neighbors(self, nodes):
+        # (dst, src, weight) edges of nodes, weight = sampling rescale / sqrt(d_dst * d_src)
+        degree = self.degree[nodes]
+        n_sample = degree if self.fanout is None else np.minimum(degree, self.fanout)
+        dst = np.repeat(nodes, n_sample)
+        starts = np.concatenate(([0], np.cumsum(n_sample)[:-1]))
+        offset = np.arange(len(dst)) - np.repeat(starts, n_sample)
+        sampled = np.repeat(degree > n_sample, n_sample)
+        offset[sampled] = (np.random.random(sampled.sum()) * np.repeat(degree, n_sample)[sampled]).astype(np.int64)
+        src = self.adj.indices[np.repeat(self.adj.indptr[nodes], n_sample) + offset].astype(np.int64)
+        scale = np.repeat(degree / np.maximum(n_sample, 1), n_sample)
+        weight = (scale * self.sqrt_degree[dst] * self.sqrt_degree[src]).astype(np.float32)
+        return dst, src, weight
+
+    def sample_subgraph(self, seeds):
+        # hop by hop: edges of the new frontier, after n_layers hops every layer of the seeds is computable
+        nodes = np.unique(seeds)
+        frontier = nodes
+        edges = []
+        for k in range(self.n_layers):
+            dst, src, weight = self.sample_neighbors(frontier)
+            edges.append((dst, src, weight))
+            frontier = np.setdiff1d(np.unique(src), nodes, assume_unique=True)
+            nodes = np.union1d(nodes, frontier)
+        dst, src, weight = [np.concatenate(e) for e in zip(*edges)]
+        return nodes, np.searchsorted(nodes, dst), np.searchsorted(nodes, src), weight
+
+    def propagate(self, ego_embed, dst, src, weight):
+        # exact for the seeds (with fanout None), other local rows are partial and unused
+        dst = torch.from_numpy(dst)
+        src = torch.from_numpy(src)
+        weight = torch.from_numpy(weight).unsqueeze(-1)
+        embed = ego_embed
+        sum_embed = ego_embed
+        for k in range(self.n_layers):
+            embed = torch.zeros_like(ego_embed).index_add_(0, dst, embed[src] * weight)
+            sum_embed = sum_embed + embed
+        return sum_embed / (self.n_layers + 1)
+
+    def train_step(self, users, pos, neg, optimizer):
+        # global ids of one batch: users (batch_size, ), pos (batch_size, ), neg (batch_size, )
+        users = np.asarray(users, dtype=np.int64)
+        pos = np.asarray(pos, dtype=np.int64) + self.n_users
+        neg = np.asarray(neg, dtype=np.int64) + self.n_users
+        nodes, dst, src, weight = self.sample_subgraph(np.concatenate((users, pos, neg)))
+        self.touched_rows += len(nodes)
+        ego_embed = torch.from_numpy(self.store.read(nodes)).requires_grad_()
+        propagated_embed = self.propagate(ego_embed, dst, src, weight)
+
+        users, pos, neg = [torch.from_numpy(np.searchsorted(nodes, x)) for x in (users, pos, neg)]
+        reg_loss = ego_embed[users].norm(2).pow(2) + ego_embed[pos].norm(2).pow(2) + ego_embed[neg].norm(2).pow(2)
+        users_emb = propagated_embed[users]
+        pos_scores = torch.sum(users_emb * propagated_embed[pos], dim=1)
+        neg_scores = torch.sum(users_emb * propagated_embed[neg], dim=1)
+        loss = torch.mean(nn.functional.softplus(neg_scores - pos_scores))
+        reg_loss = (1/2) * reg_loss / float(len(users))
+        loss = loss + self.lam * reg_loss
+        loss.backward()
+
+        grad = ego_embed.grad.numpy()
+        has_grad = np.any(grad != 0, axis=1)
+        optimizer.step(nodes[has_grad], grad[has_grad])
+        return loss.item()
+
+    def propagate_to_file(self, out_dir, block_rows=2 ** 16, max_cols=2 ** 16):
+        # exact full graph propagation, one layer at a time over row blocks of the normalized adjacency, the input rows a
+        # block needs are read max_cols at a time (a user block touches most items), writes users_emb.npy / items_emb.npy
+        # (the layout of batch_topk) with at most (block_rows + max_cols) rows in memory
+        self.store.flush()
+        n_nodes = self.n_users + self.n_items
+        dim = self.store.dim
+        norm_adj = sp.diags(self.sqrt_degree) @ self.adj @ sp.diags(self.sqrt_degree)
+        norm_adj = sp.csr_matrix(norm_adj, dtype=np.float32)
+        sum_embed = np.lib.format.open_memmap(os.path.join(out_dir, 'propagated_sum.npy'), mode='w+', dtype=np.float32, shape=(n_nodes, dim))
+        layers = [np.lib.format.open_memmap(os.path.join(out_dir, 'layer_%d.npy' % i), mode='w+', dtype=np.float32, shape=(n_nodes, dim)) for i in range(2)]
+        prev = self.store.arrays['table']
+        for start in range(0, n_nodes, block_rows):
+            sum_embed[start:start + block_rows] = prev[start:start + block_rows]
+        for k in range(self.n_layers):
+            cur = layers[k % 2]
+            for start in range(0, n_nodes, block_rows):
+                block = norm_adj[start:start + block_rows].tocoo()
+                cols, inverse = np.unique(block.col, return_inverse=True)
+                out = np.zeros((block.shape[0], dim), dtype=np.float32)
+                for col_start in range(0, len(cols), max_cols):
+                    mask = (inverse >= col_start) & (inverse < col_start + max_cols)
+                    sub_cols = cols[col_start:col_start + max_cols]
+                    sub_block = sp.csr_matrix((block.data[mask], (block.row[mask], inverse[mask] - col_start)), shape=(block.shape[0], len(sub_cols)))
+                    out += sub_block @ prev[sub_cols]
+                cur[start:start + block.shape[0]] = out
+                sum_embed[start:start + block.shape[0]] += out
+            prev = cur
+        users_emb = np.lib.format.open_memmap(os.path.join(out_dir, 'users_emb.npy'), mode='w+', dtype=np.float32, shape=(self.n_users, dim))
+        items_emb = np.lib.format.open_memmap(os.path.join(out_dir, 'items_emb.npy'), mode='w+', dtype=np.float32, shape=(self.n_items, dim))
+        for start in range(0, n_nodes, block_rows):
+            end = min(start + block_rows, n_nodes)
+            block = sum_embed[start:end] / (self.n_layers + 1)
+            if start < self.n_users:
+                users_emb[start:min(end, self.n_users)] = block[:self.n_users - start]
+            if end > self.n_users:
+                items_emb[max(start, self.n_users) - self.n_users:end - self.n_users] = block[max(self.n_users - start, 0):]
+        users_emb.flush()
+        items_emb.flush()
+        for name in ['propagated_sum.npy', 'layer_0.npy', 'layer_1.npy']:
+            os.remove(os.path.join(out_dir, name))
+        return users_emb, items_emb
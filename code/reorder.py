@@ -0,0 +1,83 @@
+import time
+
+import dgl
+import numpy as np
+import scipy.sparse as sp
+import torch
+from scipy.sparse.csgraph import reverse_cuthill_mckee
+
+
+class NodeOrder():
+
+    def __init__(self, user_new2old, item_new2old):
+        # users are permuted among users and items among items, so item node id = n_users + item_id still holds
+        self.n_users = len(user_new2old)
+        self.n_items = len(item_new2old)
+        self.user_new2old = np.asarray(user_new2old, dtype=np.int64)
+        self.item_new2old = np.asarray(item_new2old, dtype=np.int64)
+        self.user_old2new = np.argsort(self.user_new2old)
+        self.item_old2new = np.argsort(self.item_new2old)
+        self.node_new2old = torch.from_numpy(np.concatenate((self.user_new2old, self.item_new2old + self.n_users)))
+        self.node_old2new = torch.from_numpy(np.concatenate((self.user_old2new, self.item_old2new + self.n_users)))
+
+    def users_to_old(self, user_ids):
+        return self.user_new2old[user_ids]
+
+    def items_to_old(self, item_ids):
+        return self.item_new2old[item_ids]
+
+    def users_to_new(self, user_ids):
+        return self.user_old2new[user_ids]
+
+    def items_to_new(self, item_ids):
+        return self.item_old2new[item_ids]
+
+    def permute_embedding(self, table):
+        # (n_users + n_items, dim) table in original ids -> new ids
+        return table[self.node_new2old.to(table.device)]
+
+    def restore_embedding(self, table):
+        # new ids -> original ids, keeps dumped checkpoints independent of the order
+        return table[self.node_old2new.to(table.device)]
+
+    def permute_graph(self, g):
+        # relabel a graph over the (n_users + n_items) nodes, node & edge features follow
+        src, dst = g.all_edges(order='eid')
+        node_old2new = self.node_old2new.to(src.device)
+        new_g = dgl.DGLGraph()
+        new_g.add_nodes(g.number_of_nodes())
+        new_g.add_edges(node_old2new[src], node_old2new[dst])
+        new_g.readonly()
+        for key in g.ndata.keys():
+            new_g.ndata[key] = g.ndata[key][self.node_new2old.to(g.ndata[key].device)]
+        new_g.ndata['id'] = torch.arange(g.number_of_nodes(), dtype=torch.long, device=g.ndata['id'].device)
+        for key in g.edata.keys():
+            new_g.edata[key] = g.edata[key]
+        return new_g
+
+
+def degree_order(train_csr):
+    # high degree first, hot rows of the embedding table become contiguous
+    user_degrees = np.diff(train_csr.indptr)
+    item_degrees = np.bincount(train_csr.indices, minlength=train_csr.shape[1])
+    return np.argsort(-user_degrees, kind='stable'), np.argsort(-item_degrees, kind='stable')
+
+
+def rcm_order(train_csr):
+    # reverse Cuthill-McKee on the bipartite graph, neighbors get close ids, then split back to users / items
+    n_users = train_csr.shape[0]
+    adj = sp.bmat([[None, train_csr], [train_csr.T, None]], format='csr')
+    perm = reverse_cuthill_mckee(adj, symmetric_mode=True)
+    return perm[perm < n_users], perm[perm >= n_users] - n_users
+
+
+def get_node_order(data_set, method='degree'):
+    time_start = time.time()
+    if method == 'degree':
+        user_new2old, item_new2old = degree_order(data_set.get_train_csr())
+    elif method == 'rcm':
+        user_new2old, item_new2old = rcm_order(data_set.get_train_csr())
+    else:
+        assert False, 'not support this node order: ' + str(method)
+    print('node order', method, 'time:', time.time() - time_start)
+    return NodeOrder(user_new2old, item_new2old)
@@ -0,0 +1,100 @@
+import time
+
+import numpy as np
+from scipy.stats import spearmanr
+from sklearn.neighbors import NearestNeighbors
+
+
+def degree_histograms(degreeList, n_nodes, n_bins=16):
+    # (n_layers, n_nodes, n_bins) log1p of the log2 binned degree counts of every BFS ring, + (n_layers, n_nodes) ring exists
+    n_layers = max(max(layers.keys()) for layers in degreeList.values()) + 1
+    hist = np.zeros((n_layers, n_nodes, n_bins), dtype=np.float32)
+    has_layer = np.zeros((n_layers, n_nodes), dtype=bool)
+    for v, layers in degreeList.items():
+        for layer, ordered_degrees in layers.items():
+            if len(ordered_degrees) == 0:
+                continue
+            ordered_degrees = np.array(ordered_degrees)
+            if ordered_degrees.ndim == 2: # opt1_reduce_len: (degree, count)
+                degrees, counts = ordered_degrees[:, 0], ordered_degrees[:, 1]
+            else:
+                degrees, counts = ordered_degrees, np.ones(len(ordered_degrees))
+            bins = np.minimum(np.log2(np.maximum(degrees, 1)).astype(np.int64), n_bins - 1)
+            np.add.at(hist[layer, v], bins, counts)
+            has_layer[layer, v] = True
+    return np.log1p(hist), has_layer
+
+
+def group_pairs(pairs):
+    # {v: [neighbors]} of undirected pairs, the layers_adj layout
+    src = np.concatenate((pairs[:, 0], pairs[:, 1]))
+    dst = np.concatenate((pairs[:, 1], pairs[:, 0]))
+    order = np.argsort(src, kind='stable')
+    src = src[order]
+    dst = dst[order]
+    starts = np.concatenate(([0], np.nonzero(src[1:] != src[:-1])[0] + 1)) if len(src) > 0 else np.zeros(0, dtype=np.int64)
+    ends = np.append(starts[1:], len(src))
+    return {src[s].item(): dst[s:e].tolist() for s, e in zip(starts.tolist(), ends.tolist())}
+
+
+def sketch_context_graph(degreeList, n_nodes, n_users, adj, n_neighbors=10, n_bins=16, require_common_neighbor=True, workers=4):
+    # approximate Struc2Vec.create_context_graph: k-NN over degree histograms instead of a DTW per candidate pair
+    # adj: (n_nodes, n_nodes) CSR of the interaction graph
+    time_start = time.time()
+    hist, has_layer = degree_histograms(degreeList, n_nodes, n_bins)
+    n_layers = hist.shape[0]
+    # the distance of layer k accumulates layers 0..k (convert_dtw_struc_dist), the deepest one is the search key
+    key = hist.transpose(1, 0, 2).reshape(n_nodes, -1)
+    pairs = []
+    for part in (np.arange(n_users), np.arange(n_users, n_nodes)): # users with users, items with items, like get_vertices
+        knn = NearestNeighbors(n_neighbors=min(n_neighbors + 1, len(part)), metric='manhattan', n_jobs=workers).fit(key[part])
+        index = knn.kneighbors(key[part], return_distance=False)
+        v1 = np.repeat(part, index.shape[1])
+        v2 = part[index.reshape(-1)]
+        mask = v1 != v2
+        pairs.append(np.stack((np.minimum(v1, v2)[mask], np.maximum(v1, v2)[mask]), 1))
+    pairs = np.unique(np.concatenate(pairs), axis=0)
+    if require_common_neighbor:
+        # get_vertices only keeps candidates sharing a neighbor
+        common = np.asarray(adj[pairs[:, 0]].multiply(adj[pairs[:, 1]]).sum(1)).reshape(-1) > 0
+        pairs = pairs[common]
+
+    layers_adj = {}
+    layers_sim_scores = {}
+    distance = np.zeros(len(pairs))
+    for layer in range(n_layers):
+        valid = has_layer[layer, pairs[:, 0]] & has_layer[layer, pairs[:, 1]]
+        distance = distance + np.abs(hist[layer, pairs[:, 0]] - hist[layer, pairs[:, 1]]).sum(1)
+        layer_pairs = pairs[valid]
+        if len(layer_pairs) == 0:
+            continue
+        scores = np.exp(-distance[valid] / 2)
+        layers_sim_scores[layer] = dict(zip(zip(layer_pairs[:, 0].tolist(), layer_pairs[:, 1].tolist()), scores.tolist()))
+        layers_adj[layer] = group_pairs(layer_pairs)
+    print('sketch context graph time:', time.time() - time_start, ', pairs', len(pairs))
+    return layers_adj, layers_sim_scores
+
+
+def undirected_pairs(sim_scores):
+    # {(min, max): score}, DTW keys (v, candidate) come in both orientations, the first one is kept
+    pairs = {}
+    for (v1, v2), score in sim_scores.items():
+        pairs.setdefault((min(v1, v2), max(v1, v2)), score)
+    return pairs
+
+
+def compare_layers(layers_sim_scores, reference_sim_scores):
+    # agreement with the reference (DTW) layers: pair precision / recall and spearman of the scores on shared pairs
+    result = {}
+    for layer in sorted(reference_sim_scores.keys()):
+        reference = undirected_pairs(reference_sim_scores[layer])
+        approx = undirected_pairs(layers_sim_scores.get(layer, {}))
+        shared = [pair for pair in approx if pair in reference]
+        precision = len(shared) / len(approx) if len(approx) > 0 else 0.0
+        recall = len(shared) / len(reference) if len(reference) > 0 else 0.0
+        if len(shared) > 1:
+            rho = spearmanr([approx[pair] for pair in shared], [reference[pair] for pair in shared])[0]
+        else:
+            rho = float('nan')
+        result[layer] = {'pairs': len(approx), 'reference_pairs': len(reference), 'precision': precision, 'recall': recall, 'spearman': rho}
+    return result
@@ -10,8 +10,8 @@ import dgl
 import torch
 import numpy as np
 import pandas as pd
+import scipy.sparse as sp
 from fastdtw import fastdtw
-from gensim.models import Word2Vec
 from joblib import Parallel, delayed
 from tqdm import tqdm
 
@@ -19,7 +19,7 @@ from .utils import partition_dict, partition_list, preprocess_nxgraph
 
 
 class Struc2Vec():
-    def __init__(self, graph, n_users, workers=1, verbose=0, opt1_reduce_len=True, opt2_reduce_sim_calc=True, opt3_num_layers=None, temp_path='./temp_struc2vec_ng/', reuse=False):
+    def __init__(self, graph, n_users, workers=1, verbose=0, opt1_reduce_len=True, opt2_reduce_sim_calc=True, opt3_num_layers=None, temp_path='./temp_struc2vec_ng/', reuse=False, engine='dtw', sketch_neighbors=10):
     # def __init__(self, graph, n_users, workers=1, verbose=0, opt1_reduce_len=True, opt2_reduce_sim_calc=True, opt3_num_layers=None, temp_path='../temp_struc2vec_ng/', reuse=False):
         self.graph = graph
         self.n_users = n_users
@@ -32,6 +32,10 @@ class Struc2Vec():
 
         self.resue = reuse
         self.temp_path = temp_path
+        # dtw: exact DTW per candidate pair, sketch: k-NN over log binned degree histograms (see sketch.py)
+        self.engine = engine
+        self.sketch_neighbors = sketch_neighbors
+        suffix = '' if engine == 'dtw' else '_' + engine
 
         if not os.path.exists(self.temp_path):
             os.mkdir(self.temp_path)
@@ -39,14 +43,19 @@ class Struc2Vec():
             shutil.rmtree(self.temp_path)
             os.mkdir(self.temp_path)
 
-        if os.path.exists(self.temp_path + 'layers_adj.pkl') and os.path.exists(self.temp_path + 'layers_sim_scores.pkl'):
+        if os.path.exists(self.temp_path + 'layers_adj' + suffix + '.pkl') and os.path.exists(self.temp_path + 'layers_sim_scores' + suffix + '.pkl'):
             print('----- reuse exist layers_adj and layers_sim_scores')
-            self.layers_adj = pd.read_pickle(self.temp_path + 'layers_adj.pkl')
-            self.layers_sim_scores = pd.read_pickle(self.temp_path + 'layers_sim_scores.pkl')
+            self.layers_adj = pd.read_pickle(self.temp_path + 'layers_adj' + suffix + '.pkl')
+            self.layers_sim_scores = pd.read_pickle(self.temp_path + 'layers_sim_scores' + suffix + '.pkl')
         else:
-            self.layers_adj, self.layers_sim_scores = self.create_context_graph(self.opt3_num_layers, workers, verbose)
-            pd.to_pickle(self.layers_adj, self.temp_path + 'layers_adj.pkl')
-            pd.to_pickle(self.layers_sim_scores, self.temp_path + 'layers_sim_scores.pkl')
+            if engine == 'dtw':
+                self.layers_adj, self.layers_sim_scores = self.create_context_graph(self.opt3_num_layers, workers, verbose)
+            elif engine == 'sketch':
+                self.layers_adj, self.layers_sim_scores = self.create_sketch_context_graph(self.opt3_num_layers, workers, verbose)
+            else:
+                assert False, 'not support this struc2vec engine: ' + str(engine)
+            pd.to_pickle(self.layers_adj, self.temp_path + 'layers_adj' + suffix + '.pkl')
+            pd.to_pickle(self.layers_sim_scores, self.temp_path + 'layers_sim_scores' + suffix + '.pkl')
 
     # def get_sumed_struc_graph(self):
     #     # build dgl graph of each layer and sum the weight to one
@@ -144,12 +153,38 @@ class Struc2Vec():
             struc_graphs.append(g)
         return struc_graphs
 
+    def get_walk_embedding(self, embed_dim=64, num_walks=10, walk_length=80, stay_prob=0.3, window_size=5, w2v_iter=5, workers=4):
+        # classic struc2vec embedding: biased walks over the multi-layer graph + skip-gram, (n_nodes, embed_dim) tensor by node id
+        from .walker import train_walk_embedding # gensim
+        embedding = train_walk_embedding(self.layers_adj, self.layers_sim_scores, len(self.idx), embed_dim=embed_dim, num_walks=num_walks,
+                                         walk_length=walk_length, stay_prob=stay_prob, window_size=window_size, w2v_iter=w2v_iter, workers=workers)
+        return torch.from_numpy(embedding)
+
     def create_context_graph(self, max_num_layers, workers=1, verbose=0,):
         print(str(time.asctime(time.localtime(time.time()))) + ' create_context_graph')
         pair_distances = self._compute_structural_distance(max_num_layers, workers, verbose)
         layers_adj, layers_sim_scores = self._get_layer_rep(pair_distances)
         return layers_adj, layers_sim_scores
 
+    def create_sketch_context_graph(self, max_num_layers, workers=1, verbose=0):
+        from .sketch import sketch_context_graph # sklearn
+        print(str(time.asctime(time.localtime(time.time()))) + ' create_sketch_context_graph')
+        degreeList = self._get_degreelist(max_num_layers, workers, verbose)
+        edges = np.array([(self.node2idx[a], self.node2idx[b]) for a, b in self.graph.edges()], dtype=np.int64).reshape(-1, 2)
+        n_nodes = len(self.idx)
+        adj = sp.csr_matrix((np.ones(2 * len(edges), dtype=np.float32), (np.concatenate((edges[:, 0], edges[:, 1])), np.concatenate((edges[:, 1], edges[:, 0])))), shape=(n_nodes, n_nodes))
+        return sketch_context_graph(degreeList, n_nodes, self.n_users, adj, n_neighbors=self.sketch_neighbors, workers=workers)
+
+    def _get_degreelist(self, max_num_layers, workers=1, verbose=0):
+        if os.path.exists(self.temp_path + 'degreelist.pkl'):
+            print('----- read degreelist')
+            degreeList = pd.read_pickle(self.temp_path + 'degreelist.pkl')
+        else:
+            print('----- train degreelist')
+            degreeList = self._compute_ordered_degreelist(max_num_layers, workers, verbose)
+            pd.to_pickle(degreeList, self.temp_path + 'degreelist.pkl')
+        return degreeList
+
     def _compute_structural_distance(self, max_num_layers, workers=1, verbose=0,):
         print(str(time.asctime(time.localtime(time.time()))) + ' _compute_structural_distance')
 
@@ -162,13 +197,7 @@ class Struc2Vec():
             else:
                 dist_func = cost
 
-            if os.path.exists(self.temp_path + 'degreelist.pkl'):
-                print('----- read degreelist')
-                degreeList = pd.read_pickle(self.temp_path + 'degreelist.pkl')
-            else:
-                print('----- train degreelist')
-                degreeList = self._compute_ordered_degreelist(max_num_layers, workers, verbose)
-                pd.to_pickle(degreeList, self.temp_path + 'degreelist.pkl')
+            degreeList = self._get_degreelist(max_num_layers, workers, verbose)
 
             if self.opt2_reduce_sim_calc:
                 print('start len_nbs_list')
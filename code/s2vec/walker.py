@@ -0,0 +1,206 @@
+import math
+import time
+import multiprocessing as mp
+
+import gensim
+import numpy as np
+from gensim.models import Word2Vec
+
+
+class LayerTable():
+
+    def __init__(self, n_nodes, pairs, scores):
+        # one struc2vec layer as CSR rows of (neighbor, similarity) with a per row alias table
+        # pairs: (m, 2) node pairs, scores: (m, ) similarity, every pair is an undirected edge
+        src = np.concatenate((pairs[:, 0], pairs[:, 1]))
+        dst = np.concatenate((pairs[:, 1], pairs[:, 0]))
+        weight = np.concatenate((scores, scores))
+        order = np.argsort(src, kind='stable')
+        self.indices = dst[order]
+        self.weight = weight[order]
+        self.degree = np.bincount(src, minlength=n_nodes)
+        self.indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+        np.cumsum(self.degree, out=self.indptr[1:])
+        self.prob, self.alias = build_alias_rows(self.indptr, self.weight)
+        # move up probability of struc2vec: x / (x + 1), x = log(number of edges above the layer mean weight + e)
+        above = np.bincount(src[weight > weight.mean()], minlength=n_nodes) if len(weight) > 0 else np.zeros(n_nodes)
+        x = np.log(above + math.e)
+        self.up_prob = x / (x + 1)
+
+    def step(self, nodes, rng):
+        # one weighted neighbor of every node, O(1) each, nodes without neighbor stay
+        next_nodes = nodes.copy()
+        has = self.degree[nodes] > 0
+        nodes = nodes[has]
+        pos = self.indptr[nodes] + (rng.random(len(nodes)) * self.degree[nodes]).astype(np.int64)
+        accept = rng.random(len(nodes)) < self.prob[pos]
+        pos = np.where(accept, pos, self.indptr[nodes] + self.alias[pos])
+        next_nodes[has] = self.indices[pos]
+        return next_nodes
+
+
+def segment_cumsum(x, segment):
+    # inclusive prefix sum restarting at every segment, segment ids sorted
+    total = np.cumsum(x)
+    first = np.searchsorted(segment, segment, side='left')
+    return total - total[first] + x[first]
+
+
+def build_alias_rows(indptr, weight):
+    # alias table of every CSR row at once (sweep construction), alias holds the position inside the row:
+    # light entries (scaled weight < 1) take their alias from the heavy entry whose running excess covers the start of
+    # their deficit, a heavy entry overdrawn below 1 is topped up by the next heavy entry of its row
+    n_rows = len(indptr) - 1
+    degree = np.diff(indptr)
+    row = np.repeat(np.arange(n_rows), degree)
+    pos = np.arange(len(weight)) - indptr[row]
+    row_sum = np.bincount(row, weights=weight, minlength=n_rows)
+    scaled = weight * degree[row] / row_sum[row]
+    prob = np.ones(len(weight), dtype=np.float64)
+    alias = pos.copy()
+    light = np.nonzero(scaled < 1)[0]
+    heavy = np.nonzero(scaled >= 1)[0] # every non empty row has one
+    if len(light) == 0:
+        return prob, alias
+    light_row = row[light]
+    heavy_row = row[heavy]
+    deficit_end = segment_cumsum(1 - scaled[light], light_row)
+    deficit_start = deficit_end - (1 - scaled[light])
+    excess_end = segment_cumsum(scaled[heavy] - 1, heavy_row)
+    # rows apart by more than any prefix sum, so one searchsorted serves all rows
+    span = degree.max() + 2.0
+    start_key = light_row * span + deficit_start
+    excess_key = heavy_row * span + excess_end
+    last_heavy = np.searchsorted(heavy_row, np.arange(n_rows), side='right') - 1
+
+    giver = np.minimum(np.searchsorted(excess_key, start_key, side='right'), last_heavy[light_row]) # rounding
+    prob[light] = scaled[light]
+    alias[light] = pos[heavy[giver]]
+
+    # deficit taken from heavy j and its predecessors beyond their excess: end of the last light served up to j - excess_end[j]
+    served = np.searchsorted(start_key, excess_key, side='left') - 1
+    same_row = (served >= 0) & (light_row[np.maximum(served, 0)] == heavy_row)
+    overdraw = np.where(same_row, deficit_end[np.maximum(served, 0)] - excess_end, 0)
+    has_next = np.arange(len(heavy)) < last_heavy[heavy_row]
+    topped = (overdraw > 0) & has_next
+    prob[heavy[topped]] = np.clip(1 - overdraw[topped], 0, 1)
+    alias[heavy[topped]] = pos[heavy[np.nonzero(topped)[0] + 1]]
+    return prob, alias
+
+
+def build_layer_tables(layers_adj, layers_sim_scores, n_nodes):
+    # layers_sim_scores[layer]: {(v1, v2): similarity}, the layers of Struc2Vec
+    tables = []
+    for layer in sorted(layers_adj.keys()):
+        layer_sim_scores = layers_sim_scores[layer]
+        pairs = np.array(list(layer_sim_scores.keys()), dtype=np.int64).reshape(-1, 2)
+        scores = np.fromiter(layer_sim_scores.values(), dtype=np.float64, count=len(layer_sim_scores))
+        tables.append(LayerTable(n_nodes, pairs, scores))
+    return tables
+
+
+def walk_batch(tables, starts, walk_length, stay_prob, rng):
+    # all walkers advance together: optional layer change (up / down with the struc2vec probabilities), then one step in the layer
+    # unlike the sequential struc2vec walk, a layer change is always followed by a step so every walk has walk_length nodes
+    n_layers = len(tables)
+    up_prob = np.stack([table.up_prob for table in tables])
+    walks = np.empty((len(starts), walk_length), dtype=np.int64)
+    nodes = starts.copy()
+    layers = np.zeros(len(starts), dtype=np.int64)
+    walks[:, 0] = nodes
+    for step in range(1, walk_length):
+        if n_layers > 1:
+            move = np.nonzero(rng.random(len(nodes)) > stay_prob)[0]
+            up = rng.random(len(move)) < up_prob[layers[move], nodes[move]]
+            layers[move] = np.clip(layers[move] + np.where(up, 1, -1), 0, n_layers - 1)
+        for k in range(n_layers):
+            walkers = np.nonzero(layers == k)[0]
+            if len(walkers) > 0:
+                nodes[walkers] = tables[k].step(nodes[walkers], rng)
+        walks[:, step] = nodes
+    return walks
+
+
+# set once per worker process by the pool initializer
+_tables = None
+
+
+def init_walk_worker(tables):
+    global _tables
+    _tables = tables
+
+
+def walk_job(args):
+    starts, walk_length, stay_prob, seed = args
+    return walk_batch(_tables, starts, walk_length, stay_prob, np.random.default_rng(seed)).astype(np.int32)
+
+
+class WalkCorpus():
+    # restartable iterable of walks for Word2Vec: every pass regenerates the same walks (fixed seeds),
+    # at most 2 * workers batches of batch_walkers walks exist at a time; the walk pool is spawned (not forked, gensim
+    # threads are alive while the corpus is read) on the first pass, gets the tables once and is reused, call close()
+
+    def __init__(self, tables, n_nodes, num_walks=10, walk_length=80, stay_prob=0.3, batch_walkers=10000, workers=4, seed=2020):
+        self.tables = tables
+        self.n_nodes = n_nodes
+        self.num_walks = num_walks
+        self.walk_length = walk_length
+        self.stay_prob = stay_prob
+        self.batch_walkers = batch_walkers
+        self.workers = workers
+        self.seed = seed
+        self.tokens = [str(v) for v in range(n_nodes)]
+        self.pool = None
+
+    def jobs(self):
+        jobs = []
+        for r in range(self.num_walks):
+            starts = np.random.default_rng(self.seed + r).permutation(self.n_nodes)
+            for start in range(0, self.n_nodes, self.batch_walkers):
+                jobs.append((starts[start:start + self.batch_walkers], self.walk_length, self.stay_prob, self.seed * 100003 + len(jobs)))
+        return jobs
+
+    def walk_batches(self):
+        jobs = self.jobs()
+        if self.workers <= 1:
+            init_walk_worker(self.tables)
+            for job in jobs:
+                yield walk_job(job)
+            return
+        if self.pool is None:
+            self.pool = mp.get_context('spawn').Pool(self.workers, initializer=init_walk_worker, initargs=(self.tables, ))
+        window = 2 * self.workers
+        for start in range(0, len(jobs), window):
+            for walks in self.pool.map(walk_job, jobs[start:start + window]):
+                yield walks
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def __iter__(self):
+        tokens = self.tokens
+        for walks in self.walk_batches():
+            for walk in walks.tolist():
+                yield [tokens[v] for v in walk]
+
+
+def train_walk_embedding(layers_adj, layers_sim_scores, n_nodes, embed_dim=64, num_walks=10, walk_length=80, stay_prob=0.3,
+                         window_size=5, w2v_iter=5, workers=4, batch_walkers=10000, seed=2020):
+    # skip-gram over struc2vec walks, returns a (n_nodes, embed_dim) float32 array indexed by node id
+    time_start = time.time()
+    tables = build_layer_tables(layers_adj, layers_sim_scores, n_nodes)
+    print('build layer alias tables time:', time.time() - time_start)
+    corpus = WalkCorpus(tables, n_nodes, num_walks, walk_length, stay_prob, batch_walkers, workers, seed)
+    time_start = time.time()
+    try:
+        if int(gensim.__version__.split('.')[0]) >= 4:
+            model = Word2Vec(corpus, vector_size=embed_dim, window=window_size, min_count=0, sg=1, hs=0, workers=workers, epochs=w2v_iter, seed=seed)
+        else:
+            model = Word2Vec(corpus, size=embed_dim, window=window_size, min_count=0, sg=1, hs=0, workers=workers, iter=w2v_iter, seed=seed)
+    finally:
+        corpus.close()
+    print('walk & word2vec time:', time.time() - time_start)
+    return np.stack([model.wv[token] for token in corpus.tokens]).astype(np.float32)
@@ -0,0 +1,146 @@
+import queue
+import threading
+
+import numpy as np
+import torch
+
+
+class AliasTable():
+
+    def __init__(self, probs):
+        # Vose alias method, O(n) build, O(1) per sample
+        n = len(probs)
+        probs = np.asarray(probs, dtype=np.float64)
+        scaled = probs * n / probs.sum()
+        self.prob = np.ones(n, dtype=np.float64)
+        self.alias = np.arange(n, dtype=np.int64)
+        small = list(np.nonzero(scaled < 1)[0])
+        large = list(np.nonzero(scaled >= 1)[0])
+        while len(small) > 0 and len(large) > 0:
+            s = small.pop()
+            l = large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] = scaled[l] + scaled[s] - 1
+            if scaled[l] < 1:
+                small.append(l)
+            else:
+                large.append(l)
+        # left over entries are 1 up to rounding error
+
+    def sample(self, size):
+        index = np.random.randint(0, len(self.prob), size)
+        accept = np.random.random(size) < self.prob[index]
+        return np.where(accept, index, self.alias[index])
+
+
+class UniformNegativeSampler():
+
+    def __init__(self, train_data, n_items):
+        # sorted user * n_items + item keys of train edges for vectorized membership test
+        self.n_items = n_items
+        self.train_keys = np.unique(train_data[0].astype(np.int64) * n_items + train_data[1])
+
+    def is_positive(self, users, items):
+        keys = users.astype(np.int64) * self.n_items + items
+        pos = np.searchsorted(self.train_keys, keys)
+        pos[pos == len(self.train_keys)] = 0
+        return self.train_keys[pos] == keys
+
+    def draw(self, size):
+        return np.random.randint(0, self.n_items, size)
+
+    def sample(self, users, pos_items):
+        negs = self.draw(len(users))
+        rejected = np.nonzero(self.is_positive(users, negs))[0]
+        while len(rejected) > 0: # resample only the rejected ones
+            negs[rejected] = self.draw(len(rejected))
+            rejected = rejected[self.is_positive(users[rejected], negs[rejected])]
+        return negs
+
+
+class PopularityNegativeSampler(UniformNegativeSampler):
+
+    def __init__(self, train_data, n_items, alpha=0.75):
+        # item drawn with probability ~ train degree ^ alpha, positives of the user excluded
+        super(PopularityNegativeSampler, self).__init__(train_data, n_items)
+        item_degree = np.bincount(train_data[1], minlength=n_items).astype(np.float64)
+        self.alias_table = AliasTable(np.power(item_degree, alpha) + 1e-8) # never-seen items keep a tiny mass
+
+    def draw(self, size):
+        return self.alias_table.sample(size)
+
+
+class InBatchNegativeSampler(UniformNegativeSampler):
+
+    def sample(self, users, pos_items):
+        # positives of the other rows of the batch (popularity distributed), uniform resample if it is a positive
+        negs = pos_items[np.random.permutation(len(pos_items))]
+        rejected = np.nonzero(self.is_positive(users, negs))[0]
+        while len(rejected) > 0:
+            negs[rejected] = self.draw(len(rejected))
+            rejected = rejected[self.is_positive(users[rejected], negs[rejected])]
+        return negs
+
+
+def get_neg_sampler(name, train_data, n_items, alpha=0.75):
+    if name == 'uniform':
+        return UniformNegativeSampler(train_data, n_items)
+    elif name == 'popularity':
+        return PopularityNegativeSampler(train_data, n_items, alpha)
+    elif name == 'in-batch':
+        return InBatchNegativeSampler(train_data, n_items)
+    else:
+        assert False, 'not support this negative sampler: ' + str(name)
+
+
+class BatchPrefetcher():
+    # replace DataLoader(DataOnlyCF, shuffle=True): a background thread keeps the next n_prefetch batches ready,
+    # it only reads numpy arrays (nothing pickled, no worker forked per epoch) and runs across epochs
+
+    def __init__(self, train_data, n_items, batch_size=2048, n_prefetch=4, shuffle=True, neg_sampler=None, n_neg=1):
+        self.users = np.asarray(train_data[0])
+        self.items = np.asarray(train_data[1])
+        self.batch_size = batch_size
+        self.n_neg = n_neg # > 1 gives neg of shape (batch_size, n_neg)
+        self.shuffle = shuffle
+        if neg_sampler is None:
+            neg_sampler = UniformNegativeSampler(train_data, n_items)
+        self.neg_sampler = neg_sampler
+        self.queue = queue.Queue(maxsize=n_prefetch)
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._produce, daemon=True)
+        self.thread.start()
+
+    def __len__(self):
+        return (len(self.users) - 1) // self.batch_size + 1
+
+    def _produce(self):
+        while not self.stop_event.is_set():
+            if self.shuffle:
+                order = np.random.permutation(len(self.users))
+            else:
+                order = np.arange(len(self.users))
+            for start in range(0, len(order), self.batch_size):
+                index = order[start:start + self.batch_size]
+                users = self.users[index]
+                items = self.items[index]
+                if self.n_neg > 1:
+                    negs = self.neg_sampler.sample(np.repeat(users, self.n_neg), np.repeat(items, self.n_neg)).reshape(-1, self.n_neg)
+                else:
+                    negs = self.neg_sampler.sample(users, items)
+                batch = (torch.from_numpy(users), torch.from_numpy(items), torch.from_numpy(negs))
+                while not self.stop_event.is_set():
+                    try:
+                        self.queue.put(batch, timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.queue.get()
+
+    def close(self):
+        self.stop_event.set()
+        self.thread.join()
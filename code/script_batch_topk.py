@@ -0,0 +1,31 @@
+import os
+import time
+
+import numpy as np
+
+from cf_dataset import DataOnlyCF
+from batch_topk import batch_topk
+
+CHECKPOINT = 'lr0005_1e4_500epoch.pth' # (embedding, saved_args) dump of script_new
+LAYERS = 3
+TOPK = 20
+OUT_DIR = 'batch_topk' # users_emb.npy items_emb.npy topk_items.npy topk_scores.npy topk_done.npy
+CHUNK_USERS = 8192 # users per job, the unit of resume
+ITEM_CHUNK_SIZE = None # score items in chunks of this size (None for all items at once)
+N_WORKERS = 4
+THREADS_PER_WORKER = 2
+RESUME = True # keep the exported embedding and the finished chunks of a previous run
+REMAP_IDS = False # rows / item ids are dense ids, user_ids.npy / item_ids.npy give their raw ids
+
+
+if __name__ == "__main__":
+    data_set = DataOnlyCF('data_for_test/gowalla/train.txt', 'data_for_test/gowalla/test.txt', remap_ids=REMAP_IDS)
+    t1 = time.time()
+    items, scores = batch_topk(data_set, CHECKPOINT, OUT_DIR, k=TOPK, n_layers=LAYERS, chunk_users=CHUNK_USERS, item_chunk_size=ITEM_CHUNK_SIZE,
+                               n_workers=N_WORKERS, threads_per_worker=THREADS_PER_WORKER, resume=RESUME)
+    print('total time:', time.time() - t1)
+    user_map, item_map = data_set.get_id_maps()
+    if user_map is not None:
+        np.save(os.path.join(OUT_DIR, 'user_ids.npy'), user_map.raw_ids)
+        np.save(os.path.join(OUT_DIR, 'item_ids.npy'), item_map.raw_ids)
+    print('user 0:', items[0].tolist(), scores[0].tolist())
@@ -0,0 +1,68 @@
+import time
+import resource
+import multiprocessing as mp
+
+import torch
+from torch.utils.data import DataLoader
+
+from cf_dataset import DataOnlyCF
+from gcn_model import CFGCN
+import script_lgcn
+
+EPOCH = 20
+LR = 0.001
+EDIM = 64
+LAYERS = 3
+LAM = 1e-4
+N_THREADS = 8
+TRAIN_PATH = 'data_for_test/gowalla/train.txt'
+TEST_PATH = 'data_for_test/gowalla/test.txt'
+
+
+def run_one(use_bf16, result_queue):
+    # each precision runs in a fresh process so ru_maxrss is the peak of this mode only
+    torch.set_num_threads(N_THREADS)
+    torch.manual_seed(2020)
+    data_set = DataOnlyCF(TRAIN_PATH, TEST_PATH)
+    G = data_set.get_interaction_graph()
+    model = CFGCN(data_set.get_user_num(), data_set.get_item_num(), G, embed_dim=EDIM, n_layers=LAYERS, lam=LAM, use_bf16=use_bf16)
+    train_data_loader = DataLoader(data_set.get_train_dataset(), batch_size=2048, shuffle=True, num_workers=2)
+    test_data_loader = DataLoader(data_set.get_test_dataset(), batch_size=4096, num_workers=2)
+    optimizer = torch.optim.Adam(params=model.parameters(), lr=LR)
+
+    step_times = []
+    for epoch_i in range(EPOCH):
+        model.train()
+        for user_ids, pos_ids, neg_ids in train_data_loader:
+            time_start = time.time()
+            loss = model.bpr_loss(user_ids, pos_ids, neg_ids)
+            model.zero_grad()
+            loss.backward()
+            optimizer.step()
+            step_times.append(time.time() - time_start)
+        print('bf16' if use_bf16 else 'fp32', 'epoch', epoch_i + 1, 'loss', loss.item())
+
+    time_start = time.time()
+    precision, recall, ndcg_score = script_lgcn.test(data_set, model, test_data_loader)
+    test_time = time.time() - time_start
+    peak_mem_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # KB on linux
+    result_queue.put((use_bf16, sum(step_times) / len(step_times), test_time, peak_mem_mb, precision, recall, ndcg_score))
+
+
+if __name__ == "__main__":
+    ctx = mp.get_context('spawn')
+    result_queue = ctx.Queue()
+    results = {}
+    for use_bf16 in [False, True]:
+        p = ctx.Process(target=run_one, args=(use_bf16, result_queue))
+        p.start()
+        res = result_queue.get()
+        p.join()
+        results[res[0]] = res[1:]
+
+    print('==================================================')
+    print('mode  step_time(s)  test_time(s)  peak_mem(MB)  precision  recall  ndcg')
+    for use_bf16 in [False, True]:
+        step_time, test_time, peak_mem_mb, precision, recall, ndcg_score = results[use_bf16]
+        print('%s  %.4f  %.2f  %.0f  %.5f  %.5f  %.5f' % ('bf16' if use_bf16 else 'fp32', step_time, test_time, peak_mem_mb, precision, recall, ndcg_score))
+    print('bf16 / fp32 step time: %.3f, peak mem: %.3f' % (results[True][0] / results[False][0], results[True][2] / results[False][2]))
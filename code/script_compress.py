@@ -0,0 +1,50 @@
+import time
+
+import torch
+
+from cf_dataset import DataOnlyCF
+from gcn_model import CFGCN
+from sampler import BatchPrefetcher
+import script_lgcn
+
+EPOCH = 50
+LR = 0.001
+EDIM = 64
+LAYERS = 3
+LAM = 1e-4
+# (low_degree_quantile, n_buckets, low_dim), quantile 0 is the full table
+SETTINGS = [(0.0, 0, 0), (0.5, 5000, 64), (0.5, 5000, 16), (0.8, 10000, 16)]
+
+
+def parameter_bytes(model):
+    return sum(p.numel() * p.element_size() for p in model.embedding_user_item_itra.parameters())
+
+
+if __name__ == "__main__":
+    data_set = DataOnlyCF('data_for_test/gowalla/train.txt', 'data_for_test/gowalla/test.txt')
+    G = data_set.get_interaction_graph()
+    n_users = data_set.get_user_num()
+    n_items = data_set.get_item_num()
+    node_degrees = data_set.get_node_degrees()
+    test_data_loader = torch.utils.data.DataLoader(data_set.get_test_dataset(), batch_size=4096, num_workers=2)
+
+    results = []
+    for low_degree_quantile, n_buckets, low_dim in SETTINGS:
+        torch.manual_seed(2020)
+        model = CFGCN(n_users, n_items, G, embed_dim=EDIM, n_layers=LAYERS, lam=LAM, node_degrees=node_degrees,
+                      low_degree_quantile=low_degree_quantile, n_buckets=n_buckets, low_dim=low_dim)
+        train_data_loader = BatchPrefetcher(data_set.get_train_data(), n_items, batch_size=2048)
+        optimizer = torch.optim.Adam(params=model.parameters(), lr=LR)
+        time_start = time.time()
+        for epoch_i in range(EPOCH):
+            print('quantile', low_degree_quantile, 'epoch', epoch_i + 1, '/', EPOCH)
+            script_lgcn.train(model, train_data_loader, optimizer)
+        train_time = time.time() - time_start
+        train_data_loader.close()
+        precision, recall, ndcg_score = script_lgcn.test(data_set, model, test_data_loader)
+        results.append((low_degree_quantile, n_buckets, low_dim, parameter_bytes(model) / 2 ** 20, train_time, precision, recall, ndcg_score))
+
+    print('==================================================')
+    print('quantile  buckets  low_dim  embedding(MB)  train_time(s)  precision  recall  ndcg')
+    for res in results:
+        print('%.2f  %d  %d  %.2f  %.0f  %.5f  %.5f  %.5f' % res)
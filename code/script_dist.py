@@ -0,0 +1,119 @@
+import os
+import time
+
+import numpy as np
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+from cf_dataset import DataOnlyCF
+from distributed import partition_nodes, edge_cut_fraction, PartitionedLightGCN
+from metrics import precision_and_recall, ndcg
+from sampler import UniformNegativeSampler
+
+N_PROCS = 4
+THREADS_PER_PROC = 2
+EPOCH = 20
+BATCH_SIZE = 2048 # per process
+LR = 0.001
+EDIM = 64
+LAYERS = 3
+LAM = 1e-4
+TOPK = 20
+PARTITION = 'bfs' # bfs (locality grown, scipy only) metis (dgl >= 0.5, falls back to bfs) snake (degree balanced baseline)
+
+
+def test(table, n_users, train_user_dict, test_user_dict, batch_size=4096):
+    users_emb = table[:n_users]
+    items_emb = table[n_users:]
+    precision, recall, ndcg_score = [], [], []
+    test_users = list(test_user_dict.keys())
+    for start in range(0, len(test_users), batch_size):
+        batch_users = test_users[start:start + batch_size]
+        ratings = torch.matmul(users_emb[batch_users], items_emb.t())
+        for i, user_id in enumerate(batch_users):
+            ratings[i][train_user_dict.get(user_id, [])] = -np.inf # delete train data in ratings
+        batch_predict_items = torch.topk(ratings, k=TOPK)[1].tolist()
+        ground_truths = [test_user_dict[u] for u in batch_users]
+        batch_precision, batch_recall = precision_and_recall(batch_predict_items, ground_truths)
+        precision.append(batch_precision)
+        recall.append(batch_recall)
+        ndcg_score.append(ndcg(batch_predict_items, ground_truths))
+    return np.mean(precision), np.mean(recall), np.mean(ndcg_score)
+
+
+def run(rank, world_size, n_users, n_items, train_data, train_user_dict, test_user_dict, parts, cut_fraction):
+    os.environ['MASTER_ADDR'] = '127.0.0.1'
+    os.environ['MASTER_PORT'] = '29500'
+    dist.init_process_group('gloo', rank=rank, world_size=world_size)
+    torch.set_num_threads(THREADS_PER_PROC)
+    torch.manual_seed(2020 + rank)
+    np.random.seed(2020 + rank)
+
+    model = PartitionedLightGCN(n_users, n_items, train_data, parts, rank, world_size, embed_dim=EDIM, n_layers=LAYERS, lam=LAM)
+    plan = model.plan
+    optimizer = torch.optim.Adam(params=model.parameters(), lr=LR)
+
+    # interactions of owned users are trained here, their items are owned or halo rows
+    mask = parts[train_data[0]] == rank
+    owned_users = train_data[0][mask]
+    local_users = model.global2local[owned_users]
+    local_pos = model.global2local[train_data[1][mask] + n_users]
+    local_rows = np.concatenate((plan.own, plan.halo))
+    candidate_neg = np.nonzero(local_rows >= n_users)[0] # local rows of items, negatives come from them
+    neg_sampler = UniformNegativeSampler(train_data, n_items)
+    n_steps = torch.tensor([(len(local_users) - 1) // BATCH_SIZE + 1])
+    dist.all_reduce(n_steps, op=dist.ReduceOp.MAX) # every rank joins every exchange
+    print('rank', rank, ': own', plan.n_own, ', halo', plan.n_halo, ', train edges', len(local_users), ', steps', n_steps.item())
+    if len(local_users) == 0:
+        print('rank', rank, 'owns no user with interactions, it only joins the halo exchanges')
+
+    for epoch_i in range(EPOCH):
+        model.train()
+        plan.sent_bytes = 0
+        total_loss = 0
+        time_start = time.time()
+        for step_i in range(n_steps.item()):
+            if len(local_users) == 0:
+                # peers wait for this rank in every forward / backward exchange
+                propagated_embed, ego_embed = model.propagate_embedding()
+                loss = 0 * propagated_embed.sum()
+                model.zero_grad()
+                loss.backward()
+                continue
+            batch = np.random.randint(0, len(local_users), BATCH_SIZE)
+            neg = candidate_neg[np.random.randint(0, len(candidate_neg), BATCH_SIZE)]
+            global_users = owned_users[batch]
+            rejected = np.nonzero(neg_sampler.is_positive(global_users, local_rows[neg] - n_users))[0]
+            while len(rejected) > 0:
+                neg[rejected] = candidate_neg[np.random.randint(0, len(candidate_neg), len(rejected))]
+                rejected = rejected[neg_sampler.is_positive(global_users[rejected], local_rows[neg[rejected]] - n_users)]
+            loss = model.bpr_loss(torch.from_numpy(local_users[batch]), torch.from_numpy(local_pos[batch]), torch.from_numpy(neg))
+            model.zero_grad()
+            loss.backward()
+            optimizer.step()
+            total_loss += loss.item()
+        step_time = (time.time() - time_start) / n_steps.item()
+        # n_layers exchanges + 1 for the final embedding, forward and backward
+        layer_mb = plan.sent_bytes / n_steps.item() / (2 * (LAYERS + 1)) / 2 ** 20
+        print('rank %d epoch %d: loss %.5f, step time %.3fs, sent per layer exchange %.3fMB, edge cut %.3f' % (
+            rank, epoch_i + 1, total_loss / n_steps.item(), step_time, layer_mb, cut_fraction))
+
+    table = model.gather_propagated_embedding(parts)
+    if rank == 0:
+        precision, recall, ndcg_score = test(table, n_users, train_user_dict, test_user_dict)
+        print('test result: precision ' + str(precision) + '; recall ' + str(recall) + '; ndcg ' + str(ndcg_score))
+    dist.destroy_process_group()
+
+
+if __name__ == "__main__":
+    data_set = DataOnlyCF('data_for_test/gowalla/train.txt', 'data_for_test/gowalla/test.txt')
+    n_users = data_set.get_user_num()
+    n_items = data_set.get_item_num()
+    t1 = time.time()
+    parts = partition_nodes(data_set.get_train_csr(), N_PROCS, PARTITION)
+    cut_fraction = edge_cut_fraction(data_set.get_train_csr(), parts)
+    train_data = [d.astype(np.int64) for d in data_set.get_train_data()]
+    print(PARTITION, 'partition time %.1fs, node nums' % (time.time() - t1), np.bincount(parts, minlength=N_PROCS),
+          ', degree sums', np.bincount(parts, weights=data_set.get_node_degrees(), minlength=N_PROCS), ', edge cut fraction %.3f' % cut_fraction)
+    mp.spawn(run, args=(N_PROCS, n_users, n_items, train_data, data_set.train_user_dict, data_set.test_user_dict, parts, cut_fraction), nprocs=N_PROCS)
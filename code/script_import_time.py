@@ -0,0 +1,46 @@
+import sys
+import json
+import subprocess
+
+import numpy as np
+
+N_REPEAT = 5
+MODULES = ['cf_core', 'sampler', 'metrics', 'cf_dataset', 'gcn_model', 'script_lgcn', 'script_new']
+HEAVY = ['dgl', 'networkx', 'pandas', 'fastdtw', 'gensim', 'joblib', 'sklearn', 's2vec.struc2vec']
+# module level imports of cf_dataset (incl. s2vec.struc2vec) before the split, what every DataLoader worker unpickling the
+# train dataset loaded: (label, import before, import now)
+BASELINE = [
+    ('train dataset (DataLoader worker)', 'numpy, torch, scipy.sparse, dgl, networkx, pandas, fastdtw, gensim.models, joblib, tqdm, sklearn.metrics', 'cf_core'),
+    ('cf_dataset (main process)', 'numpy, torch, scipy.sparse, dgl, networkx, pandas, fastdtw, gensim.models, joblib, tqdm, sklearn.metrics', 'cf_dataset'),
+]
+# fresh interpreter per run, nothing is cached in sys.modules
+CHILD = '''
+import sys, time, json
+time_start = time.perf_counter()
+import %s
+print(json.dumps([time.perf_counter() - time_start, [m for m in %r if m in sys.modules]]))
+'''
+
+
+def import_time(module):
+    # module: one module or a comma separated import list
+    times = []
+    for i in range(N_REPEAT):
+        out = subprocess.run([sys.executable, '-c', CHILD % (module, HEAVY)], stdout=subprocess.PIPE, check=True).stdout
+        seconds, loaded = json.loads(out.decode().strip().splitlines()[-1])
+        times.append(seconds)
+    return np.median(times), loaded
+
+
+if __name__ == "__main__":
+    print('module  median import time (s)  heavy modules loaded')
+    for module in MODULES:
+        seconds, loaded = import_time(module)
+        print('%s  %.3f  %s' % (module, seconds, ' '.join(loaded)))
+
+    print('==================================================')
+    print('import  before (s)  now (s)  speedup')
+    for label, before_modules, now_modules in BASELINE:
+        before = import_time(before_modules)[0]
+        now = import_time(now_modules)[0]
+        print('%s  %.3f  %.3f  %.1fx' % (label, before, now, before / max(now, 1e-9)))
@@ -0,0 +1,37 @@
+import time
+
+import torch
+
+from cf_dataset import DataOnlyCF
+from gcn_model import CFGCN
+from incremental import append_and_refresh
+
+CODE_VERSION = '0721-1655'
+CHECKPOINT = CODE_VERSION + '.pth' # (embedding, saved_args) as dumped by script_new.py
+NEW_DATA_PATH = 'data_for_test/gowalla/new.txt' # same format as train.txt: user_id item_id ...
+FINE_TUNE_STEP = 200
+LR = 0.001
+EDIM = 64
+LAYERS = 3
+LAM = 1e-4
+
+# GPU / CPU
+device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+
+if __name__ == "__main__":
+    data_set = DataOnlyCF('data_for_test/gowalla/train.txt', 'data_for_test/gowalla/test.txt')
+    itra_G = data_set.get_interaction_graph()
+    itra_G.ndata['id'] = itra_G.ndata['id'].to(device)
+    itra_G.ndata['sqrt_degree'] = itra_G.ndata['sqrt_degree'].to(device)
+    model = CFGCN(data_set.get_user_num(), data_set.get_item_num(), itra_G, embed_dim=EDIM, n_layers=LAYERS, lam=LAM).to(device)
+    pretrained_data, saved_args = torch.load(CHECKPOINT, device)
+    model.load_pretrained_embedding(pretrained_data)
+
+    t1 = time.time()
+    new_data, _ = data_set._load_cf_data(NEW_DATA_PATH)
+    append_and_refresh(data_set, model, new_data[0], new_data[1], n_steps=FINE_TUNE_STEP, lr=LR, device=device)
+    print('refresh time:', time.time() - t1)
+
+    dump_obj = (model.get_pretrained_embedding(), saved_args)
+    torch.save(dump_obj, CODE_VERSION + '_refresh.pth')
@@ -0,0 +1,19 @@
+import sys
+import time
+
+from ingest import ingest_csr
+
+N_WORKERS = 8
+CHUNK_MB = 64
+
+
+if __name__ == "__main__":
+    # python script_ingest.py <file> [adj|edges] [out_dir]
+    file_path = sys.argv[1] if len(sys.argv) > 1 else 'data_for_test/gowalla/train.txt'
+    file_format = sys.argv[2] if len(sys.argv) > 2 else 'adj'
+    out_dir = sys.argv[3] if len(sys.argv) > 3 else None
+    t1 = time.time()
+    csr = ingest_csr(file_path, file_format=file_format, n_workers=N_WORKERS, chunk_bytes=CHUNK_MB * 2 ** 20, out_dir=out_dir)
+    total_time = time.time() - t1
+    print('users', csr.shape[0], ', items', csr.shape[1], ', interactions', csr.nnz)
+    print('ingest time: %.1fs, %.0f interactions/s' % (total_time, csr.nnz / total_time))
@@ -0,0 +1,32 @@
+import os
+import time
+
+from cf_dataset import DataOnlyCF
+from item_index import ItemNeighbors, load_item_neighbors
+from serving import compute_final_embedding
+
+CHECKPOINT = 'lr0005_1e4_500epoch.pth' # (embedding, saved_args) dump of script_new
+LAYERS = 3
+N_NEIGHBORS = 50
+METRIC = 'cosine' # cosine dot
+BLOCK_SIZE = 4096 # items per score block
+ITEM_CHUNK_SIZE = 65536 # columns per score block
+N_THREADS = 4
+INDEX_PATH = 'item_neighbors.npz'
+REFRESH_THRESHOLD = 0.05 # rows of items whose embedding moved more (relative L2) are recomputed on refresh
+
+
+if __name__ == "__main__":
+    data_set = DataOnlyCF('data_for_test/gowalla/train.txt', 'data_for_test/gowalla/test.txt')
+    t1 = time.time()
+    users_emb, items_emb = compute_final_embedding(data_set, CHECKPOINT, n_layers=LAYERS)
+    print('propagate time:', time.time() - t1)
+    if os.path.exists(INDEX_PATH):
+        # the checkpoint was retrained: refresh only the items that moved
+        index = load_item_neighbors(INDEX_PATH, BLOCK_SIZE, ITEM_CHUNK_SIZE, N_THREADS)
+        index.refresh(items_emb, REFRESH_THRESHOLD)
+    else:
+        index = ItemNeighbors(items_emb, N_NEIGHBORS, METRIC, BLOCK_SIZE, ITEM_CHUNK_SIZE, N_THREADS)
+    index.save(INDEX_PATH)
+    items, scores = index.neighbors(0, 10)
+    print('item 0:', items.tolist(), scores.tolist())
@@ -8,6 +8,7 @@ import numpy as np
 
 from cf_dataset import DataOnlyCF
 from gcn_model import CFGCN
+from sampler import BatchPrefetcher, get_neg_sampler
 from metrics import precision_and_recall, ndcg, auc
 
 EPOCH = 100
@@ -16,6 +17,12 @@ EDIM = 64
 LAYERS = 3
 LAM = 1e-4
 TOPK = 20
+PREFETCH = 0 # number of train batches sampled ahead by a background thread (0 for DataLoader), opt in
+NEG_SAMPLER = 'uniform' # uniform popularity in-batch (needs PREFETCH > 0)
+NEG_ALPHA = 0.75 # popularity sampler: P(item) ~ degree ^ NEG_ALPHA
+N_NEG = 1 # negatives per (user, pos) scored against one propagation
+NEG_LOSS = 'mean' # mean (averaged bpr) max (bpr of the hardest negative) softmax (sampled softmax)
+BF16 = False # bfloat16 aggregator Linear & scoring matmul on CPU (autocast), DGL messages / table / optimizer state stay float32
 
 # GPU / CPU
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
@@ -23,8 +30,11 @@ device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 def train(model, data_loader, optimizer, log_interval=10):
     model.train()
     total_loss = 0
+    data_time = 0.0
+    time_data = time.time()
     for i, (user_ids, pos_ids, neg_ids) in enumerate(tqdm.tqdm(data_loader)):
     # for i, (user_ids, pos_ids, neg_ids) in enumerate(data_loader):
+        data_time += time.time() - time_data # time spent waiting on data
         user_ids = user_ids.to(device)
         pos_ids = pos_ids.to(device)
         neg_ids = neg_ids.to(device)
@@ -39,7 +49,8 @@ def train(model, data_loader, optimizer, log_interval=10):
         # if (i + 1) % log_interval == 0:
         #     print('    - Average loss:', total_loss / log_interval)
         #     total_loss = 0
-    print('train loss:', total_loss / len(data_loader))
+        time_data = time.time()
+    print('train loss:', total_loss / len(data_loader), '; data wait time:', data_time)
 
 def evaluate(model, data_loader):
     with torch.no_grad():
@@ -96,17 +107,22 @@ def test(data_set, model, data_loader, show_auc = False):
             print('test result: precision ' + str(precision) + '; recall ' + str(recall) + '; ndcg ' + str(ndcg_score) + '; auc ' + str(auc_score))
         else:
             print('test result: precision ' + str(precision) + '; recall ' + str(recall) + '; ndcg ' + str(ndcg_score))
+        return precision, recall, ndcg_score
 
 
 if __name__ == "__main__":
-    data_set = DataOnlyCF('data_for_test/gowalla/train.txt', 'data_for_test/gowalla/test.txt')
+    data_set = DataOnlyCF('data_for_test/gowalla/train.txt', 'data_for_test/gowalla/test.txt', n_neg=N_NEG)
     G = data_set.get_interaction_graph()
     G.ndata['id'] = G.ndata['id'].to(device) # move graph data to target device
     G.ndata['sqrt_degree'] = G.ndata['sqrt_degree'].to(device) # move graph data to target device
     n_users = data_set.get_user_num()
     n_items = data_set.get_item_num()
-    model = CFGCN(n_users, n_items, G, embed_dim=EDIM, n_layers=LAYERS, lam=LAM).to(device)
-    train_data_loader = DataLoader(data_set, batch_size=2048, shuffle=True, num_workers=4)
+    model = CFGCN(n_users, n_items, G, embed_dim=EDIM, n_layers=LAYERS, lam=LAM, use_bf16=BF16, neg_loss=NEG_LOSS).to(device)
+    if PREFETCH > 0:
+        neg_sampler = get_neg_sampler(NEG_SAMPLER, data_set.get_train_data(), n_items, NEG_ALPHA)
+        train_data_loader = BatchPrefetcher(data_set.get_train_data(), n_items, batch_size=2048, n_prefetch=PREFETCH, neg_sampler=neg_sampler, n_neg=N_NEG)
+    else:
+        train_data_loader = DataLoader(data_set.get_train_dataset(), batch_size=2048, shuffle=True, num_workers=4)
     test_data_loader = DataLoader(data_set.get_test_dataset(), batch_size=4096, num_workers=4)
     optimizer = torch.optim.Adam(params=model.parameters(), lr=LR)
     for epoch_i in range(EPOCH):
@@ -116,6 +132,8 @@ if __name__ == "__main__":
         if (epoch_i + 1) % 10 == 0:
             test(data_set, model, test_data_loader)
         print('--------------------------------------------------')
+    if PREFETCH > 0:
+        train_data_loader.close() # stop the sampling thread, drop the queued batches
     print('==================================================')
     test(data_set, model, test_data_loader)
 
@@ -0,0 +1,65 @@
+import asyncio
+import json
+import time
+
+import numpy as np
+
+HOST = '127.0.0.1'
+PORT = 8000
+N_USERS = 29858 # gowalla
+CONCURRENCY = 64 # open connections, each sends its requests one after another
+N_REQUESTS = 20000
+TOPK = 20
+ZIPF = 1.2 # users drawn by rank ~ Zipf(ZIPF) so hot users repeat (0 for uniform)
+
+
+async def request(reader, writer, target):
+    writer.write(('GET ' + target + ' HTTP/1.1\r\nHost: ' + HOST + '\r\n\r\n').encode())
+    await writer.drain()
+    status = await reader.readline()
+    content_length = 0
+    while True:
+        header = await reader.readline()
+        if header in (b'\r\n', b''):
+            break
+        name, value = header.decode('latin-1').split(':', 1)
+        if name.strip().lower() == 'content-length':
+            content_length = int(value)
+    body = await reader.readexactly(content_length)
+    return int(status.split()[1]), json.loads(body)
+
+
+async def client(users, latencies, errors):
+    reader, writer = await asyncio.open_connection(HOST, PORT)
+    for user_id in users:
+        time_start = time.perf_counter()
+        status, body = await request(reader, writer, '/recommend?user=' + str(user_id) + '&k=' + str(TOPK))
+        latencies.append(time.perf_counter() - time_start)
+        if status != 200:
+            errors.append(body)
+    writer.close()
+
+
+async def main():
+    reader, writer = await asyncio.open_connection(HOST, PORT)
+    await request(reader, writer, '/reset')
+    if ZIPF > 0:
+        users = np.random.permutation(N_USERS)[(np.random.zipf(ZIPF, N_REQUESTS) - 1) % N_USERS]
+    else:
+        users = np.random.randint(0, N_USERS, N_REQUESTS)
+    latencies = []
+    errors = []
+    time_start = time.time()
+    await asyncio.gather(*[client(users[i::CONCURRENCY], latencies, errors) for i in range(CONCURRENCY)])
+    total_time = time.time() - time_start
+    status, server_stats = await request(reader, writer, '/stats')
+    writer.close()
+
+    latencies = np.array(latencies) * 1000
+    print('client: %d requests, %d errors, concurrency %d, throughput %.0f req/s' % (len(latencies), len(errors), CONCURRENCY, len(latencies) / total_time))
+    print('client latency (ms): p50 %.2f, p90 %.2f, p99 %.2f, max %.2f' % tuple(np.percentile(latencies, [50, 90, 99, 100])))
+    print('server:', server_stats)
+
+
+if __name__ == "__main__":
+    asyncio.get_event_loop().run_until_complete(main()) # python 3.6: no asyncio.run
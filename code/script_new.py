@@ -9,14 +9,18 @@ from torch.utils.data import DataLoader
 import numpy as np
 
 from cf_dataset import DataOnlyCF
-from gcn_model import CFGCN
-from metrics import precision_and_recall, ndcg, auc
+from gcn_model import CFGCN, MF, topk_by_item_chunks
+from sampler import BatchPrefetcher, get_neg_sampler
+from reorder import get_node_order
+from memory_plan import MemoryPlanner
+from metrics import precision_and_recall, ndcg, auc, precision_and_recall_per_user, ndcg_per_user, degree_strata, stratified_sample, stratified_mean_ci
 
 CODE_VERSION = '0721-1655'
 USE_PRETRAIN = True
 RETRAIN_PRETRAIN = False
 PRETRAIN_VERSION = 'lr0005_1e4_500epoch'
 # PRETRAIN_VERSION = 'LightGCN_Pretrain'
+# PRETRAIN_VERSION = 'struc2vec_walk' # walk embedding of script_walk.py
 PRETRAIN_EPOCH = 500
 GCN_EPOCH = 2
 STRUC_STEP = 30
@@ -31,6 +35,19 @@ BMODE = 3 # build_struc_graphs mode (3 for prune)
 CMODE = 0 # combine_multi_graph_embedding mode (1 for concat)
 ATYPE = 'graphsage' # gcn graphsage bi-interaction
 WFUSE = False # whether use diff weight to fuse(get mean) each step embedding of GCN
+FUSE = True # propagate all struc graphs in one block diagonal graph instead of one by one
+PREFETCH = 0 # number of train batches sampled ahead by a background thread (0 for DataLoader), opt in
+NEG_SAMPLER = 'uniform' # uniform popularity in-batch (needs PREFETCH > 0)
+NEG_ALPHA = 0.75 # popularity sampler: P(item) ~ degree ^ NEG_ALPHA
+N_NEG = 1 # negatives per (user, pos) scored against one propagation
+NEG_LOSS = 'mean' # mean (averaged bpr) max (bpr of the hardest negative) softmax (sampled softmax)
+BF16 = False # bfloat16 aggregator Linear & scoring matmul on CPU (autocast), DGL messages / table / optimizer state stay float32
+RECOMPUTE = None # activation checkpointing of the propagation while training: None layer graph (see script_recompute.py)
+REMAP_IDS = False # dense ids over users / items with train edges only (checkpoints are not interchangeable with the full id space)
+MEM_BUDGET_GB = None # pick test / eval batch sizes and item chunks to fit this budget (None for the fixed sizes)
+ITEM_CHUNK_SIZE = None # score items in chunks of this size at test time, set by the memory plan
+REORDER = None # relabel users / items for memory locality: None degree rcm
+SAMPLE_TEST_USERS = 3000 # intermediate test on a degree stratified user sample, full test only if the CI reaches the best recall (0 for always full)
 
 # GPU / CPU
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
@@ -55,8 +72,11 @@ if device == 'cuda':
 def train(model, data_loader, optimizer, use_dummy_gcn=False, use_struc=None):
     model.train()
     total_loss = 0
+    data_time = 0.0
+    time_start = time.time()
     for i, (user_ids, pos_ids, neg_ids) in enumerate(tqdm.tqdm(data_loader)):
     # for i, (user_ids, pos_ids, neg_ids) in enumerate(data_loader):
+        data_time += time.time() - time_start # time spent waiting on data
         user_ids = user_ids.to(device)
         pos_ids = pos_ids.to(device)
         neg_ids = neg_ids.to(device)
@@ -66,7 +86,8 @@ def train(model, data_loader, optimizer, use_dummy_gcn=False, use_struc=None):
         loss.backward()
         optimizer.step()
         total_loss += loss.cpu().item()
-    logging.info('train loss:' + str(total_loss / len(data_loader)))
+        time_start = time.time()
+    logging.info('train loss:' + str(total_loss / len(data_loader)) + '; data wait time:' + str(data_time))
 
 def evaluate(model, data_loader, use_dummy_gcn=False, use_struc=None):
     with torch.no_grad():
@@ -83,6 +104,30 @@ def evaluate(model, data_loader, use_dummy_gcn=False, use_struc=None):
         avg_loss = total_loss / len(data_loader)
         logging.info('evaluate loss:' + str(avg_loss))
 
+def predict_users(data_set, model, user_ids, use_dummy_gcn=False, use_struc=None):
+    user_ids = user_ids.to(device)
+    if ITEM_CHUNK_SIZE is not None:
+        # scores never exist for all items at once, no ratings are returned (no auc)
+        users_emb, items_emb = model.get_final_embedding(use_dummy_gcn, use_struc)
+        seen = data_set.get_train_csr()[user_ids.cpu().numpy()]
+        seen_rows = torch.from_numpy(np.repeat(np.arange(len(user_ids)), np.diff(seen.indptr))).to(device)
+        seen_items = torch.from_numpy(seen.indices.astype(np.int64)).to(device)
+        ___, index_k = topk_by_item_chunks(users_emb[user_ids.long()], items_emb, TOPK, ITEM_CHUNK_SIZE, seen_rows, seen_items)
+        ground_truths = [data_set.test_user_dict[user_id] for user_id in user_ids.tolist()]
+        return None, index_k.cpu().tolist(), ground_truths
+    ratings = model.get_users_ratings(user_ids, use_dummy_gcn, use_struc)
+    ground_truths = []
+    for i, user_id_t in enumerate(user_ids):
+        user_id = user_id_t.item()
+        ground_truths.append(data_set.test_user_dict[user_id])
+        train_pos = data_set.train_user_dict[user_id]
+        for pos_item in train_pos:
+            ratings[i][pos_item] = -1 # delete train data in ratings
+    # Precision, Recall, NDCG
+    ___, index_k = torch.topk(ratings, k=TOPK) # index_k.shape = (batch_size, TOPK), dtype=torch.int
+    batch_predict_items = index_k.cpu().tolist()
+    return ratings, batch_predict_items, ground_truths
+
 def test(data_set, model, data_loader, show_auc = False, use_dummy_gcn=False, use_struc=None):
     with torch.no_grad():
         logging.info('----- start_test -----')
@@ -92,22 +137,12 @@ def test(data_set, model, data_loader, show_auc = False, use_dummy_gcn=False, us
         ndcg_score = []
         auc_score = []
         for user_ids, _, __ in data_loader:
-            user_ids = user_ids.to(device)
-            ratings = model.get_users_ratings(user_ids, use_dummy_gcn, use_struc)
-            ground_truths = []
-            for i, user_id_t in enumerate(user_ids):
-                user_id = user_id_t.item()
-                ground_truths.append(data_set.test_user_dict[user_id])
-                train_pos = data_set.train_user_dict[user_id]
-                for pos_item in train_pos:
-                    ratings[i][pos_item] = -1 # delete train data in ratings
-            # Precision, Recall, NDCG
-            ___, index_k = torch.topk(ratings, k=TOPK) # index_k.shape = (batch_size, TOPK), dtype=torch.int
-            batch_predict_items = index_k.cpu().tolist()
+            ratings, batch_predict_items, ground_truths = predict_users(data_set, model, user_ids, use_dummy_gcn, use_struc)
             batch_precision, batch_recall = precision_and_recall(batch_predict_items, ground_truths)
             batch_ndcg = ndcg(batch_predict_items, ground_truths)
             # AUC
             if show_auc:
+                assert ratings is not None, 'auc needs full ratings, set ITEM_CHUNK_SIZE to None'
                 ratings = ratings.cpu().numpy()
                 batch_auc = auc(ratings, data_set.get_item_num(), ground_truths)
                 auc_score.append(batch_auc)
@@ -123,12 +158,76 @@ def test(data_set, model, data_loader, show_auc = False, use_dummy_gcn=False, us
             logging.info('test result: precision ' + str(precision) + '; recall ' + str(recall) + '; ndcg ' + str(ndcg_score) + '; auc ' + str(auc_score))
         else:
             logging.info('test result: precision ' + str(precision) + '; recall ' + str(recall) + '; ndcg ' + str(ndcg_score))
+        return precision, recall, ndcg_score
+
+def sampled_test(data_set, model, n_sample, batch_size=4096, use_dummy_gcn=False, use_struc=None):
+    # metrics on a training degree stratified sample of test users, with bootstrap 95% intervals
+    with torch.no_grad():
+        logging.info('----- start_sampled_test -----')
+        model.eval()
+        test_users = np.array(data_set.test_user_list)
+        degrees = np.array([len(data_set.train_user_dict.get(u, [])) for u in test_users])
+        strata = degree_strata(degrees)
+        sampled = stratified_sample(strata, n_sample)
+        precision, recall, ndcg_score = [], [], []
+        for start in range(0, len(sampled), batch_size):
+            user_ids = torch.from_numpy(test_users[sampled[start:start + batch_size]])
+            ratings, batch_predict_items, ground_truths = predict_users(data_set, model, user_ids, use_dummy_gcn, use_struc)
+            batch_precision, batch_recall = precision_and_recall_per_user(batch_predict_items, ground_truths)
+            precision.append(batch_precision)
+            recall.append(batch_recall)
+            ndcg_score.append(ndcg_per_user(batch_predict_items, ground_truths))
+        strata_sizes = np.bincount(strata)
+        result = {}
+        for name, values in [('precision', precision), ('recall', recall), ('ndcg', ndcg_score)]:
+            result[name] = stratified_mean_ci(np.concatenate(values), strata[sampled], strata_sizes)
+        logging.info('sampled test result (' + str(len(sampled)) + ' users): ' + '; '.join(name + ' %.5f [%.5f, %.5f]' % result[name] for name in result))
+        return result
+
+def monitor_test(data_set, model, data_loader, best_recall, use_dummy_gcn=False, use_struc=None):
+    # intermediate test, escalate to the full test only when the sampled recall interval reaches best_recall
+    if SAMPLE_TEST_USERS > 0:
+        recall, recall_low, recall_high = sampled_test(data_set, model, SAMPLE_TEST_USERS, use_dummy_gcn=use_dummy_gcn, use_struc=use_struc)['recall']
+        if recall_high < best_recall:
+            logging.info('sampled recall interval below best recall ' + str(best_recall) + ', skip full test')
+            return best_recall
+    precision, recall, ndcg_score = test(data_set, model, data_loader, use_dummy_gcn=use_dummy_gcn, use_struc=use_struc)
+    return max(best_recall, recall)
+
+
+def train_gcn(data_set, model, optimizer, train_data_loader, evaluate_data_loader, test_data_loader, gcn_epoch=GCN_EPOCH, struc_step=STRUC_STEP, itra_step=ITRA_STEP):
+    # alternate struc / itra training, return the final test result
+    # test(data_set, model, test_data_loader, use_dummy_gcn=True)
+    best_recall = test(data_set, model, test_data_loader, use_dummy_gcn=False)[1] # pretrain recall is not comparable to the gcn one
+    logging.info('==================================================')
+    for i in range(gcn_epoch):
+
+        for epoch_i in range(struc_step):
+            logging.info('----- use_struc=True')
+            logging.info('Train lgcn - epoch ' + str(i * (struc_step + itra_step) + epoch_i + 1) + '/' + str(gcn_epoch * (struc_step + itra_step)))
+            train(model, train_data_loader, optimizer, use_dummy_gcn=False, use_struc=True)
+            evaluate(model, evaluate_data_loader, use_dummy_gcn=False, use_struc=True)
+            if (epoch_i + 1) % 2 == 0:
+                best_recall = monitor_test(data_set, model, test_data_loader, best_recall, use_dummy_gcn=False, use_struc=True)
+            logging.info('--------------------------------------------------')
+
+        for epoch_i in range(itra_step):
+            logging.info('----- use_struc=False')
+            logging.info('Train lgcn - epoch ' + str(i * (struc_step + itra_step) + struc_step + epoch_i + 1) + '/' + str(gcn_epoch * (struc_step + itra_step)))
+            train(model, train_data_loader, optimizer, use_dummy_gcn=False, use_struc=False)
+            evaluate(model, evaluate_data_loader, use_dummy_gcn=False, use_struc=False)
+            if (epoch_i + 1) % 10 == 0:
+                best_recall = monitor_test(data_set, model, test_data_loader, best_recall, use_dummy_gcn=False, use_struc=False)
+            logging.info('--------------------------------------------------')
+
+    logging.info('==================================================')
+    return test(data_set, model, test_data_loader, use_dummy_gcn=False, use_struc=False)
 
 
 if __name__ == "__main__":
     print('CODE_VERSION: ' + CODE_VERSION)
     logging.info(str(time.asctime(time.localtime(time.time()))))
-    data_set = DataOnlyCF('data_for_test/gowalla/train.txt', 'data_for_test/gowalla/test.txt')
+    data_set = DataOnlyCF('data_for_test/gowalla/train.txt', 'data_for_test/gowalla/test.txt', n_neg=N_NEG, remap_ids=REMAP_IDS)
     itra_G = data_set.get_interaction_graph()
     # print('itra_G: nodes', itra_G.number_of_nodes(), ',edges', itra_G.number_of_edges(), ',degree mean&var', itra_G.out_degrees().float().mean(), itra_G.out_degrees().float().var())
     # import matplotlib.pyplot as plt
@@ -140,12 +239,20 @@ if __name__ == "__main__":
     # plt.show()
     # exit(0)
 
-    # move graph data to target device
-    itra_G.ndata['id'] = itra_G.ndata['id'].to(device)
-    itra_G.ndata['sqrt_degree'] = itra_G.ndata['sqrt_degree'].to(device)
     t1 = time.time()
     struc_Gs = data_set.build_struc_graphs(mode=BMODE, mode3_layers=M3LAYERS)
     print('build_struc_graphs time:', time.time() - t1)
+    node_order = None
+    if REORDER is not None:
+        # struc2vec cache is keyed by the original ids, so relabel after building the struc graphs
+        node_order = get_node_order(data_set, REORDER)
+        data_set.reorder_nodes(node_order.user_old2new, node_order.item_old2new)
+        itra_G = data_set.get_interaction_graph()
+        struc_Gs = [node_order.permute_graph(g) for g in struc_Gs]
+
+    # move graph data to target device
+    itra_G.ndata['id'] = itra_G.ndata['id'].to(device)
+    itra_G.ndata['sqrt_degree'] = itra_G.ndata['sqrt_degree'].to(device)
     for g in struc_Gs:
         g.ndata['id'] = g.ndata['id'].to(device)
         g.edata['weight'] = g.edata['weight'].to(device)
@@ -174,56 +281,57 @@ if __name__ == "__main__":
     n_users = data_set.get_user_num()
     n_items = data_set.get_item_num()
     model = CFGCN(n_users, n_items, itra_G, struc_Gs=struc_Gs, embed_dim=EDIM, n_layers=LAYERS,
-                  lam=LAM, weighted_fuse=WFUSE, combine_mode=CMODE, aggregator_type=ATYPE).to(device)
-    train_data_loader = DataLoader(data_set, batch_size=2048, shuffle=True, num_workers=2)
-    evaluate_data_loader = DataLoader(data_set.get_evaluate_dataset(), batch_size=4096, num_workers=2)
-    test_data_loader = DataLoader(data_set.get_test_dataset(), batch_size=4096 * 8, num_workers=2)
+                  lam=LAM, weighted_fuse=WFUSE, combine_mode=CMODE, aggregator_type=ATYPE, use_bf16=BF16, fuse_struc=FUSE, neg_loss=NEG_LOSS, recompute=RECOMPUTE).to(device)
+    if PREFETCH > 0:
+        neg_sampler = get_neg_sampler(NEG_SAMPLER, data_set.get_train_data(), n_items, NEG_ALPHA)
+        train_data_loader = BatchPrefetcher(data_set.get_train_data(), n_items, batch_size=2048, n_prefetch=PREFETCH, neg_sampler=neg_sampler, n_neg=N_NEG)
+    else:
+        train_data_loader = DataLoader(data_set.get_train_dataset(), batch_size=2048, shuffle=True, num_workers=2)
+    eval_batch_size, test_batch_size = 4096, 4096 * 8
+    if MEM_BUDGET_GB is not None:
+        plan = MemoryPlanner(model, MEM_BUDGET_GB * 2 ** 30).plan()
+        eval_batch_size, test_batch_size, ITEM_CHUNK_SIZE = plan['eval_batch_size'], plan['test_batch_size'], plan['item_chunk_size']
+    evaluate_data_loader = DataLoader(data_set.get_evaluate_dataset(), batch_size=eval_batch_size, num_workers=2)
+    test_data_loader = DataLoader(data_set.get_test_dataset(), batch_size=test_batch_size, num_workers=2)
     optimizer = torch.optim.Adam(params=model.parameters(), lr=LR)
 
+    best_recall = 0.0
+
     # pretrain mf model
     if USE_PRETRAIN:
         logging.info('load pretrain model, pretrain_version: ' + PRETRAIN_VERSION)
         pretrained_data, saved_args = torch.load(PRETRAIN_VERSION + '.pth', device)
-        assert (PRETRAIN_EPOCH, EDIM, CMODE) == saved_args, 'saved_args not match' + str(saved_args)
+        if saved_args[0] == 'struc2vec_walk':
+            # table of script_walk.py (PRETRAIN_VERSION = 'struc2vec_walk'), no mf epochs / combine mode, only the dim has to match
+            assert saved_args[1] == EDIM, 'saved_args not match' + str(saved_args)
+        else:
+            assert (PRETRAIN_EPOCH, EDIM, CMODE) == saved_args, 'saved_args not match' + str(saved_args)
+        if node_order is not None:
+            pretrained_data = node_order.permute_embedding(pretrained_data)
         model.load_pretrained_embedding(pretrained_data)
     elif RETRAIN_PRETRAIN:
+        # batch rows only with sparse grads, instead of the full table gather of use_dummy_gcn on the CFGCN
+        mf_model = MF(n_users, n_items, embed_dim=EDIM, lam=LAM, combine_mode=CMODE, n_struc=len(struc_Gs) if struc_Gs is not None else 0, neg_loss=NEG_LOSS, sparse=True).to(device)
+        mf_optimizer = torch.optim.SparseAdam(list(mf_model.parameters()), lr=LR)
         for epoch_i in range(PRETRAIN_EPOCH):
             logging.info('Pretrain mf - epoch ' + str(epoch_i + 1) + '/' + str(PRETRAIN_EPOCH))
-            train(model, train_data_loader, optimizer, use_dummy_gcn=True)
-            evaluate(model, evaluate_data_loader, use_dummy_gcn=True)
+            train(mf_model, train_data_loader, mf_optimizer, use_dummy_gcn=True)
+            evaluate(mf_model, evaluate_data_loader, use_dummy_gcn=True)
             if (epoch_i + 1) % 10 == 0:
-                test(data_set, model, test_data_loader, use_dummy_gcn=True)
+                best_recall = monitor_test(data_set, mf_model, test_data_loader, best_recall, use_dummy_gcn=True)
             logging.info('--------------------------------------------------')
-        dump_obj = (model.get_pretrained_embedding(), (PRETRAIN_EPOCH, EDIM, CMODE))
+        pretrained_data = mf_model.get_pretrained_embedding().clone()
+        model.load_pretrained_embedding(pretrained_data.clone())
+        if node_order is not None:
+            pretrained_data = node_order.restore_embedding(pretrained_data) # checkpoint stays in original ids
+        dump_obj = (pretrained_data, (PRETRAIN_EPOCH, EDIM, CMODE))
         torch.save(dump_obj, CODE_VERSION + '.pth')
         logging.info('==================================================')
 
     # train gcn
-    # test(data_set, model, test_data_loader, use_dummy_gcn=True)
-    test(data_set, model, test_data_loader, use_dummy_gcn=False)
-    logging.info('==================================================')
-    for i in range(GCN_EPOCH):
-
-        for epoch_i in range(STRUC_STEP):
-            logging.info('----- use_struc=True')
-            logging.info('Train lgcn - epoch ' + str(i * (STRUC_STEP + ITRA_STEP) + epoch_i + 1) + '/' + str(GCN_EPOCH * (STRUC_STEP + ITRA_STEP)))
-            train(model, train_data_loader, optimizer, use_dummy_gcn=False, use_struc=True)
-            evaluate(model, evaluate_data_loader, use_dummy_gcn=False, use_struc=True)
-            if (epoch_i + 1) % 2 == 0:
-                test(data_set, model, test_data_loader, use_dummy_gcn=False, use_struc=True)
-            logging.info('--------------------------------------------------')
-
-        for epoch_i in range(ITRA_STEP):
-            logging.info('----- use_struc=False')
-            logging.info('Train lgcn - epoch ' + str(i * (STRUC_STEP + ITRA_STEP) + STRUC_STEP + epoch_i + 1) + '/' + str(GCN_EPOCH * (STRUC_STEP + ITRA_STEP)))
-            train(model, train_data_loader, optimizer, use_dummy_gcn=False, use_struc=False)
-            evaluate(model, evaluate_data_loader, use_dummy_gcn=False, use_struc=False)
-            if (epoch_i + 1) % 10 == 0:
-                test(data_set, model, test_data_loader, use_dummy_gcn=False, use_struc=False)
-            logging.info('--------------------------------------------------')
-
-    logging.info('==================================================')
-    test(data_set, model, test_data_loader, use_dummy_gcn=False, use_struc=False)
+    train_gcn(data_set, model, optimizer, train_data_loader, evaluate_data_loader, test_data_loader)
+    if PREFETCH > 0:
+        train_data_loader.close() # stop the sampling thread, drop the queued batches
 
 # run data_lgcn/gowalla gowalla
 # at epoch 50 precision 0.0406273132632997; recall 0.13624640704870125; ndcg 0.11335605664660738
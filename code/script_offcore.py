@@ -0,0 +1,78 @@
+import time
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+
+from cf_dataset import DataOnlyCF
+from gcn_model import topk_by_item_chunks
+from metrics import precision_and_recall, ndcg
+from offcore import RowStore, RowAdam, OutOfCoreLightGCN
+
+EPOCH = 20
+BATCH_SIZE = 2048
+LR = 0.001
+EDIM = 64
+LAYERS = 3
+LAM = 1e-4
+TOPK = 20
+ITEM_CHUNK_SIZE = 2 ** 16 # item rows read from items_emb.npy per scoring step
+FANOUT = 10 # neighbors sampled per node and hop (None for the full neighborhood)
+HOT_FRACTION = 0.1 # highest degree nodes whose rows (and Adam states) stay in memory
+STORE_DIR = 'offcore_store' # table.npy m.npy v.npy, reopened when RESUME
+OUT_DIR = 'offcore_store' # users_emb.npy items_emb.npy of the final propagation
+RESUME = False
+
+
+def test(users_emb, items_emb, train_csr, test_user_dict, batch_size=4096):
+    # users_emb / items_emb: memmap final embeddings, the users of one batch and ITEM_CHUNK_SIZE items are read at a time
+    precision, recall, ndcg_score = [], [], []
+    test_users = np.array(list(test_user_dict.keys()), dtype=np.int64)
+    for start in range(0, len(test_users), batch_size):
+        batch_users = test_users[start:start + batch_size]
+        seen = train_csr[batch_users]
+        seen_rows = torch.from_numpy(np.repeat(np.arange(len(batch_users)), np.diff(seen.indptr)))
+        seen_items = torch.from_numpy(seen.indices.astype(np.int64))
+        batch_users_emb = torch.from_numpy(np.array(users_emb[batch_users]))
+        batch_predict_items = topk_by_item_chunks(batch_users_emb, items_emb, TOPK, ITEM_CHUNK_SIZE, seen_rows, seen_items)[1].tolist()
+        ground_truths = [test_user_dict[u] for u in batch_users.tolist()]
+        batch_precision, batch_recall = precision_and_recall(batch_predict_items, ground_truths)
+        precision.append(batch_precision)
+        recall.append(batch_recall)
+        ndcg_score.append(ndcg(batch_predict_items, ground_truths))
+    return np.mean(precision), np.mean(recall), np.mean(ndcg_score)
+
+
+if __name__ == "__main__":
+    data_set = DataOnlyCF('data_for_test/gowalla/train.txt', 'data_for_test/gowalla/test.txt')
+    n_users = data_set.get_user_num()
+    n_items = data_set.get_item_num()
+    n_nodes = n_users + n_items
+    degrees = data_set.get_node_degrees()
+    hot_rows = np.argsort(-degrees, kind='stable')[:int(n_nodes * HOT_FRACTION)]
+    store = RowStore(STORE_DIR, n_nodes, EDIM, hot_rows, init_bound=None if RESUME else np.sqrt(6 / (n_nodes + EDIM)))
+    model = OutOfCoreLightGCN(n_users, n_items, data_set.get_train_csr(), store, n_layers=LAYERS, lam=LAM, fanout=FANOUT)
+    optimizer = RowAdam(store, lr=LR)
+    train_data_loader = DataLoader(data_set.get_train_dataset(), batch_size=BATCH_SIZE, shuffle=True, num_workers=2)
+    print('hot rows %d / %d (%.1f%% of the edges), cache %.1fMB' % (len(hot_rows), n_nodes, 100 * degrees[hot_rows].sum() / degrees.sum(), store.stats()['cache_mb']))
+
+    for epoch_i in range(EPOCH):
+        store.reset_stats()
+        model.touched_rows = 0
+        total_loss = 0
+        n_steps = 0
+        time_start = time.time()
+        for user_ids, pos_ids, neg_ids in train_data_loader:
+            total_loss += model.train_step(user_ids.numpy(), pos_ids.numpy(), neg_ids.numpy(), optimizer)
+            n_steps += 1
+        epoch_time = time.time() - time_start
+        stats = store.stats()
+        print('epoch %d: loss %.5f, step time %.3fs, touched rows per step %.0f, hit rate %.3f, read %.1fMB, write %.1fMB' % (
+            epoch_i + 1, total_loss / n_steps, epoch_time / n_steps, model.touched_rows / n_steps, stats['hit_rate'], stats['read_mb'], stats['write_mb']))
+        store.flush() # the files are a usable checkpoint after every epoch
+
+    time_start = time.time()
+    users_emb, items_emb = model.propagate_to_file(OUT_DIR)
+    print('out of core propagation time:', time.time() - time_start)
+    precision, recall, ndcg_score = test(users_emb, items_emb, data_set.get_train_csr(), data_set.test_user_dict)
+    print('test result: precision ' + str(precision) + '; recall ' + str(recall) + '; ndcg ' + str(ndcg_score))
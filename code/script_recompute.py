@@ -0,0 +1,74 @@
+import time
+import resource
+import itertools
+import multiprocessing as mp
+
+import torch
+from torch.utils.data import DataLoader
+
+from cf_dataset import DataOnlyCF
+from gcn_model import CFGCN
+from memory_plan import MemoryPlanner
+
+N_STEPS = 20 # train steps measured per config (after 2 warm up steps)
+LR = 0.001
+EDIM = 64
+LAM = 1e-4
+ATYPE = 'graphsage'
+N_THREADS = 8
+LAYERS_LIST = [3, 4, 5, 6, 8]
+M3LAYERS_LIST = [[-1], [-2, -1], [-4, -3, -2, -1]] # struc graphs by index of the prune layers
+RECOMPUTE_LIST = [None, 'layer', 'graph']
+
+# loaded once in the parent, forked runs read them copy-on-write
+data_set = None
+all_struc_Gs = None
+
+
+def run_one(n_layers, m3layers, recompute, result_queue):
+    # each config runs in a fresh forked process, ru_maxrss above the rss at fork is the peak of this config only
+    base_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # KB on linux
+    torch.set_num_threads(N_THREADS)
+    torch.manual_seed(2020)
+    struc_Gs = [all_struc_Gs[index] for index in m3layers]
+    model = CFGCN(data_set.get_user_num(), data_set.get_item_num(), data_set.get_interaction_graph(), struc_Gs=struc_Gs, embed_dim=EDIM,
+                  n_layers=n_layers, lam=LAM, aggregator_type=ATYPE, fuse_struc=True, recompute=recompute)
+    estimate_mb = MemoryPlanner(model, 0).train_bytes() / 2 ** 20
+    train_data_loader = DataLoader(data_set.get_train_dataset(), batch_size=2048, shuffle=True, num_workers=0)
+    optimizer = torch.optim.Adam(params=model.parameters(), lr=LR)
+
+    model.train()
+    step_times = []
+    for step_i, (user_ids, pos_ids, neg_ids) in enumerate(itertools.islice(train_data_loader, N_STEPS + 2)):
+        time_start = time.time()
+        loss = model.bpr_loss(user_ids, pos_ids, neg_ids)
+        model.zero_grad()
+        loss.backward()
+        optimizer.step()
+        if step_i >= 2:
+            step_times.append(time.time() - time_start)
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 - base_rss_mb
+    result_queue.put((sum(step_times) / len(step_times), peak_mb, estimate_mb, loss.item()))
+
+
+if __name__ == "__main__":
+    data_set = DataOnlyCF('data_for_test/gowalla/train.txt', 'data_for_test/gowalla/test.txt')
+    all_struc_Gs = data_set.build_struc_graphs(mode=3, mode3_layers=None) # every layer, configs pick theirs by index
+
+    ctx = mp.get_context('fork')
+    result_queue = ctx.Queue()
+    results = {}
+    for n_layers, m3layers, recompute in itertools.product(LAYERS_LIST, M3LAYERS_LIST, RECOMPUTE_LIST):
+        p = ctx.Process(target=run_one, args=(n_layers, m3layers, recompute, result_queue))
+        p.start()
+        results[(n_layers, str(m3layers), recompute)] = result_queue.get()
+        p.join()
+        print(n_layers, m3layers, recompute, results[(n_layers, str(m3layers), recompute)])
+
+    print('==================================================')
+    print('layers  m3layers  recompute  step_time(s)  peak_mem(MB)  estimate(MB)  loss  time / mem vs None')
+    for n_layers, m3layers, recompute in itertools.product(LAYERS_LIST, M3LAYERS_LIST, RECOMPUTE_LIST):
+        step_time, peak_mb, estimate_mb, loss = results[(n_layers, str(m3layers), recompute)]
+        base_step_time, base_peak_mb = results[(n_layers, str(m3layers), None)][:2]
+        print('%d  %s  %s  %.4f  %.0f  %.0f  %.5f  %.2f / %.2f' % (n_layers, str(m3layers), str(recompute), step_time, peak_mb, estimate_mb, loss,
+                                                                 step_time / base_step_time, peak_mb / max(base_peak_mb, 1)))
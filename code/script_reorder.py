@@ -0,0 +1,43 @@
+import time
+
+import torch
+
+from cf_dataset import DataOnlyCF
+from gcn_model import CFGCN
+from reorder import get_node_order
+
+EDIM = 64
+LAYERS = 3
+N_REPEAT = 20
+METHODS = [None, 'degree', 'rcm']
+
+
+if __name__ == "__main__":
+    results = []
+    for method in METHODS:
+        torch.manual_seed(2020)
+        data_set = DataOnlyCF('data_for_test/gowalla/train.txt', 'data_for_test/gowalla/test.txt')
+        if method is not None:
+            node_order = get_node_order(data_set, method)
+            data_set.reorder_nodes(node_order.user_old2new, node_order.item_old2new)
+        G = data_set.get_interaction_graph()
+        model = CFGCN(data_set.get_user_num(), data_set.get_item_num(), G, embed_dim=EDIM, n_layers=LAYERS)
+
+        # forward + backward of the full graph propagation, as in one training step
+        model.propagate_embedding(G, model.embedding_user_item_itra, model.aggregate_layers_itra).sum().backward() # warm up
+        forward_time = 0.0
+        backward_time = 0.0
+        for i in range(N_REPEAT):
+            model.zero_grad()
+            time_start = time.time()
+            propagated_embed = model.propagate_embedding(G, model.embedding_user_item_itra, model.aggregate_layers_itra)
+            forward_time += time.time() - time_start
+            time_start = time.time()
+            propagated_embed.sum().backward()
+            backward_time += time.time() - time_start
+        results.append((str(method), forward_time / N_REPEAT * 1000, backward_time / N_REPEAT * 1000))
+
+    print('==================================================')
+    print('order  forward(ms)  backward(ms)')
+    for res in results:
+        print('%s  %.2f  %.2f' % res)
@@ -0,0 +1,30 @@
+import asyncio
+import time
+
+from cf_dataset import DataOnlyCF
+from item_index import load_item_neighbors
+from serving import load_recommender, MicroBatcher, RecommendServer, TopKCache
+
+CHECKPOINT = 'lr0005_1e4_500epoch.pth' # (embedding, saved_args) dump of script_new
+LAYERS = 3
+HOST = '127.0.0.1'
+PORT = 8000
+MAX_BATCH_SIZE = 256 # requests scored in one matmul
+MAX_WAIT_MS = 2.0 # latency budget spent waiting for a batch to fill
+CACHE_MB = 64 # per user top-k result cache (0 for no cache)
+CACHE_TTL = None # seconds an entry stays valid (None for until the next checkpoint)
+REMAP_IDS = False # dense ids over users / items with train edges, requests keep the ids of the data files
+ITEM_INDEX = None # .npz of script_item_index.py for /similar (None for no /similar)
+
+
+if __name__ == "__main__":
+    data_set = DataOnlyCF('data_for_test/gowalla/train.txt', 'data_for_test/gowalla/test.txt', remap_ids=REMAP_IDS)
+    t1 = time.time()
+    cache = TopKCache(max_bytes=CACHE_MB * 2 ** 20, ttl=CACHE_TTL) if CACHE_MB > 0 else None
+    recommender = load_recommender(data_set, CHECKPOINT, n_layers=LAYERS, cache=cache)
+    print('precompute final embedding time:', time.time() - t1)
+    user_map, item_map = data_set.get_id_maps()
+    item_index = load_item_neighbors(ITEM_INDEX) if ITEM_INDEX is not None else None
+    server = RecommendServer(MicroBatcher(recommender, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS), user_map=user_map, item_map=item_map,
+                             item_index=item_index)
+    asyncio.get_event_loop().run_until_complete(server.serve(HOST, PORT)) # python 3.6: no asyncio.run
@@ -0,0 +1,49 @@
+import time
+
+import numpy as np
+import networkx as nx
+
+from cf_dataset import DataOnlyCF
+from s2vec.struc2vec import Struc2Vec
+from s2vec.sketch import compare_layers
+
+# every engine builds from an empty temp dir (cleared, reuse=False) so the times are end to end
+DTW_TEMP_PATH = './temp_struc2vec_bench_dtw/'
+SKETCH_TEMP_PATH = './temp_struc2vec_bench_sketch/'
+WORKERS = 4
+SKETCH_NEIGHBORS = 10
+
+
+if __name__ == "__main__":
+    data_set = DataOnlyCF('data_for_test/gowalla/train.txt', 'data_for_test/gowalla/test.txt')
+    n_users = data_set.get_user_num()
+    n_items = data_set.get_item_num()
+    train_data = data_set.get_train_data()
+    nx_rec_g = nx.Graph()
+    nx_rec_g.add_nodes_from(range(n_users + n_items))
+    nx_rec_g.add_edges_from(np.concatenate((train_data[0].reshape(-1, 1), train_data[1].reshape(-1, 1) + n_users), 1))
+
+    t1 = time.time()
+    s2v_dtw = Struc2Vec(nx_rec_g, n_users, workers=WORKERS, verbose=40, opt3_num_layers=3, temp_path=DTW_TEMP_PATH, reuse=False)
+    dtw_time = time.time() - t1
+    t1 = time.time()
+    s2v_sketch = Struc2Vec(nx_rec_g, n_users, workers=WORKERS, verbose=40, opt3_num_layers=3, temp_path=SKETCH_TEMP_PATH, reuse=False, engine='sketch', sketch_neighbors=SKETCH_NEIGHBORS)
+    sketch_time = time.time() - t1
+    # the ordered degree list (BFS per node) is the stage both engines share, timed once more on its own
+    t1 = time.time()
+    s2v_sketch._compute_ordered_degreelist(3, WORKERS, 40)
+    degreelist_time = time.time() - t1
+    t1 = time.time()
+    sketch_graphs = s2v_sketch.get_pruned_struc_graph(None)
+    prune_time = time.time() - t1
+    dtw_graphs = s2v_dtw.get_pruned_struc_graph(None)
+
+    print('==================================================')
+    print('end to end build time (s): dtw %.1f, sketch %.1f, prune %.1f' % (dtw_time, sketch_time, prune_time))
+    print('degree list stage (s, in both builds): %.1f, similarity stage (s): dtw %.1f, sketch %.1f' % (
+        degreelist_time, dtw_time - degreelist_time, sketch_time - degreelist_time))
+    print('layer  sketch_pairs  dtw_pairs  precision  recall  spearman  sketch_edges  dtw_edges')
+    for layer, res in compare_layers(s2v_sketch.layers_sim_scores, s2v_dtw.layers_sim_scores).items():
+        sketch_edges = sketch_graphs[layer].number_of_edges() if layer < len(sketch_graphs) else 0
+        dtw_edges = dtw_graphs[layer].number_of_edges() if layer < len(dtw_graphs) else 0
+        print('%d  %d  %d  %.4f  %.4f  %.4f  %d  %d' % (layer, res['pairs'], res['reference_pairs'], res['precision'], res['recall'], res['spearman'], sketch_edges, dtw_edges))
@@ -0,0 +1,108 @@
+import os
+import time
+import logging
+
+import torch
+import torch.multiprocessing as mp
+from torch.utils.data import DataLoader
+
+from cf_dataset import DataOnlyCF, SharedDataCF, build_struc_graph
+from gcn_model import CFGCN
+from sampler import BatchPrefetcher, get_neg_sampler
+import script_new
+
+CORES_PER_RUN = 4
+N_RUNS = max(1, (os.cpu_count() or 1) // CORES_PER_RUN) # concurrent runs
+BASE_CONFIG = {
+    'LR': script_new.LR, 'EDIM': script_new.EDIM, 'LAYERS': script_new.LAYERS, 'LAM': script_new.LAM,
+    'M3LAYERS': script_new.M3LAYERS, 'CMODE': script_new.CMODE, 'ATYPE': script_new.ATYPE, 'WFUSE': script_new.WFUSE,
+    'NEG_SAMPLER': script_new.NEG_SAMPLER, 'NEG_ALPHA': script_new.NEG_ALPHA, 'N_NEG': script_new.N_NEG, 'NEG_LOSS': script_new.NEG_LOSS,
+    'GCN_EPOCH': script_new.GCN_EPOCH, 'STRUC_STEP': script_new.STRUC_STEP, 'ITRA_STEP': script_new.ITRA_STEP,
+}
+SWEEP = [
+    {'ATYPE': 'gcn'},
+    {'ATYPE': 'graphsage'},
+    {'ATYPE': 'bi-interaction'},
+    {'ATYPE': 'graphsage', 'M3LAYERS': [-2, -1]},
+    {'ATYPE': 'graphsage', 'CMODE': 1},
+    {'ATYPE': 'graphsage', 'WFUSE': True},
+    {'ATYPE': 'graphsage', 'LR': 0.0005},
+    {'ATYPE': 'graphsage', 'LAM': 1e-3},
+    {'ATYPE': 'graphsage', 'NEG_SAMPLER': 'popularity'},
+    {'ATYPE': 'graphsage', 'NEG_SAMPLER': 'in-batch'},
+    {'ATYPE': 'graphsage', 'N_NEG': 8, 'NEG_LOSS': 'softmax'},
+]
+
+# loaded once in the parent, the arrays go to the spawned workers in torch shared memory (no fork after torch / OMP started
+# its threads, no pickled copy of the python dicts), each worker maps them in init_worker
+data_set = None
+all_struc_Gs = None
+pretrained_data = None
+
+
+def init_worker(core_slots, data_arrays, struc_edges, shared_pretrained_data):
+    # pin each worker process to its own CORES_PER_RUN cores
+    global data_set, all_struc_Gs, pretrained_data
+    slot = core_slots.get()
+    cores = list(range(slot * CORES_PER_RUN, (slot + 1) * CORES_PER_RUN))
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(CORES_PER_RUN)
+    data_set = SharedDataCF(data_arrays)
+    n_nodes = data_set.get_user_num() + data_set.get_item_num()
+    all_struc_Gs = [build_struc_graph(n_nodes, src, dst, weight) for src, dst, weight in struc_edges]
+    pretrained_data = shared_pretrained_data
+
+
+def run_config(run_id, config):
+    time_start = time.time()
+    logging.info('run ' + str(run_id) + ' start: ' + str(config))
+    torch.manual_seed(2020 + run_id)
+    n_users = data_set.get_user_num()
+    n_items = data_set.get_item_num()
+    struc_Gs = [all_struc_Gs[index] for index in config['M3LAYERS']]
+    model = CFGCN(n_users, n_items, data_set.get_interaction_graph(), struc_Gs=struc_Gs, embed_dim=config['EDIM'], n_layers=config['LAYERS'],
+                  lam=config['LAM'], weighted_fuse=config['WFUSE'], combine_mode=config['CMODE'], aggregator_type=config['ATYPE'], fuse_struc=True, neg_loss=config['NEG_LOSS'])
+    if pretrained_data is not None:
+        model.load_pretrained_embedding(pretrained_data.clone())
+    # daemonic pool workers can not fork DataLoader workers
+    neg_sampler = get_neg_sampler(config['NEG_SAMPLER'], data_set.get_train_data(), n_items, config['NEG_ALPHA'])
+    train_data_loader = BatchPrefetcher(data_set.get_train_data(), n_items, batch_size=2048, n_prefetch=script_new.PREFETCH or 4, neg_sampler=neg_sampler, n_neg=config['N_NEG'])
+    evaluate_data_loader = DataLoader(data_set.get_evaluate_dataset(), batch_size=4096, num_workers=0)
+    test_data_loader = DataLoader(data_set.get_test_dataset(), batch_size=4096 * 8, num_workers=0)
+    optimizer = torch.optim.Adam(params=model.parameters(), lr=config['LR'])
+    precision, recall, ndcg_score = script_new.train_gcn(data_set, model, optimizer, train_data_loader, evaluate_data_loader, test_data_loader,
+                                                         gcn_epoch=config['GCN_EPOCH'], struc_step=config['STRUC_STEP'], itra_step=config['ITRA_STEP'])
+    train_data_loader.close()
+    return run_id, precision, recall, ndcg_score, time.time() - time_start
+
+
+if __name__ == "__main__":
+    data_set = DataOnlyCF('data_for_test/gowalla/train.txt', 'data_for_test/gowalla/test.txt')
+    t1 = time.time()
+    all_struc_Gs = data_set.build_struc_graphs(mode=3, mode3_layers=None) # every layer, configs pick theirs by index
+    print('build_struc_graphs time:', time.time() - t1)
+    if script_new.USE_PRETRAIN:
+        pretrained_data, saved_args = torch.load(script_new.PRETRAIN_VERSION + '.pth', 'cpu')
+
+    data_arrays = data_set.share_arrays()
+    struc_edges = [[t.clone().share_memory_() for t in g.all_edges(order='eid') + (g.edata['weight'], )] for g in all_struc_Gs]
+    if pretrained_data is not None:
+        pretrained_data.share_memory_()
+
+    configs = [dict(BASE_CONFIG, **c) for c in SWEEP]
+    ctx = mp.get_context('spawn')
+    core_slots = ctx.Queue()
+    for slot in range(N_RUNS):
+        core_slots.put(slot)
+    with ctx.Pool(N_RUNS, initializer=init_worker, initargs=(core_slots, data_arrays, struc_edges, pretrained_data)) as pool:
+        results = pool.starmap(run_config, enumerate(configs))
+
+    keys = sorted(set(k for sweep_config in SWEEP for k in sweep_config)) # swept columns only
+    lines = ['\t'.join(['run'] + keys + ['precision', 'recall', 'ndcg', 'time(s)'])]
+    for run_id, precision, recall, ndcg_score, run_time in sorted(results):
+        lines.append('\t'.join([str(run_id)] + [str(configs[run_id][k]) for k in keys] + ['%.5f' % precision, '%.5f' % recall, '%.5f' % ndcg_score, '%.0f' % run_time]))
+    table = '\n'.join(lines)
+    print(table)
+    with open(time.strftime('%Y%m%d_%H%M', time.localtime(time.time())) + '_sweep.tsv', 'w') as f:
+        f.write(table + '\n')
@@ -0,0 +1,51 @@
+import time
+
+import numpy as np
+import networkx as nx
+import torch
+
+from cf_dataset import DataOnlyCF
+from gcn_model import CFGCN
+from sampler import BatchPrefetcher
+from s2vec.struc2vec import Struc2Vec
+import script_lgcn
+
+EDIM = 64
+LAYERS = 3
+LAM = 1e-4
+LR = 0.001
+EPOCH = 50
+NUM_WALKS = 10
+WALK_LENGTH = 80
+STAY_PROB = 0.3
+WORKERS = 4
+
+
+if __name__ == "__main__":
+    data_set = DataOnlyCF('data_for_test/gowalla/train.txt', 'data_for_test/gowalla/test.txt')
+    n_users = data_set.get_user_num()
+    n_items = data_set.get_item_num()
+    train_data = data_set.get_train_data()
+    nx_rec_g = nx.Graph()
+    nx_rec_g.add_nodes_from(range(n_users + n_items))
+    nx_rec_g.add_edges_from(np.concatenate((train_data[0].reshape(-1, 1), train_data[1].reshape(-1, 1) + n_users), 1))
+    s2v = Struc2Vec(nx_rec_g, n_users, workers=WORKERS, verbose=40, opt3_num_layers=3, reuse=True)
+
+    t1 = time.time()
+    walk_embedding = s2v.get_walk_embedding(embed_dim=EDIM, num_walks=NUM_WALKS, walk_length=WALK_LENGTH, stay_prob=STAY_PROB, workers=WORKERS)
+    print('struc2vec walk embedding time:', time.time() - t1)
+    # same dump format as the pretrain checkpoints, loadable by script_new with PRETRAIN_VERSION = 'struc2vec_walk'
+    torch.save((walk_embedding, ('struc2vec_walk', EDIM, None)), 'struc2vec_walk.pth')
+
+    # structural embedding as the initial table of the lightgcn
+    model = CFGCN(n_users, n_items, data_set.get_interaction_graph(), embed_dim=EDIM, n_layers=LAYERS, lam=LAM)
+    model.load_pretrained_embedding(walk_embedding)
+    train_data_loader = BatchPrefetcher(train_data, n_items, batch_size=2048)
+    test_data_loader = torch.utils.data.DataLoader(data_set.get_test_dataset(), batch_size=4096, num_workers=2)
+    optimizer = torch.optim.Adam(params=model.parameters(), lr=LR)
+    script_lgcn.test(data_set, model, test_data_loader)
+    for epoch_i in range(EPOCH):
+        print('epoch', epoch_i + 1, '/', EPOCH)
+        script_lgcn.train(model, train_data_loader, optimizer)
+    train_data_loader.close()
+    script_lgcn.test(data_set, model, test_data_loader)
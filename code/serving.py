@@ -0,0 +1,362 @@
+import asyncio
+import json
+import threading
+import time
+from collections import deque, OrderedDict
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+import torch
+
+from gcn_model import CFGCN
+
+
+class TopKCache():
+
+    def __init__(self, max_bytes=64 * 2 ** 20, ttl=None):
+        # LRU of (user, model version, k, exclude_seen) -> top-k items & scores, ttl in seconds (None never expires)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict() # least recently used first
+        self.user_keys = {} # user -> keys of the user, for invalidation on new interactions
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock() # shared by the event loop and the scoring thread
+
+    def entry_bytes(self, items, scores):
+        return items.nbytes + scores.nbytes + 256 # arrays + rough key / tuple / dict slot overhead
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.ttl is not None and time.time() - entry[2] > self.ttl:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0], entry[1]
+
+    def put(self, key, items, scores):
+        size = self.entry_bytes(items, scores)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (items, scores, time.time())
+            self.user_keys.setdefault(key[0], set()).add(key)
+            self.n_bytes += size
+            while self.n_bytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+
+    def _remove(self, key):
+        items, scores, time_insert = self.entries.pop(key)
+        self.n_bytes -= self.entry_bytes(items, scores)
+        keys = self.user_keys[key[0]]
+        keys.discard(key)
+        if len(keys) == 0:
+            del self.user_keys[key[0]]
+
+    def invalidate_users(self, users):
+        with self.lock:
+            for user_id in users:
+                for key in list(self.user_keys.get(int(user_id), ())):
+                    self._remove(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.user_keys.clear()
+            self.n_bytes = 0
+
+    def stats(self):
+        n_lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / n_lookups if n_lookups > 0 else 0.0,
+                'entries': len(self.entries), 'cache_mb': self.n_bytes / 2 ** 20}
+
+
+class Recommender():
+
+    def __init__(self, users_emb, items_emb, train_csr, version=0, cache=None):
+        # final embeddings are computed once, a request only costs a (batch, n_items) matmul + topk
+        self.train_csr = train_csr
+        self.cache = cache
+        self.version = version
+        self.set_embedding(users_emb, items_emb)
+
+    def set_embedding(self, users_emb, items_emb):
+        self.users_emb = users_emb.float().contiguous()
+        self.items_emb = items_emb.float().contiguous()
+        self.n_users = self.users_emb.shape[0]
+        self.n_items = self.items_emb.shape[0]
+
+    def update_embedding(self, users_emb, items_emb, version=None):
+        # new checkpoint: entries of the old version can never be hit again, drop them all
+        self.set_embedding(users_emb, items_emb)
+        self.version = self.version + 1 if version is None else version
+        if self.cache is not None:
+            self.cache.clear()
+
+    def update_interactions(self, train_csr, users):
+        # seen items of users changed (e.g. DataOnlyCF.append_interactions)
+        self.train_csr = train_csr
+        if self.cache is not None:
+            self.cache.invalidate_users(users)
+
+    def cached(self, user_id, k, exclude_seen=True):
+        if self.cache is None:
+            return None
+        return self.cache.get((int(user_id), self.version, min(k, self.n_items), exclude_seen))
+
+    def recommend(self, users, k, exclude_seen=True, lookup=True):
+        # users: int64 array, cached users are served from the cache, the others in one matmul
+        k = min(k, self.n_items)
+        version = self.version
+        top_items = np.zeros((len(users), k), dtype=np.int64)
+        top_scores = np.zeros((len(users), k), dtype=np.float32)
+        miss = np.ones(len(users), dtype=bool)
+        if self.cache is not None and lookup:
+            for i, user_id in enumerate(users):
+                result = self.cache.get((int(user_id), version, k, exclude_seen))
+                if result is not None:
+                    top_items[i], top_scores[i] = result
+                    miss[i] = False
+        miss_users = users[miss]
+        if len(miss_users) > 0:
+            items, scores = self.score(miss_users, k, exclude_seen)
+            top_items[miss] = items
+            top_scores[miss] = scores
+            if self.cache is not None:
+                for user_id, user_items, user_scores in zip(miss_users, items, scores):
+                    self.cache.put((int(user_id), version, k, exclude_seen), user_items, user_scores)
+        return top_items, top_scores
+
+    def score(self, users, k, exclude_seen=True):
+        with torch.no_grad():
+            scores = torch.matmul(self.users_emb[torch.from_numpy(users)], self.items_emb.t())
+            if exclude_seen:
+                seen = self.train_csr[users]
+                seen_rows = np.repeat(np.arange(len(users)), np.diff(seen.indptr))
+                scores[torch.from_numpy(seen_rows), torch.from_numpy(seen.indices.astype(np.int64))] = -np.inf
+            top_scores, top_items = torch.topk(scores, k=k)
+        return top_items.numpy(), top_scores.numpy()
+
+
+def compute_final_embedding(data_set, checkpoint_path, n_layers=3):
+    # checkpoint: the (embedding, saved_args) dump of script_new, the interaction graph path has no other parameter
+    pretrained_data, saved_args = torch.load(checkpoint_path, 'cpu')
+    model = CFGCN(data_set.get_user_num(), data_set.get_item_num(), data_set.get_interaction_graph(), embed_dim=pretrained_data.shape[1], n_layers=n_layers)
+    model.load_pretrained_embedding(pretrained_data)
+    model.eval()
+    with torch.no_grad():
+        return model.get_final_embedding(use_struc=False)
+
+
+def load_recommender(data_set, checkpoint_path, n_layers=3, cache=None):
+    users_emb, items_emb = compute_final_embedding(data_set, checkpoint_path, n_layers)
+    return Recommender(users_emb, items_emb, data_set.get_train_csr(), cache=cache)
+
+
+class MicroBatcher():
+
+    def __init__(self, recommender, max_batch_size=256, max_wait_ms=2.0, n_latency=100000):
+        # requests arriving within max_wait_ms of the first queued one are scored together
+        self.recommender = recommender
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = asyncio.Queue()
+        self.latencies = deque(maxlen=n_latency) # seconds, enqueue to result
+        self.batch_sizes = deque(maxlen=n_latency)
+        self.n_served = 0
+        self.time_start = time.time()
+
+    async def recommend(self, user_id, k, exclude_seen=True):
+        time_enqueue = time.perf_counter()
+        result = self.recommender.cached(user_id, k, exclude_seen) # hits skip the batching delay
+        if result is not None:
+            self.latencies.append(time.perf_counter() - time_enqueue)
+            self.n_served += 1
+            return result[0].tolist(), result[1].tolist()
+        future = asyncio.get_event_loop().create_future()
+        await self.queue.put((user_id, k, exclude_seen, future, time_enqueue))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # one matmul per (k, exclude_seen) group, usually a single one
+            groups = {}
+            for request in batch:
+                groups.setdefault((request[1], request[2]), []).append(request)
+            for (k, exclude_seen), group in groups.items():
+                users = np.array([request[0] for request in group], dtype=np.int64)
+                # torch releases the GIL, the event loop keeps accepting requests meanwhile
+                try:
+                    top_items, top_scores = await loop.run_in_executor(None, self.recommender.recommend, users, k, exclude_seen, False)
+                except Exception as e:
+                    for request in group:
+                        if not request[3].cancelled():
+                            request[3].set_exception(e)
+                    continue
+                time_end = time.perf_counter()
+                for i, (user_id, request_k, request_exclude, future, time_enqueue) in enumerate(group):
+                    if not future.cancelled():
+                        future.set_result((top_items[i].tolist(), top_scores[i].tolist()))
+                    self.latencies.append(time_end - time_enqueue)
+            self.batch_sizes.append(len(batch))
+            self.n_served += len(batch)
+
+    def stats(self):
+        latencies = np.array(self.latencies) * 1000
+        result = {'served': self.n_served, 'throughput': self.n_served / (time.time() - self.time_start)}
+        if self.recommender.cache is not None:
+            result.update(self.recommender.cache.stats())
+        if len(latencies) > 0:
+            result.update({'p50_ms': float(np.percentile(latencies, 50)), 'p90_ms': float(np.percentile(latencies, 90)),
+                           'p99_ms': float(np.percentile(latencies, 99))})
+        if len(self.batch_sizes) > 0:
+            result['mean_batch_size'] = float(np.mean(self.batch_sizes))
+        return result
+
+    def reset_stats(self):
+        self.latencies.clear()
+        self.batch_sizes.clear()
+        self.n_served = 0
+        self.time_start = time.time()
+        if self.recommender.cache is not None:
+            self.recommender.cache.hits = 0
+            self.recommender.cache.misses = 0
+
+
+async def read_request(reader):
+    # minimal HTTP/1.1: request line + headers, GET only, no body
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    while True:
+        header = await reader.readline()
+        if header in (b'\r\n', b'\n', b''):
+            break
+    parts = request_line.decode('latin-1').split()
+    if len(parts) < 2:
+        return None, None # malformed request line, answered with 400
+    return parts[0], parts[1]
+
+
+def finite_or_none(body):
+    # JSON has no Infinity / NaN (e.g. -inf scores of masked seen items when k exceeds the unseen items), they become null
+    if isinstance(body, float):
+        return body if np.isfinite(body) else None
+    if isinstance(body, dict):
+        return {key: finite_or_none(value) for key, value in body.items()}
+    if isinstance(body, (list, tuple)):
+        return [finite_or_none(value) for value in body]
+    return body
+
+
+def write_response(writer, status, body):
+    data = json.dumps(finite_or_none(body), allow_nan=False).encode()
+    writer.write(('HTTP/1.1 ' + status + '\r\nContent-Type: application/json\r\nContent-Length: ' + str(len(data)) + '\r\n\r\n').encode() + data)
+
+
+class RecommendServer():
+    # GET /recommend?user=<id>&k=<k>[&seen=1]   GET /similar?item=<id>&k=<k>   GET /stats   GET /reset
+
+    def __init__(self, batcher, default_k=20, user_map=None, item_map=None, item_index=None):
+        # with id maps (DataOnlyCF remap_ids) requests and responses use the raw ids of the data files
+        # item_index: precomputed ItemNeighbors of /similar, a plain row lookup without batching
+        self.batcher = batcher
+        self.default_k = default_k
+        self.user_map = user_map
+        self.item_map = item_map
+        self.item_index = item_index
+
+    def similar(self, query):
+        if self.item_index is None:
+            return '404 Not Found', {'error': 'no item index loaded'}
+        try:
+            item_id = int(query['item'][0])
+            k = int(query.get('k', [self.default_k])[0])
+        except (KeyError, ValueError):
+            return '400 Bad Request', {'error': 'need integer item and k'}
+        dense_item_id = item_id if self.item_map is None else self.item_map.to_dense([item_id])[0].item()
+        if dense_item_id < 0 or dense_item_id >= self.item_index.n_items or k <= 0:
+            return '400 Bad Request', {'error': 'item or k out of range'}
+        items, scores = self.item_index.neighbors(dense_item_id, k)
+        if self.item_map is not None:
+            items = self.item_map.to_raw(items)
+        return '200 OK', {'item': item_id, 'items': items.tolist(), 'scores': scores.tolist()}
+
+    async def handle(self, reader, writer):
+        # keep-alive, one connection serves sequential requests
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                method, target = request
+                if target is None:
+                    write_response(writer, '400 Bad Request', {'error': 'malformed request line'})
+                    await writer.drain()
+                    continue
+                url = urlparse(target)
+                query = parse_qs(url.query)
+                if url.path == '/recommend':
+                    try:
+                        user_id = int(query['user'][0])
+                        k = int(query.get('k', [self.default_k])[0])
+                        exclude_seen = int(query.get('seen', [0])[0]) == 0 # seen=1 keeps train items
+                    except (KeyError, ValueError):
+                        write_response(writer, '400 Bad Request', {'error': 'need integer user and k'})
+                    else:
+                        dense_user_id = user_id if self.user_map is None else self.user_map.to_dense([user_id])[0].item()
+                        if dense_user_id < 0 or dense_user_id >= self.batcher.recommender.n_users or k <= 0:
+                            write_response(writer, '400 Bad Request', {'error': 'user or k out of range'})
+                        else:
+                            try:
+                                items, scores = await self.batcher.recommend(dense_user_id, k, exclude_seen)
+                            except Exception as e:
+                                write_response(writer, '500 Internal Server Error', {'error': repr(e)})
+                            else:
+                                if self.item_map is not None:
+                                    items = self.item_map.to_raw(items).tolist()
+                                write_response(writer, '200 OK', {'user': user_id, 'items': items, 'scores': scores})
+                elif url.path == '/similar':
+                    write_response(writer, *self.similar(query))
+                elif url.path == '/stats':
+                    write_response(writer, '200 OK', self.batcher.stats())
+                elif url.path == '/reset':
+                    self.batcher.reset_stats()
+                    write_response(writer, '200 OK', {})
+                else:
+                    write_response(writer, '404 Not Found', {'error': 'unknown path ' + url.path})
+                await writer.drain()
+        except (ConnectionResetError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=8000):
+        batch_task = asyncio.ensure_future(self.batcher.run())
+        server = await asyncio.start_server(self.handle, host, port)
+        print('serving on http://' + host + ':' + str(port))
+        try:
+            await batch_task # the batcher runs until cancelled (or fails), the server lives as long
+        finally:
+            server.close()
+            await server.wait_closed()
+            batch_task.cancel()